@@ -18,7 +18,6 @@ import dbus
 import signal
 import logging
 
-import ephem
 
 import queue
 from multiprocessing import Queue
@@ -36,6 +35,9 @@ from . import constants
 from .image import ImageWorker
 from .video import VideoWorker
 from .uploader import FileUploader
+from .framering import IndiAllSkyFrameRing
+from .imageQueue import IndiAllSkyImageQueue
+from .ephemeris import IndiAllSkyEphemeris
 
 from .exceptions import TimeOutException
 from .exceptions import TemperatureException
@@ -137,11 +139,21 @@ class IndiAllSky(object):
 
         self.update_time_offset = None  # when time needs to be updated, this will be the offset
 
-        self.image_q = Queue()
+        # bounded, frames are dropped or exposures paused when the ImageWorker falls behind
+        self.image_q = IndiAllSkyImageQueue(
+            max_depth=self.config.get('IMAGE_QUEUE_MAX', 10),
+            policy=self.config.get('IMAGE_QUEUE_POLICY', 'drop_oldest'),
+        )
         self.image_error_q = Queue()
         self.image_worker = None
         self.image_worker_idx = 0
 
+        self.frame_ring = None  # optional shared memory transport for frames
+
+        # sun and moon positions are computed once by this process and shared with the workers
+        self.ephemeris_table = IndiAllSkyEphemeris.createSharedTable()
+        self.ephemeris = IndiAllSkyEphemeris(self.config, self.latitude_v, self.longitude_v, shared_table=self.ephemeris_table, owner=True)
+
         self.video_q = Queue()
         self.video_error_q = Queue()
         self.video_worker = None
@@ -631,6 +643,9 @@ class IndiAllSky(object):
         self._sync_camera(camera, camera_metadata)
 
 
+        self._createFrameRing(camera_metadata['width'], camera_metadata['height'])
+
+
         try:
             # Disable debugging
             self.indiclient.disableDebugCcd()
@@ -781,6 +796,8 @@ class IndiAllSky(object):
             self.sensortemp_v,
             self.night_v,
             self.moonmode_v,
+            frame_ring=self.frame_ring,
+            ephemeris_table=self.ephemeris_table,
         )
         self.image_worker.start()
 
@@ -813,6 +830,58 @@ class IndiAllSky(object):
         self.image_worker.join()
 
 
+    def _createFrameRing(self, width, height):
+        shm_slots = int(self.config.get('IMAGE_SHM_SLOTS', 0))
+        if not shm_slots:
+            return
+
+
+        if self.config.get('CAMERA_INTERFACE', 'indi') not in ('indi', 'indi_passive'):
+            # libcamera frames are written to disk by the capture process
+            logger.warning('Shared memory frame transport is only supported with INDI cameras')
+            return
+
+
+        if self.frame_ring:
+            # already allocated
+            self.indiclient.frame_ring = self.frame_ring
+            self.image_q.frame_ring = self.frame_ring
+            return
+
+
+        if not IndiAllSkyFrameRing.available():
+            logger.error('Shared memory frame transport requires python 3.8 or newer')
+            return
+
+
+        # sized for 16-bit mono/bayer data, larger frames are spooled to disk
+        slot_size = width * height * 2
+
+        frame_ring = IndiAllSkyFrameRing(shm_slots, slot_size)
+
+        try:
+            frame_ring.create()
+        except OSError as e:
+            logger.error('Unable to allocate shared memory: %s', str(e))
+            frame_ring.close()
+            return
+
+
+        self.frame_ring = frame_ring
+        self.indiclient.frame_ring = frame_ring
+        self.image_q.frame_ring = frame_ring  # slots of dropped frames are released
+
+
+    def _closeFrameRing(self):
+        if not self.frame_ring:
+            return
+
+        logger.info('Releasing shared memory frame slots')
+        self.frame_ring.close()
+        self.frame_ring = None
+        self.image_q.frame_ring = None
+
+
     def _startVideoWorker(self):
         if self.video_worker:
             if self.video_worker.is_alive():
@@ -1059,8 +1128,7 @@ class IndiAllSky(object):
                         ### Generate timelapse at end of night
                         yesterday_ref = datetime.now() - timedelta(days=1)
                         timespec = yesterday_ref.strftime('%Y%m%d')
-                        self._generateNightTimelapse(timespec, self.camera_id)
-                        self._generateNightKeogram(timespec, self.camera_id)
+                        self._generateProducts(timespec, self.camera_id, True)
                         self._uploadAllskyEndOfNight(self.camera_id)
                         self._systemHealthCheck()
 
@@ -1068,8 +1136,7 @@ class IndiAllSky(object):
                         ### Generate timelapse at end of day
                         today_ref = datetime.now()
                         timespec = today_ref.strftime('%Y%m%d')
-                        self._generateDayTimelapse(timespec, self.camera_id)
-                        self._generateDayKeogram(timespec, self.camera_id)
+                        self._generateProducts(timespec, self.camera_id, False)
                         self._systemHealthCheck()
 
 
@@ -1101,6 +1168,8 @@ class IndiAllSky(object):
                         self._stopVideoWorker(terminate=self._terminate)
                         self._stopFileUploadWorkers(terminate=self._terminate)
 
+                        self._closeFrameRing()
+
                         self.indiclient.disableCcdCooler()  # safety
 
                         self.indiclient.disconnectServer()
@@ -1187,6 +1256,8 @@ class IndiAllSky(object):
                         self._stopVideoWorker(terminate=self._terminate)
                         self._stopFileUploadWorkers(terminate=self._terminate)
 
+                        self._closeFrameRing()
+
                         self.indiclient.disableCcdCooler()  # safety
 
                         self.indiclient.disconnectServer()
@@ -1244,6 +1315,13 @@ class IndiAllSky(object):
 
 
                     if now >= next_frame_time:
+                        if self.image_q.backlogged():
+                            # ImageWorker is behind, wait before starting the next exposure
+                            logger.warning('Image queue depth %d, delaying exposure', self.image_q.qsize())
+                            next_frame_time = now + 1.0
+                            continue
+
+
                         #######################
                         # Start next exposure #
                         #######################
@@ -1572,34 +1650,22 @@ class IndiAllSky(object):
 
 
     def detectNight(self):
-        obs = ephem.Observer()
-        obs.lon = math.radians(self.longitude_v.value)
-        obs.lat = math.radians(self.latitude_v.value)
-        obs.date = datetime.utcnow()  # ephem expects UTC dates
+        position = self.ephemeris.position(datetime.utcnow())  # ephemeris table is indexed by UTC
 
-        sun = ephem.Sun()
-        sun.compute(obs)
+        logger.info('Sun altitude: %0.2f', position['sun_alt'])
 
-        logger.info('Sun altitude: %s', sun.alt)
-
-        self.night = sun.alt < self.night_sun_radians  # boolean
+        self.night = math.radians(position['sun_alt']) < self.night_sun_radians  # boolean
 
 
     def detectMoonMode(self):
         # detectNight() should be run first
-        obs = ephem.Observer()
-        obs.lon = math.radians(self.longitude_v.value)
-        obs.lat = math.radians(self.latitude_v.value)
-        obs.date = datetime.utcnow()  # ephem expects UTC dates
-
-        moon = ephem.Moon()
-        moon.compute(obs)
+        position = self.ephemeris.position(datetime.utcnow())  # ephemeris table is indexed by UTC
 
-        moon_phase = moon.moon_phase * 100.0
+        moon_phase = position['moon_phase']
 
-        logger.info('Moon altitude: %s, phase %0.1f%%', moon.alt, moon_phase)
+        logger.info('Moon altitude: %0.2f, phase %0.1f%%', position['moon_alt'], moon_phase)
         if self.night:
-            if moon.alt >= self.night_moonmode_radians:
+            if math.radians(position['moon_alt']) >= self.night_moonmode_radians:
                 if moon_phase >= self.config['NIGHT_MOONMODE_PHASE']:
                     logger.info('Moon Mode conditions detected')
                     self.moonmode = True
@@ -1816,6 +1882,46 @@ class IndiAllSky(object):
         self.video_q.put({'task_id' : task.id})
 
 
+    def _generateProducts(self, timespec, camera_id, night, task_state=TaskQueueState.QUEUED):
+        # timelapse, keogram and star trails are generated by a single task
+        if not self.config.get('TIMELAPSE_ENABLE', True):
+            logger.warning('Timelapse creation disabled')
+            return
+
+
+        camera = IndiAllSkyDbCameraTable.query\
+            .filter(IndiAllSkyDbCameraTable.id == camera_id)\
+            .one()
+
+
+        if night:
+            timeofday = 'night'
+        else:
+            timeofday = 'day'
+
+        img_day_folder = self.image_dir.joinpath('ccd_{0:s}'.format(camera.uuid), '{0:s}'.format(timespec), timeofday)
+
+        logger.warning('Generating %s time products for %s camera %d', timeofday, timespec, camera.id)
+
+        jobdata = {
+            'action'      : 'generateProducts',
+            'timespec'    : timespec,
+            'img_folder'  : str(img_day_folder),
+            'night'       : night,
+            'camera_id'   : camera.id,
+        }
+
+        task = IndiAllSkyDbTaskQueueTable(
+            queue=TaskQueueQueue.VIDEO,
+            state=task_state,
+            data=jobdata,
+        )
+        db.session.add(task)
+        db.session.commit()
+
+        self.video_q.put({'task_id' : task.id})
+
+
     def shoot(self, exposure, sync=True, timeout=None):
         logger.info('Taking %0.8f s exposure (gain %d)', exposure, self.gain_v.value)
 
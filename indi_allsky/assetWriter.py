@@ -0,0 +1,162 @@
+import os
+import io
+import json
+import tempfile
+import shutil
+from pathlib import Path
+import time
+import logging
+import traceback
+
+from threading import Thread
+from threading import current_thread
+import queue
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyAssetWriter(object):
+    """Atomic publishing of image files.
+
+    Files are written to a hidden temporary file in the destination folder
+    and renamed into place, readers never see a partial file.  The latest
+    file is a hard link to the published file instead of a copy.
+
+    Queued writes and fsync run on a single background thread, the queue is
+    bounded so a slow disk applies back pressure instead of using memory.
+    """
+
+    def __init__(self, config, max_queue=4):
+        self.config = config
+
+        self._q = queue.Queue(maxsize=max_queue)
+        self._thread = None
+
+
+    @staticmethod
+    def tempFile(folder):
+        # temporary file on the same filesystem as the destination
+        folder_p = Path(folder)
+        if not folder_p.exists():
+            folder_p.mkdir(mode=0o755, parents=True)
+
+        fd, tmpfile_name = tempfile.mkstemp(dir=str(folder_p), prefix='.', suffix='.tmp')
+        os.close(fd)
+
+        return Path(tmpfile_name)
+
+
+    def publish(self, tmpfile_p, filename_p, latest_p=None, replace=False):
+        # returns False if the file was not published
+        tmpfile_p.chmod(0o644)
+
+        if not replace and filename_p.exists():
+            logger.error('File exists: %s (skipping)', filename_p)
+            tmpfile_p.unlink()
+            return False
+
+
+        os.replace(str(tmpfile_p), str(filename_p))
+
+
+        if latest_p:
+            self.link(filename_p, latest_p)
+
+
+        self.submit(self._fsync, filename_p)
+
+        return True
+
+
+    def link(self, filename_p, latest_p):
+        link_p = self.tempFile(latest_p.parent)
+        link_p.unlink()  # only the unique name is needed
+
+        try:
+            os.link(str(filename_p), str(link_p))
+        except OSError as e:
+            # not supported or not the same filesystem
+            logger.warning('Unable to link %s: %s', latest_p, str(e))
+            shutil.copy2(str(filename_p), str(link_p))
+
+        os.replace(str(link_p), str(latest_p))
+
+
+    def writeJson(self, filename_p, data):
+        tmpfile_p = self.tempFile(filename_p.parent)
+
+        with io.open(str(tmpfile_p), 'w') as f_tmp:
+            json.dump(data, f_tmp, indent=4)
+            f_tmp.flush()
+
+        self.publish(tmpfile_p, filename_p, replace=True)
+
+
+    def submit(self, func, *args):
+        if current_thread() is self._thread:
+            # already on the writer thread
+            func(*args)
+            return
+
+        if isinstance(self._thread, type(None)) or not self._thread.is_alive():
+            self._thread = Thread(target=self._run, name='AssetWriter', daemon=True)
+            self._thread.start()
+
+        self._q.put((func, args))  # blocks when the queue is full
+
+
+    def stop(self):
+        if isinstance(self._thread, type(None)):
+            return
+
+        if not self._thread.is_alive():
+            return
+
+        logger.info('Waiting for asset writer')
+        self._q.put(None)
+        self._thread.join()
+
+
+    def _run(self):
+        while True:
+            task = self._q.get()
+
+            if isinstance(task, type(None)):
+                return
+
+            func, args = task
+
+            task_start = time.time()
+
+            try:
+                func(*args)
+            except Exception:
+                for line in traceback.format_exc().split('\n'):
+                    logger.error('Asset writer exception: %s', line)
+
+            task_elapsed_s = time.time() - task_start
+            if task_elapsed_s > 5.0:
+                logger.warning('Asset writer task took %0.4f s', task_elapsed_s)
+
+
+    def _fsync(self, filename_p):
+        try:
+            fd = os.open(str(filename_p), os.O_RDONLY)
+        except FileNotFoundError:
+            # already removed
+            return
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+        # persist the rename
+        dir_fd = os.open(str(filename_p.parent), os.O_RDONLY)
+
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -110,6 +110,8 @@ class IndiClient(PyIndi.BaseClient):
 
         self._camera_id = None
 
+        self._frame_ring = None
+
         self._ccd_device = None
         self._ctl_ccd_exposure = None
 
@@ -141,6 +143,14 @@ class IndiClient(PyIndi.BaseClient):
     def camera_id(self, new_camera_id):
         self._camera_id = int(new_camera_id)
 
+    @property
+    def frame_ring(self):
+        return self._frame_ring
+
+    @frame_ring.setter
+    def frame_ring(self, new_frame_ring):
+        self._frame_ring = new_frame_ring
+
     @property
     def ccd_device(self):
         return self._ccd_device
@@ -275,6 +285,22 @@ class IndiClient(PyIndi.BaseClient):
         blobfile = io.BytesIO(imgdata)
         hdulist = fits.open(blobfile)
 
+        exp_date = datetime.now()
+
+        ### process data in worker
+        jobdata = {
+            'exposure'    : self._exposure,
+            'exp_time'    : datetime.timestamp(exp_date),  # datetime objects are not json serializable
+            'exp_elapsed' : exposure_elapsed_s,
+            'camera_id'   : self.camera_id,
+            'filename_t'  : self._filename_t,
+        }
+
+
+        if self._queueSharedFrame(hdulist, jobdata):
+            return
+
+
         try:
             f_tmpfile = tempfile.NamedTemporaryFile(mode='w+b', delete=False, suffix='.fit')
             f_tmpfile_p = Path(f_tmpfile.name)
@@ -291,17 +317,7 @@ class IndiClient(PyIndi.BaseClient):
         #elapsed_s = time.time() - start
         #logger.info('Blob downloaded in %0.4f s', elapsed_s)
 
-        exp_date = datetime.now()
-
-        ### process data in worker
-        jobdata = {
-            'filename'    : str(f_tmpfile_p),
-            'exposure'    : self._exposure,
-            'exp_time'    : datetime.timestamp(exp_date),  # datetime objects are not json serializable
-            'exp_elapsed' : exposure_elapsed_s,
-            'camera_id'   : self.camera_id,
-            'filename_t'  : self._filename_t,
-        }
+        jobdata['filename'] = str(f_tmpfile_p)
 
         ### Not using DB task queue to reduce DB I/O
         #with app.app_context():
@@ -320,6 +336,30 @@ class IndiClient(PyIndi.BaseClient):
         self.image_q.put(jobdata)
 
 
+    def _queueSharedFrame(self, hdulist, jobdata):
+        # returns False if the frame needs to be spooled to disk
+        if not self.frame_ring:
+            return False
+
+
+        # hand off the pixel data through shared memory
+        slot = self.frame_ring.put(hdulist[0].data)
+
+        if isinstance(slot, type(None)):
+            # ring is full or the frame is too large
+            return False
+
+
+        jobdata['frame_slot'] = slot
+        jobdata['frame_shape'] = hdulist[0].data.shape
+        jobdata['frame_dtype'] = hdulist[0].data.dtype.newbyteorder('=').str
+        jobdata['frame_header'] = hdulist[0].header.tostring()
+
+        self.image_q.put(jobdata)
+
+        return True
+
+
     def newMessage(self, d, m):
         logger.info("new Message %s", d.messageQueue(m))
 
@@ -64,6 +64,8 @@ class IndiClientPassive(IndiClient):
 
         self._camera_id = None
 
+        self._frame_ring = None
+
         self._ccd_device = None
         self._ctl_ccd_exposure = None
 
@@ -229,6 +231,22 @@ class IndiClientPassive(IndiClient):
         blobfile = io.BytesIO(imgdata)
         hdulist = fits.open(blobfile)
 
+        exp_date = datetime.now()
+
+        ### process data in worker
+        jobdata = {
+            'exposure'    : self._exposure,
+            'exp_time'    : datetime.timestamp(exp_date),  # datetime objects are not json serializable
+            'exp_elapsed' : exposure_elapsed_s,
+            'camera_id'   : self.camera_id,
+            'filename_t'  : self._filename_t,
+        }
+
+
+        if self._queueSharedFrame(hdulist, jobdata):
+            return
+
+
         try:
             f_tmpfile = tempfile.NamedTemporaryFile(mode='w+b', delete=False, suffix='.fit')
             f_tmpfile_p = Path(f_tmpfile.name)
@@ -245,17 +263,7 @@ class IndiClientPassive(IndiClient):
         #elapsed_s = time.time() - start
         #logger.info('Blob downloaded in %0.4f s', elapsed_s)
 
-        exp_date = datetime.now()
-
-        ### process data in worker
-        jobdata = {
-            'filename'    : str(f_tmpfile_p),
-            'exposure'    : self._exposure,
-            'exp_time'    : datetime.timestamp(exp_date),  # datetime objects are not json serializable
-            'exp_elapsed' : exposure_elapsed_s,
-            'camera_id'   : self.camera_id,
-            'filename_t'  : self._filename_t,
-        }
+        jobdata['filename'] = str(f_tmpfile_p)
 
         ### Not using DB task queue to reduce DB I/O
         #with app.app_context():
@@ -0,0 +1,148 @@
+import time
+import cv2
+import numpy
+import logging
+
+from .scnr import IndiAllskyScnr
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyColorLut(object):
+    """Bit depth conversion and color balance with lookup tables.
+
+    convert() reduces the frame to 8 bits, the brightness for exposure
+    control is measured on this frame.  balance() then applies SCNR to the
+    8 bit green plane and the manual and auto white balance factors with a
+    single table per channel.  The steps run in the same order as the
+    separate functions they replace, each table entry rounds and saturates
+    the same way.  Auto white balance gains are estimated from the channel
+    means scaled by the manual factors and rounded to 3 places.  Tables are
+    only rebuilt when their inputs change.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+        self._scnr = IndiAllskyScnr(self.config)
+
+        self._convert_key = None
+        self._convert_lut = None
+
+        self._balance_key = None
+        self._balance_lut = None
+
+
+    def convert(self, data, max_bit_depth):
+        if data.dtype == numpy.uint8:
+            return data.copy()  # later stages modify the image in place
+
+
+        convert_start = time.time()
+
+        div_factor = int((2 ** max_bit_depth) / 255)
+
+        if div_factor != self._convert_key:
+            logger.info('Building conversion LUT: div %d', div_factor)
+
+            values = numpy.floor(numpy.arange(65536, dtype=numpy.float64) / div_factor)
+            self._convert_lut = numpy.clip(values, 0, 255).astype(numpy.uint8)
+            self._convert_key = div_factor
+
+
+        # all channels use the same table
+        image = numpy.take(self._convert_lut, data)
+
+        convert_elapsed_s = time.time() - convert_start
+        logger.info('Resampled image to 8 bits in %0.4f s', convert_elapsed_s)
+
+        return image
+
+
+    def balance(self, image, scnr_algo=None, wb_factors=None, auto_wb=False):
+        # 8 bit color frames only, the image is modified in place
+        if len(image.shape) == 2:
+            return image
+
+
+        balance_start = time.time()
+
+        if scnr_algo:
+            try:
+                scnr_function = getattr(self._scnr, scnr_algo)
+                image[:, :, 1] = scnr_function(image[:, :, 0], image[:, :, 1], image[:, :, 2])
+            except AttributeError:
+                logger.error('Unknown SCNR algorithm: %s', scnr_algo)
+
+
+        if not wb_factors:
+            wb_factors = (1.0, 1.0, 1.0)
+
+
+        if auto_wb:
+            auto_factors = self._autoWbFactors(image, wb_factors)
+        else:
+            auto_factors = (1.0, 1.0, 1.0)
+
+
+        if wb_factors == (1.0, 1.0, 1.0) and auto_factors == (1.0, 1.0, 1.0):
+            return image
+
+
+        lut = self._getBalanceLut(wb_factors, auto_factors)
+
+        # all channels in one call
+        cv2.LUT(image, lut, dst=image)
+
+        balance_elapsed_s = time.time() - balance_start
+        logger.info('Color balance applied in %0.4f s', balance_elapsed_s)
+
+        return image
+
+
+    def _autoWbFactors(self, image, wb_factors):
+        # channel averages as they would be after the manual balance
+        avg_list = list()
+        for i, factor in enumerate(wb_factors):
+            avg_list.append(cv2.mean(image[:, :, i])[0] * factor)
+
+
+        # Find the gain of each channel
+        k = sum(avg_list) / 3
+
+        auto_factors = list()
+        for avg in avg_list:
+            try:
+                auto_factors.append(k / avg)
+            except ZeroDivisionError:
+                auto_factors.append(k / 0.1)
+
+
+        # small changes do not require a new table
+        return tuple(round(x, 3) for x in auto_factors)
+
+
+    def _getBalanceLut(self, wb_factors, auto_factors):
+        balance_key = (tuple(wb_factors), tuple(auto_factors))
+
+        if balance_key == self._balance_key:
+            return self._balance_lut
+
+
+        logger.info('Building color balance LUT: wb %s, auto wb %s', str(wb_factors), str(auto_factors))
+
+        values = numpy.arange(256, dtype=numpy.float64)
+
+        lut = numpy.empty((1, 256, 3), dtype=numpy.uint8)
+        for i, (wb, auto) in enumerate(zip(wb_factors, auto_factors)):
+            # each step rounds and saturates like the cv2 functions it replaces
+            channel = numpy.clip(numpy.rint(values * wb), 0, 255)
+            channel = numpy.clip(numpy.rint(channel * auto), 0, 255)
+            lut[0, :, i] = channel.astype(numpy.uint8)
+
+
+        self._balance_key = balance_key
+        self._balance_lut = lut
+
+        return lut
@@ -65,6 +65,7 @@ class IndiAllSkyConfigBase(object):
         "CCD_EXPOSURE_MAX"     : 15.00000,
         "CCD_EXPOSURE_DEF"     : 0.0,
         "CCD_EXPOSURE_MIN"     : 0.0,
+        "CCD_EXPOSURE_PREDICTIVE" : False,
         "EXPOSURE_PERIOD"      : 15.00000,
         "EXPOSURE_PERIOD_DAY"  : 15.00000,
         "FOCUS_MODE"           : False,
@@ -87,9 +88,12 @@ class IndiAllSkyConfigBase(object):
         "ADU_ROI" : [],
         "DETECT_STARS" : True,
         "DETECT_STARS_THOLD" : 0.6,
+        "DETECT_STARS_PYRAMID" : 0,
         "DETECT_METEORS" : False,
+        "DETECT_METEORS_DIFFERENCE" : False,
         "DETECT_MASK" : "",
         "DETECT_DRAW" : False,
+        "DETECT_FULL_RESOLUTION" : False,
         "LOGO_OVERLAY" : "",
         "SQM_ROI" : [],
         "LOCATION_NAME"      : '',
@@ -109,11 +113,14 @@ class IndiAllSkyConfigBase(object):
         "KEOGRAM_H_SCALE"  : 100,
         "KEOGRAM_V_SCALE"  : 33,
         "KEOGRAM_LABEL"    : True,
+        "KEOGRAM_LIVE"     : False,
         "STARTRAILS_MAX_ADU"    : 50,
         "STARTRAILS_MASK_THOLD" : 190,
         "STARTRAILS_PIXEL_THOLD": 1.0,
+        "STARTRAILS_LIVE"       : False,
         "STARTRAILS_TIMELAPSE"  : True,
         "STARTRAILS_TIMELAPSE_MINFRAMES" : 250,
+        "PRODUCT_WORKERS" : 2,  # keogram, star trail and image decoding processes, 0 or 1 = disabled
         "IMAGE_FILE_TYPE" : "jpg",  # jpg, png, or tif
         "IMAGE_FILE_COMPRESSION" : {
             "jpg"   : 90,
@@ -141,14 +148,22 @@ class IndiAllSkyConfigBase(object):
             "OUTLINE"  : False,
         },
         "IMAGE_SAVE_FITS"     : False,
+        "IMAGE_SAVE_FITS_COMPRESS" : False,
         "IMAGE_EXPORT_RAW"    : "",  # png or tif (or empty)
         "IMAGE_EXPORT_FOLDER" : "/var/www/html/allsky/images/export",
+        "IMAGE_SHM_SLOTS"     : 0,  # 0 = disabled
+        "IMAGE_CALIBRATION_CACHE_MB" : 128,
+        "IMAGE_STAGE_WORKERS" : 0,  # 0 = process in the image worker
+        "QUALITY_GOVERNOR" : False,
+        "IMAGE_QUEUE_MAX" : 10,  # 0 = unbounded
+        "IMAGE_QUEUE_POLICY" : "drop_oldest",  # drop_oldest, drop_newest, or pause
         "IMAGE_STACK_METHOD"  : "maximum",  # maximum, average, or minimum
         "IMAGE_STACK_COUNT"   : 1,
         "IMAGE_STACK_ALIGN"   : False,
         "IMAGE_ALIGN_DETECTSIGMA" : 5,
         "IMAGE_ALIGN_POINTS" : 50,
         "IMAGE_ALIGN_SOURCEMINAREA" : 10,
+        "IMAGE_ALIGN_STARS"   : False,
         "IMAGE_STACK_SPLIT"   : False,
         "IMAGE_EXPIRE_DAYS"     : 30,
         "TIMELAPSE_EXPIRE_DAYS" : 365,
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+import logging
+
+from .flask import db
+
+from .flask.models import IndiAllSkyDbBadPixelMapTable
+from .flask.models import IndiAllSkyDbDarkFrameTable
+
+from sqlalchemy import func
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyDarkCache(object):
+    """LRU cache of merged master darks (bad pixel map + dark).
+
+    Entries are dropped whenever the darkframe or badpixelmap tables change.
+    Many camera states resolve to the same master dark, the mappings are
+    kept in a separate LRU limited to max_matches entries.
+    """
+
+    max_matches = 1000
+
+
+    def __init__(self, config):
+        self.config = config
+
+        self._max_bytes = int(self.config.get('IMAGE_CALIBRATION_CACHE_MB', 128)) * 1024 * 1024
+
+        # master dark data keyed on the matched calibration frames
+        self._master_darks = OrderedDict()
+        self._cache_bytes = 0
+
+        # maps the current camera state to a master dark key
+        self._match_map = OrderedDict()
+
+        self._generation = None
+
+        self.hits = 0
+        self.misses = 0
+
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, new_max_bytes):
+        self._max_bytes = int(new_max_bytes)
+
+
+    def validate(self):
+        # detect new or removed calibration frames
+        dark_count, dark_max_id = db.session.query(
+            func.count(IndiAllSkyDbDarkFrameTable.id),
+            func.max(IndiAllSkyDbDarkFrameTable.id),
+        ).one()
+
+        bpm_count, bpm_max_id = db.session.query(
+            func.count(IndiAllSkyDbBadPixelMapTable.id),
+            func.max(IndiAllSkyDbBadPixelMapTable.id),
+        ).one()
+
+        generation = (dark_count, dark_max_id, bpm_count, bpm_max_id)
+
+        if generation != self._generation:
+            if not isinstance(self._generation, type(None)):
+                logger.warning('Calibration frames changed, clearing master dark cache')
+
+            self.clear()
+            self._generation = generation
+
+
+    def clear(self):
+        self._master_darks.clear()
+        self._match_map.clear()
+        self._cache_bytes = 0
+
+
+    def getMatch(self, match_key):
+        try:
+            master_key = self._match_map[match_key]
+        except KeyError:
+            return None
+
+        self._match_map.move_to_end(match_key)
+
+        return master_key
+
+
+    def setMatch(self, match_key, master_key):
+        self._match_map[match_key] = master_key
+        self._match_map.move_to_end(match_key)
+
+        while len(self._match_map) > self.max_matches:
+            self._match_map.popitem(last=False)
+
+
+    def get(self, master_key):
+        if isinstance(master_key, type(None)):
+            self.misses += 1
+            return None
+
+        try:
+            master_dark = self._master_darks[master_key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._master_darks.move_to_end(master_key)
+        self.hits += 1
+
+        return master_dark
+
+
+    def put(self, master_key, master_dark):
+        if self._max_bytes <= 0:
+            # cache disabled
+            return
+
+        if master_dark.nbytes > self._max_bytes:
+            logger.warning('Master dark exceeds cache size, not caching')
+            return
+
+
+        if master_key in self._master_darks:
+            # another camera state matched the same master dark
+            self._master_darks.move_to_end(master_key)
+            return
+
+
+        master_dark.flags.writeable = False  # shared between frames
+
+        self._master_darks[master_key] = master_dark
+        self._cache_bytes += master_dark.nbytes
+
+
+        while self._cache_bytes > self._max_bytes:
+            old_key, old_dark = self._master_darks.popitem(last=False)
+            self._cache_bytes -= old_dark.nbytes
+
+            logger.info('Evicted master dark from cache: %s', str(old_key))
+
+            # remove stale mappings
+            for k, v in list(self._match_map.items()):
+                if v == old_key:
+                    del self._match_map[k]
+
+
+    def logStats(self):
+        logger.info(
+            'Master dark cache: %d hits, %d misses, %d entries, %0.1f MB',
+            self.hits,
+            self.misses,
+            len(self._master_darks),
+            self._cache_bytes / 1024.0 / 1024.0,
+        )
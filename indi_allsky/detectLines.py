@@ -24,39 +24,124 @@ class IndiAllskyDetectLines(object):
     mask_blur_kernel_size = 75
 
 
-    def __init__(self, config, bin_v, mask=None):
+    # difference detection
+    background_step = 4  # maximum change of the background per frame
+    difference_threshold = 20
+    difference_cell_size = 8  # changed regions are grouped on a grid of this size
+    difference_box_margin = 10
+    difference_reset_ratio = 0.25  # reset the background if more of the frame changes
+
+
+    def __init__(self, config, bin_v, mask=None, geometry=None):
         self.config = config
         self.bin_v = bin_v
 
+        self._geometry = geometry
+
         self._sqm_mask = mask
         self._sqm_gradient_mask = None
 
+        self._background = None  # running median of the weighted frames
+
+
+    def detectLines(self, original_img, frame_stats=None, background=None, masked_img=None):
+        # background is from updateBackground() of the frame, needed for difference detection
+        # masked_img is from maskedImage() of the frame, calculated here if not provided
+        if isinstance(masked_img, type(None)):
+            masked_img = self.maskedImage(original_img, frame_stats=frame_stats)
+
+
+        lines_start = time.time()
+
+        if self.config.get('DETECT_METEORS_DIFFERENCE'):
+            lines = self._detectDifferenceLines(masked_img, background)
+        else:
+            lines = self._houghLines(masked_img)
+
+        lines_elapsed_s = time.time() - lines_start
+        logger.info('Line detection in %0.4f s', lines_elapsed_s)
+
+        if isinstance(lines, type(None)):
+            logger.info('Detected 0 lines')
+            return list()
+
+
+        logger.info('Detected %d lines', len(lines))
+
+        self._drawLines(original_img, lines)
+
+        return lines
+
+
+    def updateBackground(self, original_img, frame_stats=None, masked_img=None):
+        # frames must be passed in order, returns the background for detecting lines in this frame
+        if isinstance(masked_img, type(None)):
+            masked_img = self.maskedImage(original_img, frame_stats=frame_stats)
+
+        if isinstance(self._background, type(None)) or self._background.shape != masked_img.shape:
+            logger.info('Initializing line detection background')
+            self._background = masked_img.copy()
+            return None
+
+
+        background = self._background.copy()
 
-    def detectLines(self, original_img):
+
+        # saturating 8 bit differences, meteors are brighter than the background
+        diff_img = cv2.subtract(masked_img, self._background)
+        diff_neg = cv2.subtract(self._background, masked_img)
+
+        _, changed = cv2.threshold(diff_img, self.difference_threshold, 255, cv2.THRESH_BINARY)
+
+        changed_ratio = cv2.countNonZero(changed) / changed.size
+        if changed_ratio > self.difference_reset_ratio:
+            # exposure or sky changed
+            logger.warning('%0.1f%% of frame changed, resetting line detection background', changed_ratio * 100)
+            self._background = masked_img.copy()
+            return background
+
+
+        # approximate running median, a single bright frame barely moves the background
+        cv2.add(self._background, cv2.min(diff_img, self.background_step), dst=self._background)
+        cv2.subtract(self._background, cv2.min(diff_neg, self.background_step), dst=self._background)
+
+        return background
+
+
+    def maskedImage(self, original_img, frame_stats=None):
+        # the masked image may be shared by updateBackground() and detectLines() of a frame
         if isinstance(self._sqm_mask, type(None)):
             # This only needs to be done once if a mask is not provided
             self._generateSqmMask(original_img)
 
-        if isinstance(self._sqm_gradient_mask, type(None)):
-            # This only needs to be done once
-            self._generateSqmGradientMask(original_img)
 
+        if not isinstance(frame_stats, type(None)):
+            # gradient is applied to the single luminance plane
+            source_img = frame_stats.luminance
+        else:
+            source_img = original_img
 
-        # apply the gradient to the image
-        masked_img = (original_img * self._sqm_gradient_mask).astype(numpy.uint8)
 
-        #cv2.imwrite('/tmp/masked.jpg', masked_img, [cv2.IMWRITE_JPEG_QUALITY, 90])  # debugging
+        if len(source_img.shape) == 2:
+            img_gray = source_img
+        else:
+            img_gray = cv2.cvtColor(source_img, cv2.COLOR_BGR2GRAY)
 
 
-        if len(original_img.shape) == 2:
-            img_gray = masked_img
-        else:
-            img_gray = cv2.cvtColor(masked_img, cv2.COLOR_BGR2GRAY)
+        if isinstance(self._sqm_gradient_mask, type(None)) or self._sqm_gradient_mask.shape != img_gray.shape:
+            # This only needs to be done once
+            self._generateSqmGradientMask(img_gray)
 
 
+        # apply the gradient to the image, 8 bit weights
+        masked_img = cv2.multiply(img_gray, self._sqm_gradient_mask, scale=1.0 / 255)
 
-        lines_start = time.time()
+        #cv2.imwrite('/tmp/masked.jpg', masked_img, [cv2.IMWRITE_JPEG_QUALITY, 90])  # debugging
+
+        return masked_img
 
+
+    def _houghLines(self, img_gray):
         blur_gray = cv2.GaussianBlur(img_gray, (self.blur_kernel_size, self.blur_kernel_size), cv2.BORDER_DEFAULT)
 
 
@@ -74,19 +159,75 @@ class IndiAllskyDetectLines(object):
             self.max_line_gap,
         )
 
-        lines_elapsed_s = time.time() - lines_start
-        logger.info('Line detection in %0.4f s', lines_elapsed_s)
+        return lines
 
-        if isinstance(lines, type(None)):
-            logger.info('Detected 0 lines')
-            return list()
 
+    def _detectDifferenceLines(self, img_gray, background):
+        # only regions that changed from the background are searched for lines
+        if isinstance(background, type(None)) or background.shape != img_gray.shape:
+            # first frame
+            return None
 
-        logger.info('Detected %d lines', len(lines))
 
-        self._drawLines(original_img, lines)
+        # saturating 8 bit differences, meteors are brighter than the background
+        diff_img = cv2.subtract(img_gray, background)
 
-        return lines
+        _, changed = cv2.threshold(diff_img, self.difference_threshold, 255, cv2.THRESH_BINARY)
+
+        changed_ratio = cv2.countNonZero(changed) / changed.size
+        if changed_ratio > self.difference_reset_ratio:
+            # exposure or sky changed, search the whole frame
+            return self._houghLines(img_gray)
+
+
+        # regions are found on a reduced grid, one cell per block of pixels
+        image_height, image_width = img_gray.shape[:2]
+
+        grid = cv2.resize(
+            changed,
+            (max(int(image_width / self.difference_cell_size), 1), max(int(image_height / self.difference_cell_size), 1)),
+            interpolation=cv2.INTER_AREA,
+        )
+        _, grid = cv2.threshold(grid, 0, 255, cv2.THRESH_BINARY)
+
+        # connect nearby fragments
+        grid = cv2.dilate(grid, numpy.ones((3, 3), dtype=numpy.uint8))
+
+        label_count, labels, stats, centroids = cv2.connectedComponentsWithStats(grid)
+
+        cell_x = image_width / grid.shape[1]
+        cell_y = image_height / grid.shape[0]
+
+
+        # the difference image does not contain static features
+        lines_list = list()
+        for i in range(1, label_count):  # 0 is the background
+            x, y, w, h = stats[i][:4]
+
+            x1 = max(int(x * cell_x) - self.difference_box_margin, 0)
+            y1 = max(int(y * cell_y) - self.difference_box_margin, 0)
+            x2 = min(int((x + w) * cell_x) + self.difference_box_margin, image_width)
+            y2 = min(int((y + h) * cell_y) + self.difference_box_margin, image_height)
+
+            if max(x2 - x1, y2 - y1) < self.min_line_length:
+                # too small for a line
+                continue
+
+            box_lines = self._houghLines(diff_img[y1:y2, x1:x2])
+            if isinstance(box_lines, type(None)):
+                continue
+
+            # back to frame coordinates
+            box_lines += numpy.array([x1, y1, x1, y1], dtype=box_lines.dtype)
+            lines_list.append(box_lines)
+
+
+        logger.info('Searched %d changed regions for lines', label_count - 1)
+
+        if not lines_list:
+            return None
+
+        return numpy.concatenate(lines_list)
 
 
     def _generateSqmMask(self, img):
@@ -100,10 +241,14 @@ class IndiAllskyDetectLines(object):
         sqm_roi = self.config.get('SQM_ROI', [])
 
         try:
-            x1 = int(sqm_roi[0] / self.bin_v.value)
-            y1 = int(sqm_roi[1] / self.bin_v.value)
-            x2 = int(sqm_roi[2] / self.bin_v.value)
-            y2 = int(sqm_roi[3] / self.bin_v.value)
+            if not isinstance(self._geometry, type(None)):
+                # map onto the cropped and scaled frame
+                x1, y1, x2, y2 = self._geometry.mapRoi(sqm_roi)
+            else:
+                x1 = int(sqm_roi[0] / self.bin_v.value)
+                y1 = int(sqm_roi[1] / self.bin_v.value)
+                x2 = int(sqm_roi[2] / self.bin_v.value)
+                y2 = int(sqm_roi[3] / self.bin_v.value)
         except IndexError:
             logger.warning('Using central ROI for blob calculations')
             x1 = int((image_width / 2) - (image_width / 3))
@@ -141,14 +286,8 @@ class IndiAllskyDetectLines(object):
         # blur the mask to prevent mask edges from being detected as lines
         blur_mask = cv2.blur(self._sqm_mask, (self.mask_blur_kernel_size, self.mask_blur_kernel_size), cv2.BORDER_DEFAULT)
 
-        if len(img.shape) == 2:
-            # mono
-            mask = blur_mask
-        else:
-            # color
-            mask = cv2.cvtColor(blur_mask, cv2.COLOR_GRAY2BGR)
-
-        self._sqm_gradient_mask = (mask / 255).astype(numpy.float32)
+        # weights are applied to the single gray plane
+        self._sqm_gradient_mask = blur_mask
 
 
     def _drawLines(self, img, lines):
@@ -7,10 +7,12 @@ logger = logging.getLogger('indi_allsky')
 
 
 class IndiAllSkyDraw(object):
-    def __init__(self, config, bin_v, mask=None):
+    def __init__(self, config, bin_v, mask=None, geometry=None):
         self.config = config
         self.bin_v = bin_v
 
+        self._geometry = geometry
+
         self._sqm_mask = mask
 
 
@@ -28,10 +30,14 @@ class IndiAllSkyDraw(object):
             adu_roi = self.config.get('ADU_ROI', [])
 
             try:
-                adu_x1 = int(adu_roi[0] / self.bin_v.value)
-                adu_y1 = int(adu_roi[1] / self.bin_v.value)
-                adu_x2 = int(adu_roi[2] / self.bin_v.value)
-                adu_y2 = int(adu_roi[3] / self.bin_v.value)
+                if not isinstance(self._geometry, type(None)):
+                    # map onto the cropped and scaled frame
+                    adu_x1, adu_y1, adu_x2, adu_y2 = self._geometry.mapRoi(adu_roi)
+                else:
+                    adu_x1 = int(adu_roi[0] / self.bin_v.value)
+                    adu_y1 = int(adu_roi[1] / self.bin_v.value)
+                    adu_x2 = int(adu_roi[2] / self.bin_v.value)
+                    adu_y2 = int(adu_roi[3] / self.bin_v.value)
             except IndexError:
                 adu_x1 = int((image_width / 2) - (image_width / 3))
                 adu_y1 = int((image_height / 2) - (image_height / 3))
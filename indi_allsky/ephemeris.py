@@ -0,0 +1,335 @@
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+import time
+import calendar
+import math
+import logging
+
+from multiprocessing import Array
+
+import ephem
+import numpy
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyEphemeris(object):
+    """Sun and moon positions precomputed at a fixed interval.
+
+    The table starts shortly before it is built and covers the following
+    two days, so the next rising and setting of every horizon can be found
+    without iterating ephem.  Values between rows are interpolated.
+
+    Rows are indexed by epoch seconds.  Naive datetimes passed in are UTC,
+    the same as datetime.utcnow(), independent of the local timezone.
+
+    The table is rebuilt daily or when the location changes.  When a shared
+    table is provided, only the owner (main process) builds tables, other
+    processes copy the published table when its start or location differs
+    from their own.  Until the owner publishes a new table, the previous
+    table is used as long as it covers the requested time.  A process only
+    builds its own table if no published table covers the time.
+    """
+
+    step = 30  # seconds between rows
+    table_hours = 50
+    rebuild_hours = 24
+
+    # shared header, start is 0 until a table is published
+    HDR_START = 0
+    HDR_LATITUDE = 1
+    HDR_LONGITUDE = 2
+    header_size = 3
+
+    # columns, angles are degrees
+    SUN_ALT = 0
+    SUN_AZ = 1
+    SUN_HA = 2
+    MOON_ALT = 3
+    MOON_AZ = 4
+    MOON_HA = 5
+    MOON_PHASE = 6  # percent
+    SUN_MOON_SEP = 7
+    SIDEREAL = 8  # radians
+    column_count = 9
+
+    # columns that wrap around
+    _angle_columns = {
+        SUN_AZ   : 360.0,
+        SUN_HA   : 360.0,
+        MOON_AZ  : 360.0,
+        MOON_HA  : 360.0,
+        SIDEREAL : 2 * math.pi,
+    }
+
+
+    def __init__(self, config, latitude_v, longitude_v, shared_table=None, owner=False):
+        self.config = config
+
+        self.latitude_v = latitude_v
+        self.longitude_v = longitude_v
+
+        self._shared_table = shared_table
+        self._owner = owner
+
+        self._start = 0.0
+        self._latitude = None
+        self._longitude = None
+        self._table = None
+
+        self._crossings = dict()
+
+
+    @classmethod
+    def rows(cls):
+        return int(cls.table_hours * 3600 / cls.step) + 1
+
+
+    @classmethod
+    def createSharedTable(cls):
+        # allocated once by the main process, passed to the workers
+        return Array('d', cls.header_size + (cls.rows() * cls.column_count))
+
+
+    def update(self, utcnow=None):
+        if not utcnow:
+            utcnow = datetime.utcnow()
+
+        now_ts = self._epoch(utcnow)
+
+
+        if not self._owner and self._shared_table:
+            self._syncShared()
+
+            if not self._isValid(now_ts) and self._covers(now_ts):
+                # the owner publishes the next table
+                return
+
+
+        if self._isValid(now_ts):
+            return
+
+
+        self._build(now_ts)
+
+        if self._owner and self._shared_table:
+            self._publishShared()
+
+
+    def position(self, utcnow=None):
+        if not utcnow:
+            utcnow = datetime.utcnow()
+
+        self.update(utcnow)
+
+        return self._interpolate(self._epoch(utcnow))
+
+
+    def nextCrossing(self, utcnow, horizon_deg, rising=True):
+        # sun position when the sun next crosses the horizon, None if it does not
+        if not utcnow:
+            utcnow = datetime.utcnow()
+
+        self.update(utcnow)
+
+        now_ts = self._epoch(utcnow)
+
+        rising_ts, setting_ts = self._getCrossings(horizon_deg)
+        if rising:
+            crossing_ts = rising_ts
+        else:
+            crossing_ts = setting_ts
+
+        idx = numpy.searchsorted(crossing_ts, now_ts, side='right')
+        if idx >= len(crossing_ts):
+            return None
+
+        return self._interpolate(float(crossing_ts[idx]))
+
+
+    def _epoch(self, utcnow):
+        if utcnow.tzinfo:
+            return utcnow.timestamp()
+
+        # timestamp() would read a naive datetime as local time
+        return calendar.timegm(utcnow.timetuple()) + (utcnow.microsecond / 1000000)
+
+
+    def _isValid(self, now_ts):
+        if isinstance(self._table, type(None)):
+            return False
+
+        if self._latitude != round(self.latitude_v.value, 4) or self._longitude != round(self.longitude_v.value, 4):
+            return False
+
+        if now_ts < self._start:
+            return False
+
+        if now_ts > self._start + (self.rebuild_hours * 3600):
+            return False
+
+        return True
+
+
+    def _covers(self, now_ts):
+        if isinstance(self._table, type(None)):
+            return False
+
+        if now_ts < self._start:
+            return False
+
+        if now_ts > self._start + ((self.rows() - 1) * self.step):
+            return False
+
+        return True
+
+
+    def _build(self, now_ts):
+        build_start = time.time()
+
+        latitude = round(self.latitude_v.value, 4)
+        longitude = round(self.longitude_v.value, 4)
+
+        # start an hour back, aligned to the step
+        start = (math.floor(now_ts / self.step) * self.step) - 3600
+
+        obs = ephem.Observer()
+        obs.lon = math.radians(longitude)
+        obs.lat = math.radians(latitude)
+
+        sun = ephem.Sun()
+        moon = ephem.Moon()
+
+        rows = self.rows()
+        table = numpy.empty((rows, self.column_count), dtype=numpy.float64)
+
+        # ephem reads naive datetimes as UTC
+        start_date = datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None)
+
+        for i in range(rows):
+            obs.date = start_date + timedelta(seconds=i * self.step)
+
+            sun.compute(obs)
+            moon.compute(obs)
+
+            sidereal = float(obs.sidereal_time())
+
+            table[i, self.SUN_ALT] = math.degrees(sun.alt)
+            table[i, self.SUN_AZ] = math.degrees(sun.az)
+            table[i, self.SUN_HA] = self._wrapDegrees(math.degrees(sidereal - sun.ra))
+            table[i, self.MOON_ALT] = math.degrees(moon.alt)
+            table[i, self.MOON_AZ] = math.degrees(moon.az)
+            table[i, self.MOON_HA] = self._wrapDegrees(math.degrees(sidereal - moon.ra))
+            table[i, self.MOON_PHASE] = moon.moon_phase * 100.0
+            table[i, self.SUN_MOON_SEP] = abs((ephem.separation(moon, sun) / (math.pi / 180)) - 180)
+            table[i, self.SIDEREAL] = sidereal
+
+
+        self._start = float(start)
+        self._latitude = latitude
+        self._longitude = longitude
+        self._table = table
+        self._crossings = dict()
+
+        build_elapsed_s = time.time() - build_start
+        logger.info('Ephemeris table built in %0.4f s', build_elapsed_s)
+
+
+    def _publishShared(self):
+        shared = numpy.frombuffer(self._shared_table.get_obj(), dtype=numpy.float64)
+
+        with self._shared_table.get_lock():
+            shared[self.header_size:] = self._table.ravel()
+            shared[self.HDR_START] = self._start
+            shared[self.HDR_LATITUDE] = self._latitude
+            shared[self.HDR_LONGITUDE] = self._longitude
+
+
+    def _syncShared(self):
+        shared = numpy.frombuffer(self._shared_table.get_obj(), dtype=numpy.float64)
+
+        with self._shared_table.get_lock():
+            start = float(shared[self.HDR_START])
+            latitude = float(shared[self.HDR_LATITUDE])
+            longitude = float(shared[self.HDR_LONGITUDE])
+
+            if not start:
+                # nothing published
+                return
+
+            if not isinstance(self._table, type(None)) and (start, latitude, longitude) == (self._start, self._latitude, self._longitude):
+                # already current, a local table for the same start and location is identical
+                return
+
+            self._table = shared[self.header_size:].reshape((self.rows(), self.column_count)).copy()
+
+        self._start = start
+        self._latitude = latitude
+        self._longitude = longitude
+        self._crossings = dict()
+
+
+    def _interpolate(self, ts):
+        pos_f = (ts - self._start) / self.step
+        idx = min(max(int(math.floor(pos_f)), 0), self.rows() - 2)
+        frac = min(max(pos_f - idx, 0.0), 1.0)
+
+        row_a = self._table[idx]
+        row_b = self._table[idx + 1]
+
+        values = row_a + ((row_b - row_a) * frac)
+
+        for col, period in self._angle_columns.items():
+            # interpolate across the wrap
+            delta = ((row_b[col] - row_a[col] + (period / 2)) % period) - (period / 2)
+            values[col] = (row_a[col] + (delta * frac)) % period
+
+
+        return {
+            'sun_alt'       : float(values[self.SUN_ALT]),
+            'sun_az'        : float(values[self.SUN_AZ]),
+            'sun_ha'        : self._wrapDegrees(float(values[self.SUN_HA])),
+            'moon_alt'      : float(values[self.MOON_ALT]),
+            'moon_az'       : float(values[self.MOON_AZ]),
+            'moon_ha'       : self._wrapDegrees(float(values[self.MOON_HA])),
+            'moon_phase'    : float(values[self.MOON_PHASE]),
+            'sun_moon_sep'  : float(values[self.SUN_MOON_SEP]),
+            'sidereal_time' : str(ephem.hours(float(values[self.SIDEREAL]))),
+        }
+
+
+    def _getCrossings(self, horizon_deg):
+        try:
+            return self._crossings[horizon_deg]
+        except KeyError:
+            pass
+
+
+        sun_alt = self._table[:, self.SUN_ALT] - horizon_deg
+
+        above = sun_alt >= 0
+        change_idx = numpy.flatnonzero(above[1:] != above[:-1])
+
+        # linear interpolation of the crossing between rows
+        alt_a = sun_alt[change_idx]
+        alt_b = sun_alt[change_idx + 1]
+        crossing_ts = self._start + ((change_idx + (alt_a / (alt_a - alt_b))) * self.step)
+
+        rising_mask = alt_b > alt_a
+
+        crossings = (crossing_ts[rising_mask], crossing_ts[~rising_mask])
+        self._crossings[horizon_deg] = crossings
+
+        return crossings
+
+
+    def _wrapDegrees(self, deg):
+        # -180 to 180
+        if deg < -180:
+            return deg + 360
+        elif deg > 180:
+            return deg - 360
+
+        return deg
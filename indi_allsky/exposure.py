@@ -0,0 +1,249 @@
+import math
+import copy
+import functools
+import logging
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyExposureControl(object):
+    """Base class for exposure controllers.
+
+    update() is called with the brightness of each frame and returns the
+    ADU average and the next exposure (None if it should not change).
+    Controllers do not access shared state, so recorded frames can be
+    replayed through them.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+        self.stable = False
+        self.current_adu_target = 0
+
+
+    def update(self, exposure, gain, adu, night, sun_alt=None, sun_alt_next=None):
+        raise NotImplementedError()
+
+
+    def _targets(self, exposure, night):
+        if night:
+            target_adu = self.config['TARGET_ADU']
+        else:
+            target_adu = self.config['TARGET_ADU_DAY']
+
+
+        # Brightness when the sun is in view (very short exposures) can change drastically when clouds pass through the view
+        # Setting a deviation that is too short can cause exposure flapping
+        if exposure < 0.001000:
+            # DAY
+            adu_dev = float(self.config.get('TARGET_ADU_DEV_DAY', 20))
+        else:
+            # NIGHT
+            adu_dev = float(self.config.get('TARGET_ADU_DEV', 10))
+
+        return target_adu, adu_dev
+
+
+    def _clamp(self, new_exposure):
+        # Do not exceed the limits
+        if new_exposure < self.config['CCD_EXPOSURE_MIN']:
+            new_exposure = self.config['CCD_EXPOSURE_MIN']
+        elif new_exposure > self.config['CCD_EXPOSURE_MAX']:
+            new_exposure = self.config['CCD_EXPOSURE_MAX']
+
+        return new_exposure
+
+
+class IndiAllSkyExposureProportional(IndiAllSkyExposureControl):
+    """Proportional steps until the target is found, then a moving average
+    of the ADU is watched for drift."""
+
+    history_max_vals = 6  # number of entries to use to calculate average
+
+
+    def __init__(self, config):
+        super(IndiAllSkyExposureProportional, self).__init__(config)
+
+        self.hist_adu = []
+
+
+    def update(self, exposure, gain, adu, night, sun_alt=None, sun_alt_next=None):
+        target_adu, adu_dev = self._targets(exposure, night)
+
+        target_adu_min = target_adu - adu_dev
+        target_adu_max = target_adu + adu_dev
+        current_adu_target_min = self.current_adu_target - adu_dev
+        current_adu_target_max = self.current_adu_target + adu_dev
+
+        if exposure < 0.001000:
+            # DAY
+            exp_scale_factor = 0.50  # scale exposure calculation
+        else:
+            # NIGHT
+            exp_scale_factor = 1.0  # scale exposure calculation
+
+
+        if not self.stable:
+            new_exposure = self.recalculate_exposure(exposure, adu, target_adu, target_adu_min, target_adu_max, exp_scale_factor)
+            return 0.0, new_exposure
+
+
+        self.hist_adu.append(adu)
+        self.hist_adu = self.hist_adu[(self.history_max_vals * -1):]  # remove oldest values, up to history_max_vals
+
+        logger.info('Current target ADU: %0.2f (%0.2f/%0.2f)', self.current_adu_target, current_adu_target_min, current_adu_target_max)
+        logger.info('Current ADU history: (%d) [%s]', len(self.hist_adu), ', '.join(['{0:0.2f}'.format(x) for x in self.hist_adu]))
+
+
+        adu_average = functools.reduce(lambda a, b: a + b, self.hist_adu) / len(self.hist_adu)
+        logger.info('ADU average: %0.2f', adu_average)
+
+
+        ### Need at least x values to continue
+        if len(self.hist_adu) < self.history_max_vals:
+            return adu_average, None
+
+
+        ### only change exposure when 70% of the values exceed the max or minimum
+        if adu_average > current_adu_target_max:
+            logger.warning('ADU increasing beyond limits, recalculating next exposure')
+            self.stable = False
+        elif adu_average < current_adu_target_min:
+            logger.warning('ADU decreasing beyond limits, recalculating next exposure')
+            self.stable = False
+
+        return adu_average, None
+
+
+    def recalculate_exposure(self, exposure, adu, target_adu, target_adu_min, target_adu_max, exp_scale_factor):
+
+        # Until we reach a good starting point, do not calculate a moving average
+        if adu <= target_adu_max and adu >= target_adu_min:
+            logger.warning('Found target value for exposure')
+            self.current_adu_target = copy.copy(adu)
+            self.stable = True
+            self.hist_adu = []
+            return None
+
+
+        # Scale the exposure up and down based on targets
+        new_exposure = exposure - ((exposure - (exposure * (target_adu / adu))) * exp_scale_factor)
+
+        return self._clamp(new_exposure)
+
+
+class IndiAllSkyExposurePredictive(IndiAllSkyExposureControl):
+    """Predicts the next exposure from a model of the sky brightness.
+
+    Each frame gives the brightness as ADU per second of exposure for the
+    current gain.  The log of the brightness is fit against the sun altitude
+    over the recent frames (weighted toward the newest), and the fit is
+    evaluated at the sun altitude of the next frame.  The exposure is set
+    every frame, there is no separate search and hold phase.
+    """
+
+    history_max_vals = 10
+    history_decay = 0.7  # weight of each older frame
+    adu_valid_min = 2.0  # frames near black or saturation do not measure the brightness
+    adu_valid_max = 250.0
+    max_step = 4.0  # largest change factor per frame
+    min_sun_alt_range = 0.5  # degrees, below this only the brightness level is fit
+
+
+    def __init__(self, config):
+        super(IndiAllSkyExposurePredictive, self).__init__(config)
+
+        self.history = list()  # (gain, log brightness, sun altitude)
+        self.hist_adu = []
+
+
+    def update(self, exposure, gain, adu, night, sun_alt=None, sun_alt_next=None):
+        target_adu, adu_dev = self._targets(exposure, night)
+
+        self.current_adu_target = target_adu
+        self.stable = abs(adu - target_adu) <= adu_dev
+
+        self.hist_adu.append(adu)
+        self.hist_adu = self.hist_adu[(self.history_max_vals * -1):]
+
+        adu_average = sum(self.hist_adu) / len(self.hist_adu)
+
+
+        if exposure <= 0:
+            return adu_average, None
+
+
+        if adu < self.adu_valid_min or adu > self.adu_valid_max:
+            # clipped, only the direction is known
+            if adu > self.adu_valid_max:
+                new_exposure = exposure / self.max_step
+            else:
+                new_exposure = exposure * self.max_step
+
+            new_exposure = self._clamp(new_exposure)
+            logger.warning('ADU out of range, new exposure: %0.6f', new_exposure)
+            return adu_average, new_exposure
+
+
+        if self.history and self.history[-1][0] != gain:
+            # brightness is only comparable at the same gain
+            self.history = list()
+
+        if isinstance(sun_alt, type(None)):
+            sun_alt = 0.0
+
+        if isinstance(sun_alt_next, type(None)):
+            sun_alt_next = sun_alt
+
+        self.history.append((gain, math.log(adu / exposure), sun_alt))
+        self.history = self.history[(self.history_max_vals * -1):]
+
+
+        log_brightness = self._predict(sun_alt_next)
+
+        new_exposure = target_adu / math.exp(log_brightness)
+
+        # limit the step, a single bad frame cannot swing the exposure
+        new_exposure = min(max(new_exposure, exposure / self.max_step), exposure * self.max_step)
+        new_exposure = self._clamp(new_exposure)
+
+
+        if self.stable and abs(new_exposure - exposure) / exposure < 0.01:
+            # not worth changing
+            return adu_average, None
+
+
+        logger.info('Predicted exposure: %0.6f (ADU %0.2f, target %0.2f)', new_exposure, adu, target_adu)
+
+        return adu_average, new_exposure
+
+
+    def _predict(self, sun_alt_next):
+        # weighted least squares of log brightness vs sun altitude
+        weights = [self.history_decay ** age for age in range(len(self.history) - 1, -1, -1)]
+
+        w_sum = sum(weights)
+        mean_x = sum(w * h[2] for w, h in zip(weights, self.history)) / w_sum
+        mean_y = sum(w * h[1] for w, h in zip(weights, self.history)) / w_sum
+
+        var_x = sum(w * ((h[2] - mean_x) ** 2) for w, h in zip(weights, self.history)) / w_sum
+        if var_x < (self.min_sun_alt_range / 2) ** 2:
+            # sun is not moving enough to fit a slope, use the newest level
+            return self.history[-1][1]
+
+
+        cov_xy = sum(w * (h[2] - mean_x) * (h[1] - mean_y) for w, h in zip(weights, self.history)) / w_sum
+        slope = cov_xy / var_x
+
+        # the fit is anchored at the newest frame, the slope carries the trend
+        newest = self.history[-1]
+        return newest[1] + (slope * (sun_alt_next - newest[2]))
+
+
+def getExposureControl(config):
+    if config.get('CCD_EXPOSURE_PREDICTIVE'):
+        return IndiAllSkyExposurePredictive(config)
+
+    return IndiAllSkyExposureProportional(config)
@@ -410,6 +410,17 @@ def DETECT_STARS_THOLD_validator(form, field):
         raise ValidationError('Threshold must be 1.0 or less')
 
 
+def DETECT_STARS_PYRAMID_validator(form, field):
+    if not isinstance(field.data, int):
+        raise ValidationError('Please enter valid number')
+
+    if field.data < 0:
+        raise ValidationError('Pyramid level must be 0 or greater')
+
+    if field.data > 2:
+        raise ValidationError('Pyramid level must be 2 or less')
+
+
 def LOCATION_NAME_validator(form, field):
     if not field.data:
         return
@@ -617,6 +628,17 @@ def STARTRAILS_TIMELAPSE_MINFRAMES_validator(form, field):
         raise ValidationError('Star Trails Timelapse Minimum Frames must be 25 or more')
 
 
+def PRODUCT_WORKERS_validator(form, field):
+    if not isinstance(field.data, int):
+        raise ValidationError('Please enter valid number')
+
+    if field.data < 0:
+        raise ValidationError('Keogram/Star Trails workers must be 0 or greater')
+
+    if field.data > 8:
+        raise ValidationError('Keogram/Star Trails workers must be 8 or less')
+
+
 def IMAGE_FILE_TYPE_validator(form, field):
     if field.data not in ('jpg', 'png', 'tif'):
         raise ValidationError('Please select a valid file type')
@@ -687,6 +709,58 @@ def IMAGE_EXPORT_FOLDER_validator(form, field):
         raise ValidationError(str(e))
 
 
+def IMAGE_SHM_SLOTS_validator(form, field):
+    if not isinstance(field.data, int):
+        raise ValidationError('Please enter valid number')
+
+    if field.data < 0:
+        raise ValidationError('Shared memory slots must be 0 or greater')
+
+    if field.data > 10:
+        raise ValidationError('Shared memory slots must be 10 or less')
+
+
+def IMAGE_STAGE_WORKERS_validator(form, field):
+    if not isinstance(field.data, int):
+        raise ValidationError('Please enter valid number')
+
+    if field.data < 0:
+        raise ValidationError('Stage workers must be 0 or greater')
+
+    if field.data > 8:
+        raise ValidationError('Stage workers must be 8 or less')
+
+
+def IMAGE_QUEUE_MAX_validator(form, field):
+    if not isinstance(field.data, int):
+        raise ValidationError('Please enter valid number')
+
+    if field.data < 0:
+        raise ValidationError('Image queue depth must be 0 or greater')
+
+
+def IMAGE_QUEUE_POLICY_validator(form, field):
+    queue_policies = (
+        'drop_oldest',
+        'drop_newest',
+        'pause',
+    )
+
+    if field.data not in queue_policies:
+        raise ValidationError('Invalid selection')
+
+
+def IMAGE_CALIBRATION_CACHE_MB_validator(form, field):
+    if not isinstance(field.data, int):
+        raise ValidationError('Please enter valid number')
+
+    if field.data < 0:
+        raise ValidationError('Cache size must be 0 or greater')
+
+    if field.data > 4096:
+        raise ValidationError('Cache size must be 4096 or less')
+
+
 def IMAGE_EXPORT_RAW_validator(form, field):
     if not field.data:
         return
@@ -1621,6 +1695,12 @@ class IndiAllskyConfigForm(FlaskForm):
         ('minimum', 'Minimum'),
     )
 
+    IMAGE_QUEUE_POLICY_choices = (
+        ('drop_oldest', 'Drop oldest frame'),
+        ('drop_newest', 'Drop newest frame'),
+        ('pause', 'Pause exposures'),
+    )
+
     IMAGE_STACK_COUNT_choices = (
         ('1', 'Disabled'),
         ('2', '2'),
@@ -1716,6 +1796,7 @@ class IndiAllskyConfigForm(FlaskForm):
     CCD_EXPOSURE_MAX                 = FloatField('Max Exposure', validators=[DataRequired(), CCD_EXPOSURE_MAX_validator])
     CCD_EXPOSURE_DEF                 = FloatField('Default Exposure', validators=[CCD_EXPOSURE_DEF_validator])
     CCD_EXPOSURE_MIN                 = FloatField('Min Exposure', validators=[CCD_EXPOSURE_MIN_validator])
+    CCD_EXPOSURE_PREDICTIVE          = BooleanField('Predictive Exposure')
     EXPOSURE_PERIOD                  = FloatField('Exposure Period (Night)', validators=[DataRequired(), EXPOSURE_PERIOD_validator])
     EXPOSURE_PERIOD_DAY              = FloatField('Exposure Period (Day)', validators=[DataRequired(), EXPOSURE_PERIOD_DAY_validator])
     FOCUS_MODE                       = BooleanField('Focus Mode')
@@ -1741,9 +1822,12 @@ class IndiAllskyConfigForm(FlaskForm):
     ADU_ROI_Y2                       = IntegerField('ADU ROI y2', validators=[ADU_ROI_validator])
     DETECT_STARS                     = BooleanField('Star Detection')
     DETECT_STARS_THOLD               = FloatField('Star Detection Threshold', validators=[DataRequired(), DETECT_STARS_THOLD_validator])
+    DETECT_STARS_PYRAMID             = IntegerField('Star Detection Downscale', validators=[DETECT_STARS_PYRAMID_validator])
     DETECT_METEORS                   = BooleanField('Meteor Detection')
+    DETECT_METEORS_DIFFERENCE        = BooleanField('Difference Meteor Detection')
     DETECT_MASK                      = StringField('Detection Mask', validators=[DETECT_MASK_validator])
     DETECT_DRAW                      = BooleanField('Mark Detections on Image')
+    DETECT_FULL_RESOLUTION           = BooleanField('Detect at Full Resolution')
     LOGO_OVERLAY                     = StringField('Logo Overlay', validators=[LOGO_OVERLAY_validator])
     SQM_ROI_X1                       = IntegerField('SQM ROI x1', validators=[SQM_ROI_validator])
     SQM_ROI_Y1                       = IntegerField('SQM ROI y1', validators=[SQM_ROI_validator])
@@ -1766,11 +1850,14 @@ class IndiAllskyConfigForm(FlaskForm):
     KEOGRAM_H_SCALE                  = IntegerField('Keogram Horizontal Scaling', validators=[DataRequired(), KEOGRAM_H_SCALE_validator])
     KEOGRAM_V_SCALE                  = IntegerField('Keogram Vertical Scaling', validators=[DataRequired(), KEOGRAM_V_SCALE_validator])
     KEOGRAM_LABEL                    = BooleanField('Label Keogram')
+    KEOGRAM_LIVE                     = BooleanField('Live Keogram')
     STARTRAILS_MAX_ADU               = IntegerField('Star Trails Max ADU', validators=[DataRequired(), STARTRAILS_MAX_ADU_validator])
     STARTRAILS_MASK_THOLD            = IntegerField('Star Trails Mask Threshold', validators=[DataRequired(), STARTRAILS_MASK_THOLD_validator])
     STARTRAILS_PIXEL_THOLD           = FloatField('Star Trails Pixel Threshold', validators=[STARTRAILS_PIXEL_THOLD_validator])
+    STARTRAILS_LIVE                  = BooleanField('Live Star Trails')
     STARTRAILS_TIMELAPSE             = BooleanField('Star Trails Timelapse')
     STARTRAILS_TIMELAPSE_MINFRAMES   = IntegerField('Star Trails Timelapse Minimum Frames', validators=[DataRequired(), STARTRAILS_TIMELAPSE_MINFRAMES_validator])
+    PRODUCT_WORKERS                  = IntegerField('Keogram/Star Trails Workers', validators=[PRODUCT_WORKERS_validator])
     IMAGE_FILE_TYPE                  = SelectField('Image file type', choices=IMAGE_FILE_TYPE_choices, validators=[DataRequired(), IMAGE_FILE_TYPE_validator])
     IMAGE_FILE_COMPRESSION__JPG      = IntegerField('JPEG Compression', validators=[DataRequired(), IMAGE_FILE_COMPRESSION__JPG_validator])
     IMAGE_FILE_COMPRESSION__PNG      = IntegerField('PNG Compression', validators=[DataRequired(), IMAGE_FILE_COMPRESSION__PNG_validator])
@@ -1795,16 +1882,24 @@ class IndiAllskyConfigForm(FlaskForm):
     IMAGE_CROP_ROI_X2                = IntegerField('Image Crop ROI x2', validators=[IMAGE_CROP_ROI_validator])
     IMAGE_CROP_ROI_Y2                = IntegerField('Image Crop ROI y2', validators=[IMAGE_CROP_ROI_validator])
     IMAGE_SAVE_FITS                  = BooleanField('Save FITS data')
+    IMAGE_SAVE_FITS_COMPRESS         = BooleanField('Compress FITS data')
     NIGHT_GRAYSCALE                  = BooleanField('Save in Grayscale at Night')
     DAYTIME_GRAYSCALE                = BooleanField('Save in Grayscale during Day')
     IMAGE_EXPORT_RAW                 = SelectField('Export raw image type', choices=IMAGE_EXPORT_RAW_choices, validators=[IMAGE_EXPORT_RAW_validator])
     IMAGE_EXPORT_FOLDER              = StringField('Export folder', validators=[DataRequired(), IMAGE_EXPORT_FOLDER_validator])
+    IMAGE_SHM_SLOTS                  = IntegerField('Shared memory frame slots', validators=[IMAGE_SHM_SLOTS_validator])
+    IMAGE_CALIBRATION_CACHE_MB       = IntegerField('Master dark cache (MB)', validators=[IMAGE_CALIBRATION_CACHE_MB_validator])
+    IMAGE_STAGE_WORKERS              = IntegerField('Image stage workers', validators=[IMAGE_STAGE_WORKERS_validator])
+    QUALITY_GOVERNOR                 = BooleanField('Quality Governor')
+    IMAGE_QUEUE_MAX                  = IntegerField('Image queue depth', validators=[IMAGE_QUEUE_MAX_validator])
+    IMAGE_QUEUE_POLICY               = SelectField('Image queue policy', choices=IMAGE_QUEUE_POLICY_choices, validators=[DataRequired(), IMAGE_QUEUE_POLICY_validator])
     IMAGE_STACK_METHOD               = SelectField('Image stacking method', choices=IMAGE_STACK_METHOD_choices, validators=[DataRequired(), IMAGE_STACK_METHOD_validator])
     IMAGE_STACK_COUNT                = SelectField('Stack count', choices=IMAGE_STACK_COUNT_choices, validators=[DataRequired(), IMAGE_STACK_COUNT_validator])
     IMAGE_STACK_ALIGN                = BooleanField('Register images')
     IMAGE_ALIGN_DETECTSIGMA          = IntegerField('Alignment sensitivity', validators=[DataRequired(), IMAGE_ALIGN_DETECTSIGMA_validator])
     IMAGE_ALIGN_POINTS               = IntegerField('Alignment points', validators=[DataRequired(), IMAGE_ALIGN_POINTS_validator])
     IMAGE_ALIGN_SOURCEMINAREA        = IntegerField('Minimum point area', validators=[DataRequired(), IMAGE_ALIGN_SOURCEMINAREA_validator])
+    IMAGE_ALIGN_STARS                = BooleanField('Align with detected stars')
     IMAGE_STACK_SPLIT                = BooleanField('Stack split screen')
     IMAGE_EXPIRE_DAYS                = IntegerField('Image expiration (days)', validators=[DataRequired(), IMAGE_EXPIRE_DAYS_validator])
     TIMELAPSE_EXPIRE_DAYS            = IntegerField('Timelapse expiration (days)', validators=[DataRequired(), TIMELAPSE_EXPIRE_DAYS_validator])
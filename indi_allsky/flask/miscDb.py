@@ -160,6 +160,7 @@ class miscDb(object):
         #    'stars'
         #    'detections'
         #    'process_elapsed'
+        #    'quality'
         #}
 
         if not filename:
@@ -223,6 +224,7 @@ class miscDb(object):
             stars=metadata['stars'],
             detections=metadata['detections'],
             process_elapsed=metadata['process_elapsed'],
+            quality=int(metadata.get('quality', 0)),
             remote_url=metadata.get('remote_url'),
             s3_key=metadata.get('s3_key'),
         )
@@ -543,6 +545,7 @@ class miscDb(object):
         #    'gain'
         #    'binmode'
         #    'night'
+        #    'compressed'  # optional
         #}
 
         if not filename:
@@ -576,6 +579,7 @@ class miscDb(object):
             binmode=metadata['binmode'],
             dayDate=dayDate,
             night=metadata['night'],
+            compressed=bool(metadata.get('compressed', False)),
             remote_url=metadata.get('remote_url'),
             s3_key=metadata.get('s3_key'),
         )
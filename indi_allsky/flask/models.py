@@ -182,6 +182,7 @@ class IndiAllSkyDbImageTable(IndiAllSkyDbFileBase):
     sync_id = db.Column(db.Integer, nullable=True, index=True)
     calibrated = db.Column(db.Boolean, server_default=expression.false(), nullable=False)
     detections = db.Column(db.Integer, server_default='0', nullable=False, index=True)
+    quality = db.Column(db.Integer, server_default='0', nullable=False)  # bitmask of the stages reduced by the quality governor
     camera_id = db.Column(db.Integer, db.ForeignKey('camera.id'), nullable=False)
     camera = db.relationship('IndiAllSkyDbCameraTable', back_populates='images')
 
@@ -335,6 +336,7 @@ class IndiAllSkyDbFitsImageTable(IndiAllSkyDbFileBase):
     exposure = db.Column(db.Float, nullable=False)
     gain = db.Column(db.Integer, nullable=False)
     binmode = db.Column(db.Integer, server_default='1', nullable=False)
+    compressed = db.Column(db.Boolean, server_default=expression.false(), nullable=False)
     night = db.Column(db.Boolean, default=expression.true(), nullable=False, index=True)
     uploaded = db.Column(db.Boolean, server_default=expression.false(), nullable=False)
     sync_id = db.Column(db.Integer, nullable=True, index=True)
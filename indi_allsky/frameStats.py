@@ -0,0 +1,84 @@
+import cv2
+import numpy
+import logging
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyFrameStats(object):
+    """Statistics shared by the measurement and detection stages of a frame.
+
+    Values are calculated on first access and reused by every later stage.
+    The object must be replaced when the frame data is replaced.
+    """
+
+    def __init__(self, data):
+        self._data = data
+
+        self._luminance = None
+        self._max = None
+        self._roi_means = dict()
+
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, *args):
+        pass  # read only
+
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    @shape.setter
+    def shape(self, *args):
+        pass  # read only
+
+
+    @property
+    def luminance(self):
+        if isinstance(self._luminance, type(None)):
+            if len(self._data.shape) == 2:
+                # mono or bayered data is already a single plane
+                self._luminance = self._data
+            else:
+                self._luminance = cv2.cvtColor(self._data, cv2.COLOR_BGR2GRAY)
+
+        return self._luminance
+
+    @luminance.setter
+    def luminance(self, *args):
+        pass  # read only
+
+
+    @property
+    def max(self):
+        if isinstance(self._max, type(None)):
+            self._max = int(numpy.amax(self._data))
+
+        return self._max
+
+    @max.setter
+    def max(self, *args):
+        pass  # read only
+
+
+    def roiMean(self, name, mask):
+        # mean luminance within a named mask
+        try:
+            return self._roi_means[name]
+        except KeyError:
+            pass
+
+        roi_mean = cv2.mean(src=self.luminance, mask=mask)[0]
+        self._roi_means[name] = roi_mean
+
+        return roi_mean
+
+
+    def maskedLuminance(self, mask):
+        return cv2.bitwise_and(self.luminance, self.luminance, mask=mask)
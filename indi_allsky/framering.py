@@ -0,0 +1,135 @@
+import time
+import numpy
+import logging
+
+from multiprocessing import Array
+
+try:
+    from multiprocessing import shared_memory  # python 3.8+
+except ImportError:
+    shared_memory = None
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyFrameRing(object):
+    """Ring of preallocated shared memory slots used to hand frames from the
+    camera client to the ImageWorker without spooling them to disk.
+
+    Slots must be created in the main process before the worker is started,
+    the worker inherits the mappings.
+    """
+
+    SLOT_FREE = 0
+    SLOT_USED = 1
+
+
+    def __init__(self, slot_count, slot_size):
+        self._slot_count = int(slot_count)
+        self._slot_size = int(slot_size)
+
+        self._slot_state = Array('b', self._slot_count)  # all slots start free
+        self._next_slot = 0
+
+        self._shm_list = list()
+
+
+    @property
+    def slot_count(self):
+        return self._slot_count
+
+    @slot_count.setter
+    def slot_count(self, *args):
+        pass  # read only
+
+
+    @property
+    def slot_size(self):
+        return self._slot_size
+
+    @slot_size.setter
+    def slot_size(self, *args):
+        pass  # read only
+
+
+    @classmethod
+    def available(cls):
+        return not isinstance(shared_memory, type(None))
+
+
+    def create(self):
+        if not self.available():
+            raise Exception('multiprocessing.shared_memory requires python 3.8 or newer')
+
+        logger.info('Allocating %d shared memory frame slots (%0.1f MB each)', self._slot_count, self._slot_size / 1024.0 / 1024.0)
+
+        for x in range(self._slot_count):
+            shm = shared_memory.SharedMemory(create=True, size=self._slot_size)
+            self._shm_list.append(shm)
+
+
+    def close(self, unlink=True):
+        for shm in self._shm_list:
+            shm.close()
+
+            if unlink:
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
+
+        self._shm_list = list()
+
+
+    def put(self, data):
+        # returns the slot index, or None if the frame cannot be stored
+        if data.nbytes > self._slot_size:
+            logger.warning('Frame too large for shared memory slot (%d > %d)', data.nbytes, self._slot_size)
+            return None
+
+
+        with self._slot_state.get_lock():
+            for x in range(self._slot_count):
+                slot = (self._next_slot + x) % self._slot_count
+
+                if self._slot_state[slot] == self.SLOT_FREE:
+                    self._slot_state[slot] = self.SLOT_USED
+                    break
+            else:
+                logger.warning('No free shared memory frame slots')
+                return None
+
+        self._next_slot = (slot + 1) % self._slot_count
+
+
+        copy_start = time.time()
+
+        slot_data = numpy.ndarray(data.shape, dtype=data.dtype.newbyteorder('='), buffer=self._shm_list[slot].buf)
+        numpy.copyto(slot_data, data)  # also converts big endian FITS data to native order
+
+        copy_elapsed_s = time.time() - copy_start
+        logger.info('Frame stored in slot %d in %0.4f s', slot, copy_elapsed_s)
+
+        return slot
+
+
+    def get(self, slot, shape, dtype):
+        # returns an array backed by the shared memory slot, call release() when finished
+        return numpy.ndarray(tuple(shape), dtype=numpy.dtype(dtype), buffer=self._shm_list[slot].buf)
+
+
+    def sharesMemory(self, slot, data):
+        # True if the array is backed by the slot
+        slot_data = numpy.ndarray((self._slot_size,), dtype=numpy.uint8, buffer=self._shm_list[slot].buf)
+        return numpy.may_share_memory(slot_data, data)
+
+
+    def release(self, slot):
+        with self._slot_state.get_lock():
+            self._slot_state[slot] = self.SLOT_FREE
+
+
+    def used(self):
+        with self._slot_state.get_lock():
+            return len([x for x in self._slot_state if x == self.SLOT_USED])
@@ -0,0 +1,97 @@
+import cv2
+import logging
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyFrameGeometry(object):
+    """Crop and scale applied to the processed frame.
+
+    Regions of interest and masks are defined against the full (binned)
+    frame, this maps them onto the frame after it has been cropped and
+    scaled.
+    """
+
+    def __init__(self, config, bin_v):
+        self.config = config
+        self.bin_v = bin_v
+
+        self._crop_roi = None  # unbinned x1, y1, x2, y2
+        self._scale = 1.0
+
+
+    @property
+    def crop_roi(self):
+        return self._crop_roi
+
+    @crop_roi.setter
+    def crop_roi(self, new_crop_roi):
+        if new_crop_roi:
+            self._crop_roi = list(new_crop_roi)
+        else:
+            self._crop_roi = None
+
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, new_scale):
+        self._scale = float(new_scale)
+
+
+    def cropBox(self):
+        # crop coordinates adjusted for binning
+        if not self._crop_roi:
+            return None
+
+        return (
+            int(self._crop_roi[0] / self.bin_v.value),
+            int(self._crop_roi[1] / self.bin_v.value),
+            int(self._crop_roi[2] / self.bin_v.value),
+            int(self._crop_roi[3] / self.bin_v.value),
+        )
+
+
+    def scaledSize(self, width, height):
+        # must match scale_image()
+        return int(width * self._scale), int(height * self._scale)
+
+
+    def mapPoint(self, x, y):
+        crop_box = self.cropBox()
+        if crop_box:
+            x -= crop_box[0]
+            y -= crop_box[1]
+
+        return int(x * self._scale), int(y * self._scale)
+
+
+    def mapRoi(self, roi):
+        # raises IndexError for an undefined roi, like the original lookups
+        x1 = int(roi[0] / self.bin_v.value)
+        y1 = int(roi[1] / self.bin_v.value)
+        x2 = int(roi[2] / self.bin_v.value)
+        y2 = int(roi[3] / self.bin_v.value)
+
+        return self.mapPoint(x1, y1) + self.mapPoint(x2, y2)
+
+
+    def mapMask(self, mask):
+        if mask is None:
+            return None
+
+        crop_box = self.cropBox()
+        if crop_box:
+            mask = mask[
+                crop_box[1]:crop_box[3],
+                crop_box[0]:crop_box[2],
+            ]
+
+        if self._scale != 1.0:
+            mask_height, mask_width = mask.shape[:2]
+            mask = cv2.resize(mask, self.scaledSize(mask_width, mask_height), interpolation=cv2.INTER_NEAREST)
+
+        return mask
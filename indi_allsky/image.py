@@ -6,11 +6,8 @@ from datetime import datetime
 from datetime import timedelta
 #from datetime import timezone
 import time
-import functools
 import tempfile
-import shutil
 import psutil
-import copy
 import math
 import signal
 import logging
@@ -19,9 +16,10 @@ import traceback
 
 #from tifffile import TiffWriter
 
-import ephem
 
 from multiprocessing import Process
+from multiprocessing import Queue
+from multiprocessing import Value
 #from threading import Thread
 import queue
 
@@ -33,17 +31,30 @@ import numpy
 from . import constants
 
 from .orb import IndiAllskyOrbGenerator
+from .overlayCache import IndiAllSkyOverlayCache
+from .ephemeris import IndiAllSkyEphemeris
+from .exposure import getExposureControl
+from .qualityGovernor import IndiAllSkyQualityGovernor
 from .sqm import IndiAllskySqm
 from .stars import IndiAllSkyStars
 from .detectLines import IndiAllskyDetectLines
 from .draw import IndiAllSkyDraw
-from .scnr import IndiAllskyScnr
+from .colorLut import IndiAllSkyColorLut
 from .stack import IndiAllskyStacker
+from .stack import IndiAllskyStackAccumulator
+from .frameStats import IndiAllSkyFrameStats
+from .geometry import IndiAllSkyFrameGeometry
+from .darkCache import IndiAllSkyDarkCache
+from .assetWriter import IndiAllSkyAssetWriter
+from .keogram import KeogramGenerator
+from .keogramStrip import IndiAllSkyKeogramStrip
+from .starTrailsLive import IndiAllSkyStarTrailAccumulator
 
 from .flask import create_app
 from .flask import db
 from .flask.miscDb import miscDb
 
+from .flask.models import NotificationCategory
 from .flask.models import TaskQueueState
 from .flask.models import TaskQueueQueue
 from .flask.models import IndiAllSkyDbCameraTable
@@ -77,6 +88,34 @@ class ImageWorker(Process):
     sqm_history_minutes = 30
     stars_history_minutes = 30
 
+    stage_timeout = 120  # seconds to wait for a stage worker to finish a frame
+
+    keogram_live_interval = 10  # frames between updates of the live keogram image
+
+    stage_i_ref_keys = (
+        'calibrated',
+        'exposure',
+        'exp_date',
+        'exp_elapsed',
+        'camera_id',
+        'camera_name',
+        'camera_uuid',
+        'image_bitpix',
+        'image_count',
+        'target_adu',
+        'sqm_value',
+        'lines',
+        'stars',
+        'stage_elapsed',
+        'quality_reduced',
+        'keogram_column',
+        'startrail_image',
+        'lines_background',
+        'lines_masked',
+        'night',
+        'moonmode',
+    )
+
     def __init__(
         self,
         idx,
@@ -94,6 +133,8 @@ class ImageWorker(Process):
         sensortemp_v,
         night_v,
         moonmode_v,
+        frame_ring=None,
+        ephemeris_table=None,
     ):
         super(ImageWorker, self).__init__()
 
@@ -105,6 +146,9 @@ class ImageWorker(Process):
         self.image_q = image_q
         self.upload_q = upload_q
 
+        self.frame_ring = frame_ring  # optional shared memory frame transport
+        self.ephemeris_table = ephemeris_table  # optional shared ephemeris table
+
         self.latitude_v = latitude_v
         self.longitude_v = longitude_v
 
@@ -129,16 +173,20 @@ class ImageWorker(Process):
 
         self.filename_t = 'ccd{0:d}_{1:s}.{2:s}'
 
-        self.target_adu_found = False
-        self.current_adu_target = 0
-        self.hist_adu = []
+        self._exposure_control = getExposureControl(self.config)
+        self._quality_governor = IndiAllSkyQualityGovernor(self.config)
+        self._fits_elapsed_s = None  # set by the asset writer thread
+
+        self._keogram_strip = None  # live keogram for the current day/night folder
+        self._startrail_live = None  # live star trails for the current night folder
+        self._ephemeris = IndiAllSkyEphemeris(self.config, latitude_v, longitude_v, shared_table=ephemeris_table)
 
         self.image_count = 0
 
         self.sqm_value = 0
 
         self._detection_mask = self._load_detection_mask()
-        self._adu_mask = self._detection_mask  # reuse detection mask for ADU mask (if defined)
+        self._adu_mask = None
 
         self.image_processor = ImageProcessor(
             self.config,
@@ -154,16 +202,36 @@ class ImageWorker(Process):
             moonmode_v,
             self.astrometric_data,
             mask=self._detection_mask,
+            ephemeris_table=self.ephemeris_table,
         )
 
+        # reuse detection mask for ADU mask (if defined), mapped to the processed frame
+        self._adu_mask = self.image_processor.geometry.mapMask(self._detection_mask)
+
         self._miscDb = miscDb(self.config)
 
+        self._asset_writer = IndiAllSkyAssetWriter(self.config)
+
         if self.config.get('IMAGE_FOLDER'):
             self.image_dir = Path(self.config['IMAGE_FOLDER']).absolute()
         else:
             self.image_dir = Path(__file__).parent.parent.joinpath('html', 'images').absolute()
 
 
+        # stateless stages can be run in parallel by a pool of stage workers
+        self._stage_workers = list()
+        self._stage_worker_count = int(self.config.get('IMAGE_STAGE_WORKERS', 0))
+        self._stage_worker_idx = 0
+        self._stage_job_q = None
+        self._stage_result_q = None
+        self._stage_error_q = None
+
+        # frames are finalized in the order they were received
+        self._stage_seq = 0
+        self._stage_pending = dict()  # insertion ordered, oldest first
+        self._stage_results = dict()
+
+
         self._shutdown = False
 
 
@@ -214,9 +282,33 @@ class ImageWorker(Process):
     def saferun(self):
         #raise Exception('Test exception handling in worker')
 
+        self._startStageWorkers()
+
+        try:
+            self._saferun()
+        finally:
+            self._stopStageWorkers()
+
+            if self._startrail_live:
+                self._startrail_live.checkpoint()
+
+            self._asset_writer.stop()
+
+
+    def _saferun(self):
         while True:
+            if self._stage_pending:
+                # poll for finished stages
+                with app.app_context():
+                    self._collectStageResults()
+
+                q_timeout = 0.25
+            else:
+                q_timeout = 23  # prime number
+
+
             try:
-                i_dict = self.image_q.get(timeout=23)  # prime number
+                i_dict = self.image_q.get(timeout=q_timeout)
             except queue.Empty:
                 continue
 
@@ -262,7 +354,6 @@ class ImageWorker(Process):
         #filename_t = task.data.get('filename_t')
         ###
 
-        filename_p = Path(i_dict['filename'])
         exposure = i_dict['exposure']
         exp_date = datetime.fromtimestamp(i_dict['exp_time'])
         exp_elapsed = i_dict['exp_elapsed']
@@ -276,16 +367,25 @@ class ImageWorker(Process):
         self.image_count += 1
 
 
-        if not filename_p.exists():
-            logger.error('Frame not found: %s', filename_p)
-            #task.setFailed('Frame not found: {0:s}'.format(str(filename_p)))
-            return
+        frame_slot = i_dict.get('frame_slot')
 
+        if isinstance(frame_slot, type(None)):
+            filename_p = Path(i_dict['filename'])
 
-        if filename_p.stat().st_size == 0:
-            logger.error('Frame is empty: %s', filename_p)
-            filename_p.unlink()
-            return
+            if not filename_p.exists():
+                logger.error('Frame not found: %s', filename_p)
+                #task.setFailed('Frame not found: {0:s}'.format(str(filename_p)))
+                return
+
+
+            if filename_p.stat().st_size == 0:
+                logger.error('Frame is empty: %s', filename_p)
+                filename_p.unlink()
+                return
+        else:
+            if not self.frame_ring:
+                logger.error('Frame received in shared memory slot %d, but shared memory is not configured', frame_slot)
+                return
 
 
         camera = IndiAllSkyDbCameraTable.query\
@@ -297,18 +397,52 @@ class ImageWorker(Process):
 
 
         try:
-            self.image_processor.add(filename_p, exposure, exp_date, exp_elapsed, camera)
+            if isinstance(frame_slot, type(None)):
+                self.image_processor.add(filename_p, exposure, exp_date, exp_elapsed, camera)
+            else:
+                self.image_processor.add_frame(
+                    self.frame_ring,
+                    frame_slot,
+                    i_dict['frame_shape'],
+                    i_dict['frame_dtype'],
+                    i_dict['frame_header'],
+                    exposure,
+                    exp_date,
+                    exp_elapsed,
+                    camera,
+                )
         except BadImage as e:
             logger.error('Bad Image: %s', str(e))
             #task.setFailed('Bad Image: {0:s}'.format(str(filename_p)))
             return
 
+
+        try:
+            self._processFrame(camera, exposure, processing_start)
+        finally:
+            # the slot is released here unless a stage worker owns the frame
+            self._releaseFrameSlot(self.image_processor.detachFrame(self.frame_ring))
+
+
+    def _processFrame(self, camera, exposure, processing_start):
         self.image_processor.calibrate()
 
 
-        if self.config.get('IMAGE_SAVE_FITS'):
+        # optional stages reduced to keep up with the exposure period
+        quality_reduced = self._quality_governor.reduced
+        self.image_processor.quality_reduced = quality_reduced
+        self.image_processor.getLatestImage()['quality_reduced'] = quality_reduced
+
+
+        fits_data = None
+        if self.config.get('IMAGE_SAVE_FITS') and 'fits' not in quality_reduced:
             i_ref = self.image_processor.getLatestImage()
-            self.write_fit(i_ref, camera)
+
+            if self._stage_workers:
+                # written by a stage worker, the hdulist is reused for stacking
+                fits_data = (numpy.copy(i_ref['hdulist'][0].data), i_ref['hdulist'][0].header.tostring())
+            else:
+                self.write_fit(i_ref, camera)
 
 
         self.image_processor.calculateSqm()
@@ -324,15 +458,18 @@ class ImageWorker(Process):
 
 
         i_ref = self.image_processor.getLatestImage()
+        i_ref['image_count'] = self.image_count
 
         ### IMAGE IS CALIBRATED ###
 
 
+        raw_data = None
         if self.config.get('IMAGE_EXPORT_RAW'):
-            self.export_raw_image(i_ref)
-
-
-        self.image_processor.convert_16bit_to_8bit()
+            if self._stage_workers:
+                # written by a stage worker
+                raw_data = (self.image_processor.non_stacked_image, self.image_processor.max_bit_depth)
+            else:
+                self.export_raw_image(i_ref)
 
 
         #with io.open('/tmp/indi_allsky_numpy.npy', 'w+b') as f_numpy:
@@ -358,82 +495,194 @@ class ImageWorker(Process):
             self.image_processor.flip(1)
 
 
-        # adu calculate (before processing)
-        adu, adu_average = self.calculate_histogram(self.image_processor.image, exposure)
+        # crop and scale as early as possible, regions of interest are mapped to match
+        if self.config.get('IMAGE_CROP_ROI'):
+            self.image_processor.crop_image()
 
+        if self.image_processor.early_scale:
+            self.image_processor.scale_image()
 
-        # line detection
-        if self.night_v.value and self.config.get('DETECT_METEORS'):
-            self.image_processor.detectLines()
 
+        self.image_processor.convert_16bit_to_8bit()
 
-        # star detection
-        if self.night_v.value and self.config.get('DETECT_STARS', True):
-            self.image_processor.detectStars()
 
+        # statistics shared by the measurement and detection stages
+        self.image_processor.calculateFrameStats()
 
-        # additional draw code
-        if self.config.get('DETECT_DRAW'):
-            self.image_processor.drawDetections()
 
+        # adu calculate (before color balance and processing)
+        adu, adu_average = self.calculate_histogram(self.image_processor.image, exposure, frame_stats=self.image_processor.frame_stats)
 
-        # crop
-        if self.config.get('IMAGE_CROP_ROI'):
-            self.image_processor.crop_image()
 
+        # green removal and white balance
+        if self.image_processor.color_balance():
+            self.image_processor.calculateFrameStats()
 
-        # green removal
-        scnr_algo = self.config.get('SCNR_ALGORITHM')
-        if scnr_algo:
-            self.image_processor.scnr(scnr_algo)
 
+        # stage workers receive frames out of order, the background is updated here
+        self.image_processor.updateLinesBackground()
 
-        # white balance
-        self.image_processor.white_balance_manual_bgr()
 
-        if self.config.get('AUTO_WB'):
-            self.image_processor.white_balance_auto_bgr()
+        if self._stage_workers:
+            # remaining stages do not depend on earlier frames
+            self._dispatchStage(i_ref, camera, adu, adu_average, time.time() - processing_start, fits_data, raw_data)
+            return
 
 
-        if not self.night_v.value and self.config['DAYTIME_CONTRAST_ENHANCE']:
-            # Contrast enhancement during the day
-            self.image_processor.contrast_clahe()
-        elif self.night_v.value and self.config['NIGHT_CONTRAST_ENHANCE']:
-            # Contrast enhancement during night
-            self.image_processor.contrast_clahe()
+        self.image_processor.post_process()
 
 
-        self.image_processor.colorize()
+        processing_elapsed_s = time.time() - processing_start
+        logger.info('Image processed in %0.4f s', processing_elapsed_s)
 
 
-        self.image_processor.apply_image_circle_mask()
+        tmpfile_name = self.image_processor.encode_image(self.image_processor.image, self.getImageTmpFolder(i_ref, camera))
 
+        self._governQuality(i_ref, processing_elapsed_s)
 
-        self.image_processor.apply_logo_overlay()
+        self._finalizeImage(i_ref, camera, adu, adu_average, tmpfile_name, processing_elapsed_s)
 
 
-        if self.config['IMAGE_SCALE'] and self.config['IMAGE_SCALE'] != 100:
-            self.image_processor.scale_image()
+    def _releaseFrameSlot(self, frame_slot):
+        if isinstance(frame_slot, type(None)):
+            return
 
+        self.frame_ring.release(frame_slot)
 
-        # blur
-        #self.image_processor.median_blur()
 
-        # denoise
-        #self.image_processor.fastDenoise()
+    def _appendKeogramColumn(self, i_ref, day_folder):
+        column, dimensions = i_ref['keogram_column']
 
-        self.image_processor.image_text()
+        if isinstance(self._keogram_strip, type(None)) or self._keogram_strip.folder_p != day_folder:
+            # new day or night
+            self._keogram_strip = IndiAllSkyKeogramStrip(day_folder)
 
 
-        processing_elapsed_s = time.time() - processing_start
-        logger.info('Image processed in %0.4f s', processing_elapsed_s)
+        keogram_start = time.time()
+
+        self._keogram_strip.append(column, i_ref['exp_date'].timestamp(), dimensions)
+
+        keogram_elapsed_s = time.time() - keogram_start
+        logger.info('Keogram column stored in %0.4f s', keogram_elapsed_s)
+
+
+        if self._keogram_strip.count % self.keogram_live_interval == 0:
+            self._asset_writer.submit(
+                self._writeLiveKeogram,
+                self._keogram_strip.getData(),
+                self._keogram_strip.getTimestamps(),
+                self._keogram_strip.info,
+            )
+
+
+    def _writeLiveKeogram(self, keogram_data, timestamps_list, dimensions):
+        # runs on the asset writer thread
+        kg = KeogramGenerator(self.config)
+        kg.h_scale_factor = self.config['KEOGRAM_H_SCALE']
+        kg.v_scale_factor = self.config['KEOGRAM_V_SCALE']
+        kg.loadStrip(keogram_data, timestamps_list, dimensions)
+
+        keogram = kg.render()
+
+        tmpfile_p = self.image_processor.encode_image(keogram, self.image_dir)
+
+        keogram_latest_p = self.image_dir.joinpath('keogram_latest.{0:s}'.format(self.config['IMAGE_FILE_TYPE']))
+        self._asset_writer.publish(tmpfile_p, keogram_latest_p, replace=True)
+
+
+    def _addStarTrailImage(self, i_ref, night_folder):
+        if isinstance(self._startrail_live, type(None)) or self._startrail_live.folder_p != night_folder:
+            if self._startrail_live:
+                # previous night
+                self._startrail_live.checkpoint()
+
+            self._startrail_live = IndiAllSkyStarTrailAccumulator(self.config, self.bin_v, night_folder, mask=self._detection_mask)
+            self._startrail_live.max_brightness = self.config['STARTRAILS_MAX_ADU']
+            self._startrail_live.mask_threshold = self.config['STARTRAILS_MASK_THOLD']
+            self._startrail_live.pixel_cutoff_threshold = self.config['STARTRAILS_PIXEL_THOLD']
+
+
+        startrail_start = time.time()
+
+        checkpoint = self._startrail_live.addImage(i_ref['startrail_image'])
+
+        startrail_elapsed_s = time.time() - startrail_start
+        logger.info('Star trails updated in %0.4f s', startrail_elapsed_s)
+
+
+        if checkpoint:
+            preview = self._startrail_live.getImage()
+
+            if not isinstance(preview, type(None)):
+                self._asset_writer.submit(self._writeLiveStarTrail, preview)
+
+
+    def _writeLiveStarTrail(self, startrail):
+        # runs on the asset writer thread
+        tmpfile_p = self.image_processor.encode_image(startrail, self.image_dir)
+
+        startrail_latest_p = self.image_dir.joinpath('startrail_latest.{0:s}'.format(self.config['IMAGE_FILE_TYPE']))
+        self._asset_writer.publish(tmpfile_p, startrail_latest_p, replace=True)
+
+
+    def _governQuality(self, i_ref, frame_cost):
+        if i_ref['night']:
+            budget = float(self.config['EXPOSURE_PERIOD'])
+        else:
+            budget = float(self.config['EXPOSURE_PERIOD_DAY'])
+
+
+        queue_depth = self.image_q.qsize()
+
+
+        stage_elapsed = dict(i_ref['stage_elapsed'])
+
+        if not isinstance(self._fits_elapsed_s, type(None)):
+            # written in the background
+            stage_elapsed['fits'] = self._fits_elapsed_s
+            self._fits_elapsed_s = None
+
+
+        change = self._quality_governor.update(frame_cost, budget, queue_depth, stage_elapsed)
+        if not change:
+            return
+
+        action, stage, message = change
+
+        logger.warning('%s', message)
+
+        # every transition gets a new item, repeated changes of a stage are not duplicates
+        self._miscDb.addNotification(
+            NotificationCategory.WORKER,
+            '{0:s}_{1:s}_{2:x}'.format(action, stage, int(time.time())),  # 32 characters max
+            message,
+            expire=timedelta(hours=2),
+        )
+
+
+    def _finalizeImage(self, i_ref, camera, adu, adu_average, tmpfile_name, processing_elapsed_s):
+        # database updates and uploads, frames must be finalized in order
+        exposure = i_ref['exposure']
+        exp_date = i_ref['exp_date']
+        exp_elapsed = i_ref['exp_elapsed']
+        camera_id = i_ref['camera_id']
 
 
         #task.setSuccess('Image processed')
 
         self.write_status_json(i_ref, adu, adu_average)  # write json status file
 
-        latest_file, new_filename = self.write_img(self.image_processor.image, i_ref, camera)
+        latest_file, new_filename = self._store_img(tmpfile_name, i_ref, camera)
+
+        if new_filename and not isinstance(i_ref['keogram_column'], type(None)):
+            # strip is stored in the day/night folder
+            self._appendKeogramColumn(i_ref, new_filename.parent.parent)
+
+        if new_filename and not isinstance(i_ref['startrail_image'], type(None)):
+            self._addStarTrailImage(i_ref, new_filename.parent.parent)
+
+        # the final image is not kept with the stacked frames
+        i_ref['startrail_image'] = None
 
         if new_filename:
             image_metadata = {
@@ -445,16 +694,17 @@ class ImageWorker(Process):
                 'binmode'         : self.bin_v.value,
                 'temp'            : self.sensortemp_v.value,
                 'adu'             : adu,
-                'stable'          : self.target_adu_found,
-                'moonmode'        : bool(self.moonmode_v.value),
+                'stable'          : self._exposure_control.stable,
+                'moonmode'        : bool(i_ref['moonmode']),
                 'moonphase'       : self.astrometric_data['moon_phase'],
-                'night'           : bool(self.night_v.value),
+                'night'           : bool(i_ref['night']),
                 'adu_roi'         : self.config['ADU_ROI'],
                 'calibrated'      : i_ref['calibrated'],
                 'sqm'             : i_ref['sqm_value'],
                 'stars'           : len(i_ref['stars']),
                 'detections'      : len(i_ref['lines']),
                 'process_elapsed' : processing_elapsed_s,
+                'quality'         : IndiAllSkyQualityGovernor.stageMask(i_ref['quality_reduced']),
                 'camera_uuid'     : i_ref['camera_uuid'],
             }
 
@@ -479,8 +729,8 @@ class ImageWorker(Process):
                 'sunalt'   : round(self.astrometric_data['sun_alt'], 1),
                 'moonalt'  : round(self.astrometric_data['moon_alt'], 1),
                 'moonphase': round(self.astrometric_data['moon_phase'], 1),
-                'moonmode' : bool(self.moonmode_v.value),
-                'night'    : bool(self.night_v.value),
+                'moonmode' : bool(i_ref['moonmode']),
+                'night'    : bool(i_ref['night']),
                 'sqm'      : round(i_ref['sqm_value'], 1),
                 'stars'    : len(i_ref['stars']),
                 'latitude' : round(self.latitude_v.value, 3),
@@ -566,6 +816,239 @@ class ImageWorker(Process):
             self.upload_metadata(i_ref, adu, adu_average)
 
 
+    def _startStageWorkers(self):
+        if not self._stage_worker_count:
+            return
+
+        self._stage_job_q = Queue()
+        self._stage_result_q = Queue()
+        self._stage_error_q = Queue()
+
+        for x in range(self._stage_worker_count):
+            self._stage_workers.append(self._startStageWorker())
+
+
+    def _startStageWorker(self):
+        self._stage_worker_idx += 1
+
+        logger.info('Starting ImageStageWorker process %d', self._stage_worker_idx)
+        stage_worker = ImageStageWorker(
+            self._stage_worker_idx,
+            self.config,
+            self._stage_error_q,
+            self._stage_job_q,
+            self._stage_result_q,
+            mask=self._detection_mask,
+            ephemeris_table=self.ephemeris_table,
+        )
+        stage_worker.start()
+
+        return stage_worker
+
+
+    def _checkStageWorkers(self):
+        for i, stage_worker in enumerate(self._stage_workers):
+            if stage_worker.is_alive():
+                continue
+
+            try:
+                stage_error, stage_traceback = self._stage_error_q.get_nowait()
+                for line in stage_traceback.split('\n'):
+                    logger.error('Stage worker exception: %s', line)
+            except queue.Empty:
+                pass
+
+            self._stage_workers[i] = self._startStageWorker()
+
+
+    def _stopStageWorkers(self):
+        if not self._stage_workers:
+            return
+
+
+        # finish the frames already in progress
+        stop_time = time.time() + self.stage_timeout
+        while self._stage_pending and time.time() < stop_time:
+            with app.app_context():
+                self._collectStageResults(timeout=1.0)
+
+
+        logger.info('Stopping ImageStageWorker processes')
+        for stage_worker in self._stage_workers:
+            self._stage_job_q.put({'stop' : True})
+
+        for stage_worker in self._stage_workers:
+            stage_worker.join(timeout=30.0)
+
+        self._stage_workers = list()
+
+
+    def _dispatchStage(self, i_ref, camera, adu, adu_average, processing_elapsed_s, fits_data, raw_data):
+        # limit the number of frames in flight
+        while len(self._stage_pending) >= self._stage_worker_count * 2:
+            self._collectStageResults(timeout=1.0)
+
+
+        seq = self._stage_seq
+        self._stage_seq += 1
+
+
+        # only the picklable values are sent to the stage worker
+        stage_i_ref = {k : i_ref[k] for k in self.stage_i_ref_keys}
+
+        self._stage_pending[seq] = {
+            'i_ref'           : stage_i_ref,
+            'camera_id'       : camera.id,
+            'adu'             : adu,
+            'adu_average'     : adu_average,
+            'process_elapsed' : processing_elapsed_s,
+            'dispatch_time'   : time.time(),
+            'frame_slot'      : None,
+        }
+
+
+        # temporary files are created next to their final location
+        folders = {
+            'image' : str(self.getImageTmpFolder(i_ref, camera)),
+            'fits'  : None,
+            'raw'   : None,
+        }
+
+        if fits_data:
+            folders['fits'] = str(self.getImageFolder(i_ref['exp_date'], camera, i_ref['night']))
+
+        if raw_data:
+            folders['raw'] = str(self.getRawFolder(i_ref['exp_date'], i_ref['night']))
+
+
+        job = {
+            'seq'     : seq,
+            'image'   : self.image_processor.image,
+            'i_ref'   : stage_i_ref,
+            'fits'    : fits_data,
+            'raw'     : raw_data,
+            'folders' : folders,
+            'values' : {
+                'latitude'   : self.latitude_v.value,
+                'longitude'  : self.longitude_v.value,
+                'ra'         : self.ra_v.value,
+                'dec'        : self.dec_v.value,
+                'exposure'   : self.exposure_v.value,
+                'gain'       : self.gain_v.value,
+                'bin'        : self.bin_v.value,
+                'sensortemp' : self.sensortemp_v.value,
+                'night'      : self.night_v.value,
+                'moonmode'   : self.moonmode_v.value,
+            },
+        }
+
+        self._stage_job_q.put(job)
+
+        # the stage worker owns the processed image now
+        self.image_processor.image = None
+        i_ref['lines_background'] = None
+        i_ref['lines_masked'] = None
+
+        # the job may reference the shared memory slot until the result is returned
+        self._stage_pending[seq]['frame_slot'] = self.image_processor.detachFrame(self.frame_ring)
+
+
+    def _collectStageResults(self, timeout=None):
+        self._checkStageWorkers()
+
+
+        try:
+            if timeout:
+                result = self._stage_result_q.get(timeout=timeout)
+            else:
+                result = self._stage_result_q.get_nowait()
+
+            while True:
+                if result['seq'] in self._stage_pending:
+                    self._stage_results[result['seq']] = result
+                else:
+                    # frame was already abandoned
+                    self._removeStageFiles(result)
+
+                result = self._stage_result_q.get_nowait()
+        except queue.Empty:
+            pass
+
+
+        while self._stage_pending:
+            seq = next(iter(self._stage_pending))  # oldest frame
+
+            result = self._stage_results.pop(seq, None)
+            if isinstance(result, type(None)):
+                pending = self._stage_pending[seq]
+
+                if time.time() - pending['dispatch_time'] < self.stage_timeout:
+                    # wait for the oldest frame before finalizing newer frames
+                    return
+
+                logger.error('Frame %d was not processed within %d seconds, skipping', seq, self.stage_timeout)
+                pending = self._stage_pending.pop(seq)
+                self._releaseFrameSlot(pending['frame_slot'])
+                continue
+
+
+            pending = self._stage_pending.pop(seq)
+            self._releaseFrameSlot(pending['frame_slot'])
+
+            if result['error']:
+                for line in result['error'].split('\n'):
+                    logger.error('Stage worker exception: %s', line)
+
+                self._removeStageFiles(result)
+                continue
+
+
+            self._finalizeStageResult(pending, result)
+
+
+    def _finalizeStageResult(self, pending, result):
+        i_ref = pending['i_ref']
+        i_ref['stars'] = result['stars']
+        i_ref['lines'] = result['lines']
+        i_ref['stage_elapsed'].update(result['stage_elapsed'])
+        i_ref['keogram_column'] = result['keogram_column']
+        i_ref['startrail_image'] = result['startrail_image']
+
+        self.astrometric_data.update(result['astrometric_data'])
+
+
+        camera = IndiAllSkyDbCameraTable.query\
+            .filter(IndiAllSkyDbCameraTable.id == pending['camera_id'])\
+            .one()
+
+
+        if result['fits_tmpfile']:
+            self._store_fit(Path(result['fits_tmpfile']), i_ref, camera)
+
+        if result['raw_tmpfile']:
+            self._store_raw(Path(result['raw_tmpfile']), i_ref)
+
+
+        processing_elapsed_s = pending['process_elapsed'] + result['process_elapsed']
+        logger.info('Image processed in %0.4f s', processing_elapsed_s)
+
+        # stage workers process frames in parallel
+        self._governQuality(i_ref, pending['process_elapsed'] + (result['process_elapsed'] / self._stage_worker_count))
+
+        self._finalizeImage(i_ref, camera, pending['adu'], pending['adu_average'], Path(result['tmpfile']), processing_elapsed_s)
+
+
+    def _removeStageFiles(self, result):
+        for k in ('tmpfile', 'fits_tmpfile', 'raw_tmpfile'):
+            if not result.get(k):
+                continue
+
+            try:
+                Path(result[k]).unlink()
+            except FileNotFoundError:
+                pass
+
+
     def upload_image(self, i_ref, image_entry, camera):
         ### upload images
         if not self.config.get('FILETRANSFER', {}).get('UPLOAD_IMAGE'):
@@ -578,8 +1061,8 @@ class ImageWorker(Process):
             return
 
 
-        if (self.image_count % int(self.config['FILETRANSFER']['UPLOAD_IMAGE'])) != 0:
-            next_image = int(self.config['FILETRANSFER']['UPLOAD_IMAGE']) - (self.image_count % int(self.config['FILETRANSFER']['UPLOAD_IMAGE']))
+        if (i_ref['image_count'] % int(self.config['FILETRANSFER']['UPLOAD_IMAGE'])) != 0:
+            next_image = int(self.config['FILETRANSFER']['UPLOAD_IMAGE']) - (i_ref['image_count'] % int(self.config['FILETRANSFER']['UPLOAD_IMAGE']))
             logger.info('Next image upload in %d images (%d s)', next_image, int(self.config['EXPOSURE_PERIOD'] * next_image))
             return
 
@@ -636,21 +1119,21 @@ class ImageWorker(Process):
 
 
         ### Only uploading metadata if image uploading is enabled
-        if (self.image_count % int(self.config['FILETRANSFER']['UPLOAD_IMAGE'])) != 0:
-            #next_image = int(self.config['FILETRANSFER']['UPLOAD_IMAGE']) - (self.image_count % int(self.config['FILETRANSFER']['UPLOAD_IMAGE']))
+        if (i_ref['image_count'] % int(self.config['FILETRANSFER']['UPLOAD_IMAGE'])) != 0:
+            #next_image = int(self.config['FILETRANSFER']['UPLOAD_IMAGE']) - (i_ref['image_count'] % int(self.config['FILETRANSFER']['UPLOAD_IMAGE']))
             #logger.info('Next image upload in %d images (%d s)', next_image, int(self.config['EXPOSURE_PERIOD'] * next_image))
             return
 
 
         metadata = {
             'device'              : i_ref['camera_name'],
-            'night'               : self.night_v.value,
+            'night'               : i_ref['night'],
             'temp'                : self.sensortemp_v.value,
             'gain'                : self.gain_v.value,
             'exposure'            : i_ref['exposure'],
-            'stable_exposure'     : int(self.target_adu_found),
+            'stable_exposure'     : int(self._exposure_control.stable),
             'target_adu'          : i_ref['target_adu'],
-            'current_adu_target'  : self.current_adu_target,
+            'current_adu_target'  : self._exposure_control.current_adu_target,
             'current_adu'         : adu,
             'adu_average'         : adu_average,
             'sqm'                 : i_ref['sqm_value'],
@@ -661,6 +1144,7 @@ class ImageWorker(Process):
             'latitude'            : self.latitude_v.value,
             'longitude'           : self.longitude_v.value,
             'sidereal_time'       : self.astrometric_data['sidereal_time'],
+            'quality_reduced'     : list(i_ref['quality_reduced']),
         }
 
 
@@ -845,21 +1329,46 @@ class ImageWorker(Process):
 
 
     def write_fit(self, i_ref, camera):
-        f_tmpfile = tempfile.NamedTemporaryFile(mode='w+b', delete=False, suffix='.fit')
+        filename = self._addFitsEntry(i_ref, camera)
+
+        # the data is reused for stacking
+        hdu = fits.PrimaryHDU(numpy.copy(i_ref['hdulist'][0].data), header=i_ref['hdulist'][0].header.copy())
+
+        self._asset_writer.submit(self._writeFit, fits.HDUList([hdu]), filename)
+
+
+    def _writeFit(self, hdulist, filename):
+        # runs on the asset writer thread
+        fits_start = time.time()
+
+        tmpfile_p = self.image_processor.encode_fit(hdulist, filename.parent)
+
+        self._fits_elapsed_s = time.time() - fits_start
 
-        i_ref['hdulist'].writeto(f_tmpfile)
-        f_tmpfile.close()
+        if self._asset_writer.publish(tmpfile_p, filename):
+            logger.info('Finished writing fit file')
 
-        tmpfile_p = Path(f_tmpfile.name)
 
+    def _store_fit(self, tmpfile_p, i_ref, camera):
+        filename = self._addFitsEntry(i_ref, camera)
+
+        if self._asset_writer.publish(tmpfile_p, filename):
+            logger.info('Finished writing fit file')
+
+
+    def _addFitsEntry(self, i_ref, camera):
+        if self.config.get('IMAGE_SAVE_FITS_COMPRESS'):
+            fits_ext = 'fit.fz'
+        else:
+            fits_ext = 'fit'
 
         date_str = i_ref['exp_date'].strftime('%Y%m%d_%H%M%S')
         # raw light
-        folder = self.getImageFolder(i_ref['exp_date'], camera)
+        folder = self.getImageFolder(i_ref['exp_date'], camera, i_ref['night'])
         filename = folder.joinpath(self.filename_t.format(
             i_ref['camera_id'],
             date_str,
-            'fit',
+            fits_ext,
         ))
 
 
@@ -869,7 +1378,8 @@ class ImageWorker(Process):
             'exposure'   : i_ref['exposure'],
             'gain'       : self.gain_v.value,
             'binmode'    : self.bin_v.value,
-            'night'      : bool(self.night_v.value),
+            'night'      : bool(i_ref['night']),
+            'compressed' : bool(self.config.get('IMAGE_SAVE_FITS_COMPRESS')),
             'camera_uuid': i_ref['camera_uuid'],
         }
 
@@ -880,29 +1390,9 @@ class ImageWorker(Process):
         )
 
 
-        file_dir = filename.parent
-        if not file_dir.exists():
-            file_dir.mkdir(mode=0o755, parents=True)
-
         logger.info('fit filename: %s', filename)
 
-
-        if filename.exists():
-            logger.error('File exists: %s (skipping)', filename)
-            tmpfile_p.unlink()
-            return
-
-
-        shutil.copy2(str(tmpfile_p), str(filename))
-        filename.chmod(0o644)
-
-        # set mtime to original exposure time
-        #os.utime(str(filename), (i_ref['exp_date'].timestamp(), i_ref['exp_date'].timestamp()))
-
-        tmpfile_p.unlink()
-
-
-        logger.info('Finished writing fit file')
+        return filename
 
 
     def export_raw_image(self, i_ref):
@@ -914,101 +1404,44 @@ class ImageWorker(Process):
             return
 
 
-        f_tmpfile = tempfile.NamedTemporaryFile(mode='w+b', delete=False, suffix='.{0}'.format(self.config['IMAGE_EXPORT_RAW']))
-        f_tmpfile.close()
+        filename = self._addRawEntry(i_ref)
 
-        tmpfile_name = Path(f_tmpfile.name)
+        self._asset_writer.submit(
+            self._writeRaw,
+            self.image_processor.non_stacked_image,
+            i_ref['image_bitpix'],
+            self.image_processor.max_bit_depth,
+            filename,
+        )
 
 
-        data = self.image_processor.non_stacked_image
-        max_bit_depth = self.image_processor.max_bit_depth
+    def _writeRaw(self, data, image_bitpix, max_bit_depth, filename):
+        # runs on the asset writer thread
+        tmpfile_name = self.image_processor.encode_raw(data, image_bitpix, max_bit_depth, filename.parent)
 
-        if i_ref['image_bitpix'] == 8:
-            # nothing to scale
-            scaled_data = data
-        elif i_ref['image_bitpix'] == 16:
-            if max_bit_depth == 8:
-                logger.info('Upscaling data from 8 to 16 bit')
-                scaled_data = numpy.left_shift(data, 8)
-            elif max_bit_depth == 9:
-                logger.info('Upscaling data from 9 to 16 bit')
-                scaled_data = numpy.left_shift(data, 7)
-            elif max_bit_depth == 10:
-                logger.info('Upscaling data from 10 to 16 bit')
-                scaled_data = numpy.left_shift(data, 6)
-            elif max_bit_depth == 11:
-                logger.info('Upscaling data from 11 to 16 bit')
-                scaled_data = numpy.left_shift(data, 5)
-            elif max_bit_depth == 12:
-                logger.info('Upscaling data from 12 to 16 bit')
-                scaled_data = numpy.left_shift(data, 4)
-            elif max_bit_depth == 13:
-                logger.info('Upscaling data from 13 to 16 bit')
-                scaled_data = numpy.left_shift(data, 3)
-            elif max_bit_depth == 14:
-                logger.info('Upscaling data from 14 to 16 bit')
-                scaled_data = numpy.left_shift(data, 2)
-            elif max_bit_depth == 15:
-                logger.info('Upscaling data from 15 to 16 bit')
-                scaled_data = numpy.left_shift(data, 1)
-            elif max_bit_depth == 16:
-                # nothing to scale
-                scaled_data = data
-            else:
-                # assume 16 bit
-                scaled_data = data
-        else:
-            raise Exception('Unsupported bit depth')
+        self._asset_writer.publish(tmpfile_name, filename)
 
 
+    def _store_raw(self, tmpfile_name, i_ref):
+        filename = self._addRawEntry(i_ref)
 
-        write_img_start = time.time()
-
-        if self.config['IMAGE_EXPORT_RAW'] in ('jpg', 'jpeg'):
-            if i_ref['image_bitpix'] == 8:
-                scaled_data_8 = scaled_data
-            else:
-                # jpeg has to be 8 bits
-                logger.info('Resampling image from %d to 8 bits', i_ref['image_bitpix'])
-
-                div_factor = int((2 ** max_bit_depth) / 255)
-                scaled_data_8 = (scaled_data / div_factor).astype(numpy.uint8)
-
-            cv2.imwrite(str(tmpfile_name), scaled_data_8, [cv2.IMWRITE_JPEG_QUALITY, self.config['IMAGE_FILE_COMPRESSION']['jpg']])
-        elif self.config['IMAGE_EXPORT_RAW'] in ('png',):
-            cv2.imwrite(str(tmpfile_name), scaled_data, [cv2.IMWRITE_PNG_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['png']])
-        elif self.config['IMAGE_EXPORT_RAW'] in ('tif', 'tiff'):
-            cv2.imwrite(str(tmpfile_name), scaled_data, [cv2.IMWRITE_TIFF_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['tif']])
-
-            #with TiffWriter(str(tmpfile_name), ) as tif:
-            #    tif.write(
-            #        scaled_data,
-            #        compression='lzw',  # requires imagecodecs
-            #        metadata={'foo': 'bar'},
-            #    )
-        else:
-            raise Exception('Unknown file type: %s', self.config['IMAGE_EXPORT_RAW'])
-
-        write_img_elapsed_s = time.time() - write_img_start
-        logger.info('Raw image written in %0.4f s', write_img_elapsed_s)
-
+        self._asset_writer.publish(tmpfile_name, filename)
 
 
+    def getRawFolder(self, exp_date, night):
         export_dir = Path(self.config['IMAGE_EXPORT_FOLDER'])
 
-        if self.night_v.value:
+        if night:
             # images should be written to previous day's folder until noon
-            day_ref = i_ref['exp_date'] - timedelta(hours=12)
+            day_ref = exp_date - timedelta(hours=12)
             timeofday_str = 'night'
         else:
             # daytime
             # images should be written to current day's folder
-            day_ref = i_ref['exp_date']
+            day_ref = exp_date
             timeofday_str = 'day'
 
-        date_str = i_ref['exp_date'].strftime('%Y%m%d_%H%M%S')
-
-        hour_str = i_ref['exp_date'].strftime('%d_%H')
+        hour_str = exp_date.strftime('%d_%H')
 
         day_folder = export_dir.joinpath('{0:s}'.format(day_ref.strftime('%Y%m%d')), timeofday_str)
         if not day_folder.exists():
@@ -1018,6 +1451,13 @@ class ImageWorker(Process):
         if not hour_folder.exists():
             hour_folder.mkdir(mode=0o755)
 
+        return hour_folder
+
+
+    def _addRawEntry(self, i_ref):
+        hour_folder = self.getRawFolder(i_ref['exp_date'], i_ref['night'])
+
+        date_str = i_ref['exp_date'].strftime('%Y%m%d_%H%M%S')
 
         raw_filename_t = 'raw_{0:s}'.format(self.filename_t)
         filename = hour_folder.joinpath(raw_filename_t.format(
@@ -1033,7 +1473,7 @@ class ImageWorker(Process):
             'exposure'   : i_ref['exposure'],
             'gain'       : self.gain_v.value,
             'binmode'    : self.bin_v.value,
-            'night'      : bool(self.night_v.value),
+            'night'      : bool(i_ref['night']),
             'camera_uuid': i_ref['camera_uuid'],
         }
 
@@ -1046,72 +1486,47 @@ class ImageWorker(Process):
 
         logger.info('RAW filename: %s', filename)
 
-        if filename.exists():
-            logger.error('File exists: %s (skipping)', filename)
-            tmpfile_name.unlink()
-            return
-
-
-        shutil.copy2(str(tmpfile_name), str(filename))
-        filename.chmod(0o644)
-
-        tmpfile_name.unlink()
-
-        # set mtime to original exposure time
-        #os.utime(str(filename), (i_ref['exp_date'].timestamp(), i_ref['exp_date'].timestamp()))
+        return filename
 
 
     def write_img(self, data, i_ref, camera):
-        f_tmpfile = tempfile.NamedTemporaryFile(mode='w+b', delete=False, suffix='.{0}'.format(self.config['IMAGE_FILE_TYPE']))
-        f_tmpfile.close()
+        tmpfile_name = self.image_processor.encode_image(data, self.getImageTmpFolder(i_ref, camera))
 
-        tmpfile_name = Path(f_tmpfile.name)
+        return self._store_img(tmpfile_name, i_ref, camera)
 
 
-        write_img_start = time.time()
+    def getImageTmpFolder(self, i_ref, camera):
+        # encode on the same filesystem as the final file
+        if self.config.get('FOCUS_MODE', False):
+            return self.image_dir
 
-        # write to temporary file
-        if self.config['IMAGE_FILE_TYPE'] in ('jpg', 'jpeg'):
-            cv2.imwrite(str(tmpfile_name), data, [cv2.IMWRITE_JPEG_QUALITY, self.config['IMAGE_FILE_COMPRESSION']['jpg']])
-        elif self.config['IMAGE_FILE_TYPE'] in ('png',):
-            cv2.imwrite(str(tmpfile_name), data, [cv2.IMWRITE_PNG_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['png']])
-        elif self.config['IMAGE_FILE_TYPE'] in ('tif', 'tiff'):
-            cv2.imwrite(str(tmpfile_name), data, [cv2.IMWRITE_TIFF_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['tif']])
-        else:
-            raise Exception('Unknown file type: %s', self.config['IMAGE_FILE_TYPE'])
+        if not i_ref['night'] and not self.config['DAYTIME_TIMELAPSE']:
+            return self.image_dir
 
-        write_img_elapsed_s = time.time() - write_img_start
-        logger.info('Image compressed in %0.4f s', write_img_elapsed_s)
+        return self.getImageFolder(i_ref['exp_date'], camera, i_ref['night'])
 
 
+    def _store_img(self, tmpfile_name, i_ref, camera):
         ### Always write the latest file for web access
         latest_file = self.image_dir.joinpath('latest.{0:s}'.format(self.config['IMAGE_FILE_TYPE']))
 
-        try:
-            latest_file.unlink()
-        except FileNotFoundError:
-            pass
-
-
-        shutil.copy2(str(tmpfile_name), str(latest_file))
-        latest_file.chmod(0o644)
-
 
         ### disable timelapse images in focus mode
         if self.config.get('FOCUS_MODE', False):
             logger.warning('Focus mode enabled, not saving timelapse image')
+            self._asset_writer.publish(tmpfile_name, latest_file, replace=True)
             return None, None
 
 
         ### Do not write daytime image files if daytime timelapse is disabled
-        if not self.night_v.value and not self.config['DAYTIME_TIMELAPSE']:
+        if not i_ref['night'] and not self.config['DAYTIME_TIMELAPSE']:
             logger.info('Daytime timelapse is disabled')
-            tmpfile_name.unlink()
+            self._asset_writer.publish(tmpfile_name, latest_file, replace=True)
             return latest_file, None
 
 
         ### Write the timelapse file
-        folder = self.getImageFolder(i_ref['exp_date'], camera)
+        folder = self.getImageFolder(i_ref['exp_date'], camera, i_ref['night'])
 
         date_str = i_ref['exp_date'].strftime('%Y%m%d_%H%M%S')
         filename = folder.joinpath(self.filename_t.format(i_ref['camera_id'], date_str, self.config['IMAGE_FILE_TYPE']))
@@ -1120,14 +1535,12 @@ class ImageWorker(Process):
 
         if filename.exists():
             logger.error('File exists: %s (skipping)', filename)
-            tmpfile_name.unlink()
+            self._asset_writer.publish(tmpfile_name, latest_file, replace=True)
             return latest_file, None
 
 
-        shutil.copy2(str(tmpfile_name), str(filename))
-        filename.chmod(0o644)
-
-        tmpfile_name.unlink()
+        # latest file is a link to the timelapse file
+        self._asset_writer.publish(tmpfile_name, filename, latest_p=latest_file)
 
 
         # set mtime to original exposure time
@@ -1143,13 +1556,13 @@ class ImageWorker(Process):
             'name'                : 'indi_json',
             'class'               : 'ccd',
             'device'              : i_ref['camera_name'],
-            'night'               : self.night_v.value,
+            'night'               : i_ref['night'],
             'temp'                : self.sensortemp_v.value,
             'gain'                : self.gain_v.value,
             'exposure'            : i_ref['exposure'],
-            'stable_exposure'     : int(self.target_adu_found),
+            'stable_exposure'     : int(self._exposure_control.stable),
             'target_adu'          : i_ref['target_adu'],
-            'current_adu_target'  : self.current_adu_target,
+            'current_adu_target'  : self._exposure_control.current_adu_target,
             'current_adu'         : adu,
             'adu_average'         : adu_average,
             'sqm'                 : i_ref['sqm_value'],
@@ -1157,21 +1570,20 @@ class ImageWorker(Process):
             'time'                : i_ref['exp_date'].strftime('%s'),
             'latitude'            : self.latitude_v.value,
             'longitude'           : self.longitude_v.value,
+            'quality_reduced'     : list(i_ref['quality_reduced']),
+            'image_queue_depth'   : self.image_q.qsize(),
+            'image_queue_dropped' : self.image_q.dropped,
         }
 
 
         indi_allsky_status_p = Path('/var/lib/indi-allsky/indi_allsky_status.json')
 
-        with io.open(str(indi_allsky_status_p), 'w') as f_indi_status:
-            json.dump(status, f_indi_status, indent=4)
-            f_indi_status.flush()
-            f_indi_status.close()
-
-        indi_allsky_status_p.chmod(0o644)
+        # readers never see a partially written file
+        self._asset_writer.writeJson(indi_allsky_status_p, status)
 
 
-    def getImageFolder(self, exp_date, camera):
-        if self.night_v.value:
+    def getImageFolder(self, exp_date, camera, night):
+        if night:
             # images should be written to previous day's folder until noon
             day_ref = exp_date - timedelta(hours=12)
             timeofday_str = 'night'
@@ -1193,13 +1605,15 @@ class ImageWorker(Process):
         return hour_folder
 
 
-    def calculate_histogram(self, data, exposure):
+    def calculate_histogram(self, data, exposure, frame_stats=None):
         if isinstance(self._adu_mask, type(None)):
             # This only needs to be done once if a mask is not provided
             self._generateAduMask(data)
 
 
-        if len(data.shape) == 2:
+        if not isinstance(frame_stats, type(None)):
+            adu = frame_stats.roiMean('adu', self._adu_mask)
+        elif len(data.shape) == 2:
             # mono
             adu = cv2.mean(src=data, mask=self._adu_mask)[0]
         else:
@@ -1217,103 +1631,33 @@ class ImageWorker(Process):
 
 
         if self.night_v.value:
-            target_adu = self.config['TARGET_ADU']
+            period = self.config['EXPOSURE_PERIOD']
         else:
-            target_adu = self.config['TARGET_ADU_DAY']
-
-
-        # Brightness when the sun is in view (very short exposures) can change drastically when clouds pass through the view
-        # Setting a deviation that is too short can cause exposure flapping
-        if exposure < 0.001000:
-            # DAY
-            adu_dev = float(self.config.get('TARGET_ADU_DEV_DAY', 20))
-
-            target_adu_min = target_adu - adu_dev
-            target_adu_max = target_adu + adu_dev
-            current_adu_target_min = self.current_adu_target - adu_dev
-            current_adu_target_max = self.current_adu_target + adu_dev
-
-            exp_scale_factor = 0.50  # scale exposure calculation
-            history_max_vals = 6     # number of entries to use to calculate average
-        else:
-            # NIGHT
-            adu_dev = float(self.config.get('TARGET_ADU_DEV', 10))
-
-            target_adu_min = target_adu - adu_dev
-            target_adu_max = target_adu + adu_dev
-            current_adu_target_min = self.current_adu_target - adu_dev
-            current_adu_target_max = self.current_adu_target + adu_dev
-
-            exp_scale_factor = 1.0  # scale exposure calculation
-            history_max_vals = 6    # number of entries to use to calculate average
-
-
-
-        if not self.target_adu_found:
-            self.recalculate_exposure(exposure, adu, target_adu, target_adu_min, target_adu_max, exp_scale_factor)
-            return adu, 0.0
-
-
-        self.hist_adu.append(adu)
-        self.hist_adu = self.hist_adu[(history_max_vals * -1):]  # remove oldest values, up to history_max_vals
-
-        logger.info('Current target ADU: %0.2f (%0.2f/%0.2f)', self.current_adu_target, current_adu_target_min, current_adu_target_max)
-        logger.info('Current ADU history: (%d) [%s]', len(self.hist_adu), ', '.join(['{0:0.2f}'.format(x) for x in self.hist_adu]))
-
-
-        adu_average = functools.reduce(lambda a, b: a + b, self.hist_adu) / len(self.hist_adu)
-        logger.info('ADU average: %0.2f', adu_average)
+            period = self.config['EXPOSURE_PERIOD_DAY']
 
+        # sun altitude now and at the next frame for the brightness trend
+        utcnow = datetime.utcnow()
+        sun_alt = self._ephemeris.position(utcnow)['sun_alt']
+        sun_alt_next = self._ephemeris.position(utcnow + timedelta(seconds=period))['sun_alt']
 
-        ### Need at least x values to continue
-        if len(self.hist_adu) < history_max_vals:
-            return adu, 0.0
 
+        adu_average, new_exposure = self._exposure_control.update(
+            exposure,
+            self.gain_v.value,
+            adu,
+            bool(self.night_v.value),
+            sun_alt=sun_alt,
+            sun_alt_next=sun_alt_next,
+        )
 
-        ### only change exposure when 70% of the values exceed the max or minimum
-        if adu_average > current_adu_target_max:
-            logger.warning('ADU increasing beyond limits, recalculating next exposure')
-            self.target_adu_found = False
-        elif adu_average < current_adu_target_min:
-            logger.warning('ADU decreasing beyond limits, recalculating next exposure')
-            self.target_adu_found = False
+        if not isinstance(new_exposure, type(None)):
+            logger.warning('New calculated exposure: %0.6f', new_exposure)
+            with self.exposure_v.get_lock():
+                self.exposure_v.value = new_exposure
 
         return adu, adu_average
 
 
-    def recalculate_exposure(self, exposure, adu, target_adu, target_adu_min, target_adu_max, exp_scale_factor):
-
-        # Until we reach a good starting point, do not calculate a moving average
-        if adu <= target_adu_max and adu >= target_adu_min:
-            logger.warning('Found target value for exposure')
-            self.current_adu_target = copy.copy(adu)
-            self.target_adu_found = True
-            self.hist_adu = []
-            return
-
-
-        # Scale the exposure up and down based on targets
-        if adu > target_adu_max:
-            new_exposure = exposure - ((exposure - (exposure * (target_adu / adu))) * exp_scale_factor)
-        elif adu < target_adu_min:
-            new_exposure = exposure - ((exposure - (exposure * (target_adu / adu))) * exp_scale_factor)
-        else:
-            new_exposure = exposure
-
-
-
-        # Do not exceed the limits
-        if new_exposure < self.config['CCD_EXPOSURE_MIN']:
-            new_exposure = self.config['CCD_EXPOSURE_MIN']
-        elif new_exposure > self.config['CCD_EXPOSURE_MAX']:
-            new_exposure = self.config['CCD_EXPOSURE_MAX']
-
-
-        logger.warning('New calculated exposure: %0.6f', new_exposure)
-        with self.exposure_v.get_lock():
-            self.exposure_v.value = new_exposure
-
-
     def _generateAduMask(self, img):
         logger.info('Generating mask based on ADU_ROI')
 
@@ -1325,10 +1669,8 @@ class ImageWorker(Process):
         adu_roi = self.config.get('ADU_ROI', [])
 
         try:
-            x1 = int(adu_roi[0] / self.bin_v.value)
-            y1 = int(adu_roi[1] / self.bin_v.value)
-            x2 = int(adu_roi[2] / self.bin_v.value)
-            y2 = int(adu_roi[3] / self.bin_v.value)
+            # map onto the cropped and scaled frame
+            x1, y1, x2, y2 = self.image_processor.geometry.mapRoi(adu_roi)
         except IndexError:
             logger.warning('Using central ROI for ADU calculations')
             x1 = int((image_width / 2) - (image_width / 3))
@@ -1385,6 +1727,207 @@ class ImageWorker(Process):
         return mask_data
 
 
+class ImageStageWorker(Process):
+    """Runs the stateless processing stages and encoding of a frame.
+
+    Frames are prepared by ImageWorker, which also keeps the stateful steps
+    (calibration, stacking and exposure control).  Results are returned
+    with the frame sequence number and ImageWorker finalizes them in order.
+    """
+
+    def __init__(
+        self,
+        idx,
+        config,
+        error_q,
+        job_q,
+        result_q,
+        mask=None,
+        ephemeris_table=None,
+    ):
+        super(ImageStageWorker, self).__init__()
+
+        #self.threadID = idx
+        self.name = 'ImageStageWorker{0:03d}'.format(idx)
+        self.daemon = True  # never outlive the image worker
+
+        self.config = config
+        self.error_q = error_q
+        self.job_q = job_q
+        self.result_q = result_q
+
+        self._mask = mask
+        self._ephemeris_table = ephemeris_table
+
+        self.image_processor = None
+
+        self._shutdown = False
+
+
+    def sighup_handler_worker(self, signum, frame):
+        logger.warning('Caught HUP signal')
+
+        # set flag for program to stop processes
+        self._shutdown = True
+
+
+    def sigterm_handler_worker(self, signum, frame):
+        logger.warning('Caught TERM signal')
+
+        # set flag for program to stop processes
+        self._shutdown = True
+
+
+    def sigint_handler_worker(self, signum, frame):
+        logger.warning('Caught INT signal')
+
+        # set flag for program to stop processes
+        self._shutdown = True
+
+
+
+    def run(self):
+        # setup signal handling after detaching from the main process
+        signal.signal(signal.SIGHUP, self.sighup_handler_worker)
+        signal.signal(signal.SIGTERM, self.sigterm_handler_worker)
+        signal.signal(signal.SIGINT, self.sigint_handler_worker)
+
+
+        ### use this as a method to log uncaught exceptions
+        try:
+            self.saferun()
+        except Exception as e:
+            tb = traceback.format_exc()
+            self.error_q.put((str(e), tb))
+            raise e
+
+
+
+    def saferun(self):
+        # values are not shared, they are set from each frame
+        self.latitude_v = Value('f', 0.0)
+        self.longitude_v = Value('f', 0.0)
+        self.ra_v = Value('f', 0.0)
+        self.dec_v = Value('f', 0.0)
+        self.exposure_v = Value('f', -1.0)
+        self.gain_v = Value('i', -1)
+        self.bin_v = Value('i', 1)
+        self.sensortemp_v = Value('f', 0)
+        self.night_v = Value('i', -1)
+        self.moonmode_v = Value('i', -1)
+
+        self.astrometric_data = {
+            'sun_alt'       : 0.0,
+            'moon_alt'      : 0.0,
+            'moon_phase'    : 0.0,
+            'sun_moon_sep'  : 90.0,
+            'sidereal_time' : 'unset',
+        }
+
+        self.image_processor = ImageProcessor(
+            self.config,
+            self.latitude_v,
+            self.longitude_v,
+            self.ra_v,
+            self.dec_v,
+            self.exposure_v,
+            self.gain_v,
+            self.bin_v,
+            self.sensortemp_v,
+            self.night_v,
+            self.moonmode_v,
+            self.astrometric_data,
+            mask=self._mask,
+            ephemeris_table=self._ephemeris_table,
+        )
+
+
+        while True:
+            try:
+                job = self.job_q.get(timeout=23)  # prime number
+            except queue.Empty:
+                continue
+
+
+            if job.get('stop'):
+                logger.warning('Goodbye')
+                return
+
+            if self._shutdown:
+                logger.warning('Goodbye')
+                return
+
+
+            result = {
+                'seq'          : job['seq'],
+                'error'        : None,
+                'tmpfile'      : None,
+                'fits_tmpfile' : None,
+                'raw_tmpfile'  : None,
+            }
+
+            try:
+                self.processJob(job, result)
+            except Exception:
+                # the frame is skipped, the worker continues
+                result['error'] = traceback.format_exc()
+
+            self.result_q.put(result)
+
+
+    def processJob(self, job, result):
+        stage_start = time.time()
+
+        values = job['values']
+
+        self.latitude_v.value = values['latitude']
+        self.longitude_v.value = values['longitude']
+        self.ra_v.value = values['ra']
+        self.dec_v.value = values['dec']
+        self.exposure_v.value = values['exposure']
+        self.gain_v.value = values['gain']
+        self.bin_v.value = values['bin']
+        self.sensortemp_v.value = values['sensortemp']
+        self.night_v.value = values['night']
+        self.moonmode_v.value = values['moonmode']
+
+
+        i_ref = job['i_ref']
+
+
+        if job['fits']:
+            fits_data, fits_header_str = job['fits']
+            hdulist = fits.HDUList([fits.PrimaryHDU(fits_data, header=fits.Header.fromstring(fits_header_str))])
+
+            fits_start = time.time()
+
+            result['fits_tmpfile'] = str(self.image_processor.encode_fit(hdulist, job['folders']['fits']))
+
+            i_ref['stage_elapsed']['fits'] = time.time() - fits_start
+
+        if job['raw']:
+            raw_data, max_bit_depth = job['raw']
+            result['raw_tmpfile'] = str(self.image_processor.encode_raw(raw_data, i_ref['image_bitpix'], max_bit_depth, job['folders']['raw']))
+
+
+        self.image_processor.setStageImage(job['image'], i_ref)
+
+        self.image_processor.post_process()
+
+        result['process_elapsed'] = time.time() - stage_start
+
+
+        result['tmpfile'] = str(self.image_processor.encode_image(self.image_processor.image, job['folders']['image']))
+
+        result['stars'] = i_ref['stars']
+        result['lines'] = i_ref['lines']
+        result['stage_elapsed'] = i_ref['stage_elapsed']
+        result['keogram_column'] = i_ref['keogram_column']
+        result['startrail_image'] = i_ref['startrail_image']
+        result['astrometric_data'] = dict(self.astrometric_data)
+
+
+
 class ImageProcessor(object):
 
     dark_temperature_range = 5.0  # dark must be within this range
@@ -1421,6 +1964,7 @@ class ImageProcessor(object):
         moonmode_v,
         astrometric_data,
         mask=None,
+        ephemeris_table=None,
     ):
         self.config = config
 
@@ -1446,7 +1990,7 @@ class ImageProcessor(object):
         self._image_circle_alpha_mask = None
 
         self._overlay = None
-        self._alpha_mask = None
+        self._overlay_layers = dict()  # premultiplied layers by image dimensions
 
         self.focus_mode = self.config.get('FOCUS_MODE', False)
 
@@ -1455,22 +1999,51 @@ class ImageProcessor(object):
 
         # contains the current stacked image
         self._image = None
+        self._frame_stats = None
         self._non_stacked_image = None  # used when raw exports are enabled
 
         # contains the raw image data, data will be newest to oldest
         self.image_list = [None]  # element will be removed on first image
 
+        # crop and scale are applied right after debayer, full frame regions are mapped to match
+        self._geometry = IndiAllSkyFrameGeometry(self.config, self.bin_v)
+        self._geometry.crop_roi = self.config.get('IMAGE_CROP_ROI')
+
+        image_scale = self.config.get('IMAGE_SCALE', 100)
+        if self.focus_mode:
+            # frames are not scaled in focus mode, masks and overlays must match
+            self._early_scale = False
+        elif image_scale and image_scale != 100 and not self.config.get('DETECT_FULL_RESOLUTION'):
+            self._early_scale = True
+            self._geometry.scale = image_scale / 100.0
+        else:
+            self._early_scale = False
+
+        processed_mask = self._geometry.mapMask(self._detection_mask)
+
         self._orb = IndiAllskyOrbGenerator(self.config)
+        self._overlay_cache = IndiAllSkyOverlayCache(self.config)
+        self._keogram = KeogramGenerator(self.config)
+        self._ephemeris = IndiAllSkyEphemeris(self.config, self.latitude_v, self.longitude_v, shared_table=ephemeris_table)
         self._sqm = IndiAllskySqm(self.config, self.bin_v, mask=None)
-        self._stars = IndiAllSkyStars(self.config, self.bin_v, mask=self._detection_mask)
-        self._lineDetect = IndiAllskyDetectLines(self.config, self.bin_v, mask=self._detection_mask)
-        self._draw = IndiAllSkyDraw(self.config, self.bin_v, mask=self._detection_mask)
-        self._scnr = IndiAllskyScnr(self.config)
+        self._stars = IndiAllSkyStars(self.config, self.bin_v, mask=processed_mask, geometry=self._geometry)
+        self._registration_stars = IndiAllSkyStars(self.config, self.bin_v, mask=self._detection_mask)  # full frame
+        self._lineDetect = IndiAllskyDetectLines(self.config, self.bin_v, mask=processed_mask, geometry=self._geometry)
+        self._draw = IndiAllSkyDraw(self.config, self.bin_v, mask=processed_mask, geometry=self._geometry)
+        self._color_lut = IndiAllSkyColorLut(self.config)
+        self._dark_cache = IndiAllSkyDarkCache(self.config)
 
         self._stacker = IndiAllskyStacker(self.config, self.bin_v, mask=self._detection_mask)
         self._stacker.detection_sigma = self.config.get('IMAGE_ALIGN_DETECTSIGMA', 5)
         self._stacker.max_control_points = self.config.get('IMAGE_ALIGN_POINTS', 50)
         self._stacker.min_area = self.config.get('IMAGE_ALIGN_SOURCEMINAREA', 10)
+        self._stacker.star_registration = self.config.get('IMAGE_ALIGN_STARS', False)
+
+        self._stack_accum = IndiAllskyStackAccumulator(self.config, method=self.stack_method)
+        self._stack_accum.depth = self.stack_count
+
+        # optional stages disabled or reduced to keep up with the exposure period
+        self._quality_reduced = tuple()
 
 
 
@@ -1481,6 +2054,16 @@ class ImageProcessor(object):
     @image.setter
     def image(self, new_image):
         self._image = new_image
+        self._frame_stats = None  # stats are only valid for the data they were calculated from
+
+
+    @property
+    def frame_stats(self):
+        return self._frame_stats
+
+    @frame_stats.setter
+    def frame_stats(self, *args):
+        pass  # read only
 
 
     @property
@@ -1492,6 +2075,33 @@ class ImageProcessor(object):
         self._non_stacked_image = new_non_stacked_image
 
 
+    @property
+    def geometry(self):
+        return self._geometry
+
+    @geometry.setter
+    def geometry(self, *args):
+        pass  # read only
+
+
+    @property
+    def early_scale(self):
+        return self._early_scale
+
+    @early_scale.setter
+    def early_scale(self, *args):
+        pass  # read only
+
+
+    @property
+    def quality_reduced(self):
+        return self._quality_reduced
+
+    @quality_reduced.setter
+    def quality_reduced(self, new_quality_reduced):
+        self._quality_reduced = tuple(new_quality_reduced)
+
+
     @property
     def shape(self):
         return self.image_list[0]['hdulist'].data.shape
@@ -1511,10 +2121,7 @@ class ImageProcessor(object):
 
 
 
-    def add(self, filename, exposure, exp_date, exp_elapsed, camera):
-        filename_p = Path(filename)
-
-
+    def _clear(self):
         # clear old data as soon as possible
         self.image = None
         self.non_stacked_image = None
@@ -1527,6 +2134,61 @@ class ImageProcessor(object):
         else:
             # disable stacking during daytime and moonmode
             self.image_list.clear()
+            self._stack_accum.reset()
+            self._stacker.reset()
+
+
+    def add_frame(self, frame_ring, slot, shape, dtype, header_str, exposure, exp_date, exp_elapsed, camera):
+        # frame data is handed off through shared memory instead of a file
+        self._clear()
+
+        # the slot is used without a copy until detachFrame() is called
+        data = frame_ring.get(slot, shape, dtype)
+
+        hdu = fits.PrimaryHDU(data, header=fits.Header.fromstring(header_str))
+        hdulist = fits.HDUList([hdu])
+
+        image_bitpix = hdulist[0].header['BITPIX']
+        image_bayerpat = hdulist[0].header.get('BAYERPAT')
+
+        try:
+            self._add_hdulist(hdulist, image_bitpix, image_bayerpat, True, exposure, exp_date, exp_elapsed, camera)
+        except Exception:
+            frame_ring.release(slot)
+            raise
+
+        self.getLatestImage()['frame_slot'] = slot
+
+
+    def detachFrame(self, frame_ring):
+        # returns the shared memory slot of the latest frame, the slot may be released when the frame is processed
+        i_ref = self.getLatestImage()
+
+        frame_slot = i_ref['frame_slot']
+        if isinstance(frame_slot, type(None)):
+            return None
+
+        i_ref['frame_slot'] = None
+
+
+        if frame_ring.sharesMemory(frame_slot, i_ref['hdulist'][0].data):
+            if self.night_v.value and not self.moonmode_v.value and self.stack_count > 1:
+                # stacked with the next frames
+                i_ref['hdulist'][0].data = numpy.copy(i_ref['hdulist'][0].data)
+            else:
+                # removed from the list with the next frame anyway
+                self.image_list.remove(i_ref)
+
+
+        self.non_stacked_image = None
+
+        return frame_slot
+
+
+    def add(self, filename, exposure, exp_date, exp_elapsed, camera):
+        filename_p = Path(filename)
+
+        self._clear()
 
 
         indi_rgb = True  # INDI returns array in the wrong order for cv2
@@ -1623,6 +2285,13 @@ class ImageProcessor(object):
             image_bayerpat = hdulist[0].header.get('BAYERPAT')
 
 
+        filename_p.unlink()  # no longer need the original file
+
+
+        self._add_hdulist(hdulist, image_bitpix, image_bayerpat, indi_rgb, exposure, exp_date, exp_elapsed, camera)
+
+
+    def _add_hdulist(self, hdulist, image_bitpix, image_bayerpat, indi_rgb, exposure, exp_date, exp_elapsed, camera):
         # Override these
 
         hdulist[0].header['OBJECT'] = 'AllSky'
@@ -1653,9 +2322,6 @@ class ImageProcessor(object):
         #logger.info('Final HDU Header = %s', pformat(hdulist[0].header))
 
 
-        filename_p.unlink()  # no longer need the original file
-
-
         logger.info('Image bits: %d, cfa: %s', image_bitpix, str(image_bayerpat))
 
 
@@ -1674,7 +2340,9 @@ class ImageProcessor(object):
                 pass
 
 
-        detected_bit_depth = self._detectBitDepth(hdulist)
+        frame_stats = IndiAllSkyFrameStats(hdulist[0].data)
+
+        detected_bit_depth = self._detectBitDepth(frame_stats)
 
 
         if self.night_v.value:
@@ -1695,20 +2363,31 @@ class ImageProcessor(object):
             'image_bitpix'     : image_bitpix,
             'image_bayerpat'   : image_bayerpat,
             'detected_bit_depth' : detected_bit_depth,  # keeping this for reference
+            'frame_stats'      : frame_stats,
             'target_adu'       : target_adu,
             'indi_rgb'         : indi_rgb,
             'sqm_value'        : None,    # populated later
             'lines'            : list(),  # populated later
             'stars'            : list(),  # populated later
+            'star_centroids'   : None,    # populated during registration
+            'stage_elapsed'    : dict(),  # cost of the optional stages
+            'quality_reduced'  : tuple(),  # optional stages reduced by the quality governor
+            'keogram_column'   : None,    # live keogram column and image dimensions
+            'startrail_image'  : None,    # final image for the live star trails
+            'lines_background' : None,    # meteor detection background, updated in frame order
+            'lines_masked'     : None,    # masked luminance for meteor detection, calculated once per frame
+            'night'            : bool(self.night_v.value),  # the state may change before the frame is finalized
+            'moonmode'         : bool(self.moonmode_v.value),
+            'frame_slot'       : None,    # shared memory slot holding the frame data
         }
 
 
         self.image_list.insert(0, image_data)  # new image is first in list
 
 
-    def _detectBitDepth(self, hdulist):
+    def _detectBitDepth(self, frame_stats):
         ### This will need some rework if cameras return signed int data
-        max_val = numpy.amax(hdulist[0].data)
+        max_val = frame_stats.max
         logger.info('Image max value: %d', int(max_val))
 
         # This method of detecting bit depth can cause the 16->8 bit conversion
@@ -1757,6 +2436,7 @@ class ImageProcessor(object):
         try:
             calibrated_data = self._calibrate(i_ref['hdulist'][0].data, i_ref['exposure'], i_ref['camera_id'], i_ref['image_bitpix'])
             i_ref['hdulist'][0].data = calibrated_data
+            i_ref['frame_stats'] = IndiAllSkyFrameStats(calibrated_data)
 
             i_ref['calibrated'] = True
         except CalibrationNotFound:
@@ -1764,6 +2444,39 @@ class ImageProcessor(object):
 
 
     def _calibrate(self, data, exposure, camera_id, image_bitpix):
+        self._dark_cache.validate()
+
+        match_key = (
+            camera_id,
+            image_bitpix,
+            self.gain_v.value,
+            self.bin_v.value,
+            float(exposure),
+            int(math.floor(self.sensortemp_v.value)),  # temperature bucket
+        )
+
+        master_dark = self._dark_cache.get(self._dark_cache.getMatch(match_key))
+
+        if isinstance(master_dark, type(None)):
+            master_key, master_dark = self._loadMasterDark(exposure, camera_id, image_bitpix)
+
+            self._dark_cache.setMatch(match_key, master_key)
+            self._dark_cache.put(master_key, master_dark)
+
+        self._dark_cache.logStats()
+
+
+        if master_dark.shape != data.shape:
+            logger.error('Dark frame calibration dimensions mismatch')
+            raise CalibrationNotFound('Dark frame calibration dimension mismatch')
+
+
+        data_calibrated = cv2.subtract(data, master_dark)
+
+        return data_calibrated
+
+
+    def _loadMasterDark(self, exposure, camera_id, image_bitpix):
         # pick a bad pixel map that is closest to the exposure and temperature
         logger.info('Searching for bad pixel map: gain %d, exposure >= %0.1f, temp >= %0.1fc', self.gain_v.value, exposure, self.sensortemp_v.value)
         bpm_entry = IndiAllSkyDbBadPixelMapTable.query\
@@ -1892,14 +2605,18 @@ class ImageProcessor(object):
             master_dark = dark
 
 
-        if master_dark.shape != data.shape:
-            logger.error('Dark frame calibration dimensions mismatch')
-            raise CalibrationNotFound('Dark frame calibration dimension mismatch')
-
-
-        data_calibrated = cv2.subtract(data, master_dark)
+        master_key = (
+            camera_id,
+            image_bitpix,
+            self.gain_v.value,
+            self.bin_v.value,
+            dark_frame_entry.exposure,
+            int(math.floor(dark_frame_entry.temp)) if not isinstance(dark_frame_entry.temp, type(None)) else None,
+            dark_frame_entry.id,
+            bpm_entry.id if bpm_entry and not isinstance(bpm, type(None)) else None,
+        )
 
-        return data_calibrated
+        return master_key, master_dark
 
 
     def calculateSqm(self):
@@ -1910,7 +2627,7 @@ class ImageProcessor(object):
             i_ref['sqm_value'] = 0
             return
 
-        i_ref['sqm_value'] = self._sqm.calculate(i_ref['hdulist'][0].data, i_ref['exposure'], self.gain_v.value)
+        i_ref['sqm_value'] = self._sqm.calculate(i_ref['hdulist'][0].data, i_ref['exposure'], self.gain_v.value, frame_stats=i_ref['frame_stats'])
 
 
     def stack(self):
@@ -1940,6 +2657,27 @@ class ImageProcessor(object):
         stack_list_len = len(stack_i_ref_list)
         assert stack_list_len > 0  # canary
 
+
+        if self.night_v.value and not self.moonmode_v.value and self.stack_count > 1:
+            # keep the running stack in sync with the image list, frames reference the copy held by the accumulator
+            try:
+                if self._stack_accum.count == 0:
+                    # older images were added while stacking was inactive
+                    for old_i_ref in reversed(stack_i_ref_list[1:]):
+                        old_i_ref['hdulist'][0].data = self._stack_accum.add(old_i_ref['hdulist'][0].data)
+
+                i_ref['hdulist'][0].data = self._stack_accum.add(i_ref['hdulist'][0].data)
+            except AttributeError:
+                logger.error('Unknown stacking method: %s', self.stack_method)
+                self.image = i_ref['hdulist'][0].data
+                return
+
+
+            if self.config.get('IMAGE_EXPORT_RAW'):
+                # release the original array
+                self.non_stacked_image = i_ref['hdulist'][0].data
+
+
         if stack_list_len == 1:
             # no reason to stack a single image
             self.image = i_ref['hdulist'][0].data
@@ -1957,113 +2695,291 @@ class ImageProcessor(object):
             raise Exception('Unknown bits per pixel')
 
 
-        if self.config.get('IMAGE_STACK_ALIGN') and i_ref['exposure'] > self.registration_exposure_thresh:
+        if self.config.get('IMAGE_STACK_ALIGN') and 'align' in self._quality_reduced:
+            logger.warning('Alignment reduced by quality governor')
+
+
+        if self.config.get('IMAGE_STACK_ALIGN') and i_ref['exposure'] > self.registration_exposure_thresh and 'align' not in self._quality_reduced:
             # only perform registration once the exposure exceeds 5 seconds
 
             stack_i_ref_list = list(filter(lambda x: x['exposure'] > self.registration_exposure_thresh, stack_i_ref_list))
 
 
+            align_start = time.time()
+
             # if the registration takes longer than the exposure period, kill it
             # 3 seconds is the assumed time it normally takes to process an image
             signal.alarm(int(self.config['EXPOSURE_PERIOD'] - 3))
 
             try:
+                if self._stacker.star_registration:
+                    # centroids are cached, only new images are searched
+                    for x in stack_i_ref_list:
+                        if isinstance(x['star_centroids'], type(None)):
+                            x['star_centroids'] = self._registration_stars.detectCentroids(
+                                x['hdulist'][0].data,
+                                detection_sigma=self._stacker.detection_sigma,
+                                max_points=self._stacker.max_control_points,
+                            )
+
+                # data is returned aligned to the registration anchor
                 stack_data_list = self._stacker.register(stack_i_ref_list)
+                registered = True
             except TimeOutException:
                 # stack unaligned images
                 logger.error('Registration exceeded the exposure period, cancel alignment')
                 stack_data_list = [x['hdulist'][0].data for x in stack_i_ref_list]
+                registered = False
 
             signal.alarm(0)
+
+            i_ref['stage_elapsed']['align'] = time.time() - align_start
         else:
-            # stack unaligned images
-            stack_data_list = [x['hdulist'][0].data for x in stack_i_ref_list]
+            # stack unaligned images from the running accumulator
+            stack_data_list = None
+            registered = False
 
 
         stack_start = time.time()
 
 
-        try:
-            stacker_method = getattr(self._stacker, self.stack_method)
-            self.image = stacker_method(stack_data_list, numpy_type)
-        except AttributeError:
-            logger.error('Unknown stacking method: %s', self.stack_method)
-            self.image = i_ref['hdulist'][0].data
-            return
+        if isinstance(stack_data_list, type(None)):
+            self.image = self._stack_accum.result(numpy_type)
+            stack_len = self._stack_accum.count
+        else:
+            try:
+                stacker_method = getattr(self._stacker, self.stack_method)
+                self.image = stacker_method(stack_data_list, numpy_type)
+            except AttributeError:
+                logger.error('Unknown stacking method: %s', self.stack_method)
+                self.image = i_ref['hdulist'][0].data
+                return
+
+            stack_len = len(stack_data_list)
+
+
+        if registered:
+            # move the stack from the anchor to the latest image
+            self.image = self._stacker.alignToReference(self.image)
 
 
         if self.config.get('IMAGE_STACK_SPLIT'):
             self.image = self._splitscreen(i_ref['hdulist'][0].data, self.image)
 
 
-        stack_elapsed_s = time.time() - stack_start
-        logger.info('Stacked %d images (%s) in %0.4f s', len(stack_data_list), self.stack_method, stack_elapsed_s)
+        stack_elapsed_s = time.time() - stack_start
+        logger.info('Stacked %d images (%s) in %0.4f s', stack_len, self.stack_method, stack_elapsed_s)
+
+
+    def debayer(self):
+        i_ref = self.getLatestImage()
+
+        # sanity check
+        if not len(self.image.shape) == 2:
+            # already debayered
+            return
+
+
+        i_ref = self.getLatestImage()
+
+
+        if self.config.get('CFA_PATTERN'):
+            # override detected bayer pattern
+            logger.warning('Overriding CFA pattern: %s', self.config['CFA_PATTERN'])
+            image_bayerpat = self.config['CFA_PATTERN']
+        else:
+            image_bayerpat = i_ref['image_bayerpat']
+
+
+        if not image_bayerpat:
+            logger.error('No bayer pattern detected')
+            return
+
+
+        if self.config.get('NIGHT_GRAYSCALE') and self.night_v.value:
+            debayer_algorithm = self.__cfa_gray_map[image_bayerpat]
+        elif self.config.get('DAYTIME_GRAYSCALE') and not self.night_v.value:
+            debayer_algorithm = self.__cfa_gray_map[image_bayerpat]
+        else:
+            debayer_algorithm = self.__cfa_bgr_map[image_bayerpat]
+
+
+        self.image = cv2.cvtColor(self.image, debayer_algorithm)
+
+
+        # for raw export
+        if not isinstance(self.non_stacked_image, type(None)):
+            self.non_stacked_image = cv2.cvtColor(self.non_stacked_image, debayer_algorithm)
+
+
+    def convert_16bit_to_8bit(self):
+        self.image = self._color_lut.convert(self.image, self._max_bit_depth)
+
+
+    def color_balance(self):
+        # returns True if the image was changed
+        if self.focus_mode:
+            # disable color processing in focus mode
+            return False
+
+        if len(self.image.shape) == 2:
+            return False
+
+
+        scnr_algo = self.config.get('SCNR_ALGORITHM')
+        wb_factors = self._getWbFactors()
+        auto_wb = self.config.get('AUTO_WB')
+
+        if not scnr_algo and not auto_wb and wb_factors in (None, (1.0, 1.0, 1.0)):
+            return False
+
+
+        self._color_lut.balance(
+            self.image,
+            scnr_algo=scnr_algo,
+            wb_factors=wb_factors,
+            auto_wb=auto_wb,
+        )
+
+        return True
+
+
+    def _getWbFactors(self):
+        if not self.config.get('WBB_FACTOR'):
+            logger.error('Missing WBB_FACTOR setting')
+            return None
+
+        if not self.config.get('WBG_FACTOR'):
+            logger.error('Missing WBG_FACTOR setting')
+            return None
+
+        if not self.config.get('WBR_FACTOR'):
+            logger.error('Missing WBR_FACTOR setting')
+            return None
+
+        return (
+            float(self.config.get('WBB_FACTOR')),
+            float(self.config.get('WBG_FACTOR')),
+            float(self.config.get('WBR_FACTOR')),
+        )
+
+
+    def rotate(self, rotate_enum):
+        self.image = cv2.rotate(self.image, rotate_enum)
+
+
+    def flip(self, cv2_axis):
+        self.image = cv2.flip(self.image, cv2_axis)
+
+
+    def setStageImage(self, image, i_ref):
+        # frame prepared by another process, only the post processing stages are run
+        self.image = image
+        self.image_list = [i_ref]
+
+        self._quality_reduced = tuple(i_ref['quality_reduced'])
+
+        self.calculateFrameStats()
+
+
+    def calculateFrameStats(self):
+        self._frame_stats = IndiAllSkyFrameStats(self.image)
+
+
+    def post_process(self):
+        # stages that only depend on the current frame, these may run in a stage worker
+
+        # line detection
+        if self.night_v.value and self.config.get('DETECT_METEORS') and 'lines' not in self._quality_reduced:
+            self.detectLines()
+
+
+        # star detection
+        if self.night_v.value and self.config.get('DETECT_STARS', True) and 'stars' not in self._quality_reduced:
+            self.detectStars()
+
+
+        # additional draw code
+        if self.config.get('DETECT_DRAW'):
+            self.drawDetections()
+
+
+        if self.night_v.value:
+            contrast_enhance = self.config['NIGHT_CONTRAST_ENHANCE']
+        else:
+            contrast_enhance = self.config['DAYTIME_CONTRAST_ENHANCE']
+
+        if contrast_enhance and 'clahe' not in self._quality_reduced:
+            clahe_start = time.time()
+
+            self.contrast_clahe()
 
+            self.getLatestImage()['stage_elapsed']['clahe'] = time.time() - clahe_start
 
-    def debayer(self):
-        i_ref = self.getLatestImage()
 
-        # sanity check
-        if not len(self.image.shape) == 2:
-            # already debayered
-            return
+        self.apply_image_circle_mask()
 
 
-        i_ref = self.getLatestImage()
+        self.apply_logo_overlay()
 
 
-        if self.config.get('CFA_PATTERN'):
-            # override detected bayer pattern
-            logger.warning('Overriding CFA pattern: %s', self.config['CFA_PATTERN'])
-            image_bayerpat = self.config['CFA_PATTERN']
-        else:
-            image_bayerpat = i_ref['image_bayerpat']
+        if self.config['IMAGE_SCALE'] and self.config['IMAGE_SCALE'] != 100 and not self.early_scale:
+            # scaling was deferred for full resolution detection
+            self.scale_image()
 
 
-        if not image_bayerpat:
-            logger.error('No bayer pattern detected')
-            return
+        # gray frames are only converted if colored labels are drawn
+        self.colorize()
 
 
-        if self.config.get('NIGHT_GRAYSCALE') and self.night_v.value:
-            debayer_algorithm = self.__cfa_gray_map[image_bayerpat]
-        elif self.config.get('DAYTIME_GRAYSCALE') and not self.night_v.value:
-            debayer_algorithm = self.__cfa_gray_map[image_bayerpat]
-        else:
-            debayer_algorithm = self.__cfa_bgr_map[image_bayerpat]
+        # blur
+        #self.median_blur()
 
+        # denoise
+        #self.fastDenoise()
 
-        self.image = cv2.cvtColor(self.image, debayer_algorithm)
+        self.image_text()
 
 
-        # for raw export
-        if not isinstance(self.non_stacked_image, type(None)):
-            self.non_stacked_image = cv2.cvtColor(self.non_stacked_image, debayer_algorithm)
+        # live keogram uses the final image
+        if self.config.get('KEOGRAM_LIVE'):
+            self.extractKeogramColumn()
 
+        if self.night_v.value and self.config.get('STARTRAILS_LIVE') and not self.focus_mode:
+            self.getLatestImage()['startrail_image'] = self.image
 
-    def convert_16bit_to_8bit(self):
+
+    def extractKeogramColumn(self):
         i_ref = self.getLatestImage()
 
-        self._convert_16bit_to_8bit(i_ref['image_bitpix'])
+        if self.focus_mode:
+            return
 
+        keogram_start = time.time()
 
-    def _convert_16bit_to_8bit(self, image_bitpix):
-        if image_bitpix == 8:
-            return
+        column = self._keogram.extractColumn(self.image)
+        i_ref['keogram_column'] = (column, self._keogram.getDimensions())
 
-        logger.info('Resampling image from %d to 8 bits', image_bitpix)
+        keogram_elapsed_s = time.time() - keogram_start
+        logger.info('Keogram column extracted in %0.4f s', keogram_elapsed_s)
 
-        div_factor = int((2 ** self._max_bit_depth) / 255)
 
-        self.image = (self.image / div_factor).astype(numpy.uint8)
+    def updateLinesBackground(self):
+        i_ref = self.getLatestImage()
 
+        if self.focus_mode:
+            return
 
-    def rotate(self, rotate_enum):
-        self.image = cv2.rotate(self.image, rotate_enum)
+        if not self.night_v.value or not self.config.get('DETECT_METEORS') or not self.config.get('DETECT_METEORS_DIFFERENCE'):
+            return
 
+        # updated even when line detection is reduced, a stale background would be reset
+        masked_img = self._lineDetect.maskedImage(self.image, frame_stats=self.frame_stats)
+        i_ref['lines_background'] = self._lineDetect.updateBackground(self.image, masked_img=masked_img)
 
-    def flip(self, cv2_axis):
-        self.image = cv2.flip(self.image, cv2_axis)
+        if 'lines' not in self._quality_reduced:
+            # reused by line detection of this frame
+            i_ref['lines_masked'] = masked_img
 
 
     def detectLines(self):
@@ -2074,7 +2990,20 @@ class ImageProcessor(object):
             i_ref['lines'] = list
             return
 
-        i_ref['lines'] = self._lineDetect.detectLines(self.image)
+        lines_start = time.time()
+
+        i_ref['lines'] = self._lineDetect.detectLines(
+            self.image,
+            frame_stats=self.frame_stats,
+            background=i_ref['lines_background'],
+            masked_img=i_ref['lines_masked'],
+        )
+
+        # not kept with the stacked frames
+        i_ref['lines_background'] = None
+        i_ref['lines_masked'] = None
+
+        i_ref['stage_elapsed']['lines'] = time.time() - lines_start
 
 
     def detectStars(self):
@@ -2085,7 +3014,17 @@ class ImageProcessor(object):
             i_ref['stars'] = list()
             return
 
-        i_ref['stars'] = self._stars.detectObjects(self.image)
+        if 'stars_scale' in self._quality_reduced:
+            # half resolution
+            extra_level = 1
+        else:
+            extra_level = 0
+
+        stars_start = time.time()
+
+        i_ref['stars'] = self._stars.detectObjects(self.image, frame_stats=self.frame_stats, extra_level=extra_level)
+
+        i_ref['stage_elapsed']['stars'] = time.time() - stars_start
 
 
     def drawDetections(self):
@@ -2097,11 +3036,8 @@ class ImageProcessor(object):
 
 
     def crop_image(self):
-        # divide the coordinates by binning value
-        x1 = int(self.config['IMAGE_CROP_ROI'][0] / self.bin_v.value)
-        y1 = int(self.config['IMAGE_CROP_ROI'][1] / self.bin_v.value)
-        x2 = int(self.config['IMAGE_CROP_ROI'][2] / self.bin_v.value)
-        y2 = int(self.config['IMAGE_CROP_ROI'][3] / self.bin_v.value)
+        # coordinates are divided by binning value
+        x1, y1, x2, y2 = self._geometry.cropBox()
 
 
         self.image = self.image[
@@ -2113,55 +3049,6 @@ class ImageProcessor(object):
         logger.info('New cropped size: %d x %d', new_width, new_height)
 
 
-    def scnr(self, algo):
-        if self.focus_mode:
-            # disable processing in focus mode
-            return
-
-        try:
-            scnr_function = getattr(self._scnr, algo)
-            self.image = scnr_function(self.image)
-        except AttributeError:
-            logger.error('Unknown SCNR algorithm: %s', algo)
-
-
-    def white_balance_manual_bgr(self):
-        if self.focus_mode:
-            # disable processing in focus mode
-            return
-
-
-        if len(self.image.shape) == 2:
-            # mono
-            return
-
-
-        if not self.config.get('WBB_FACTOR'):
-            logger.error('Missing WBB_FACTOR setting')
-            return
-
-        if not self.config.get('WBG_FACTOR'):
-            logger.error('Missing WBG_FACTOR setting')
-            return
-
-        if not self.config.get('WBR_FACTOR'):
-            logger.error('Missing WBR_FACTOR setting')
-            return
-
-        WBB_FACTOR = float(self.config.get('WBB_FACTOR'))
-        WBG_FACTOR = float(self.config.get('WBG_FACTOR'))
-        WBR_FACTOR = float(self.config.get('WBR_FACTOR'))
-
-        b, g, r = cv2.split(self.image)
-
-        logger.info('Applying manual color balance settings')
-        wbb = cv2.multiply(b, WBB_FACTOR)
-        wbg = cv2.multiply(g, WBG_FACTOR)
-        wbr = cv2.multiply(r, WBR_FACTOR)
-
-        self.image = cv2.merge([wbb, wbg, wbr])
-
-
     #def white_balance_bgr_2(self):
     #    if len(self.image.shape) == 2:
     #        # mono
@@ -2201,46 +3088,6 @@ class ImageProcessor(object):
     #    self.image = data_denoise
 
 
-    def white_balance_auto_bgr(self):
-        if self.focus_mode:
-            # disable processing in focus mode
-            return
-
-        if len(self.image.shape) == 2:
-            # mono
-            return
-
-        ### This seems to work
-        b, g, r = cv2.split(self.image)
-        b_avg = cv2.mean(b)[0]
-        g_avg = cv2.mean(g)[0]
-        r_avg = cv2.mean(r)[0]
-
-        # Find the gain of each channel
-        k = (b_avg + g_avg + r_avg) / 3
-
-        try:
-            kb = k / b_avg
-        except ZeroDivisionError:
-            kb = k / 0.1
-
-        try:
-            kg = k / g_avg
-        except ZeroDivisionError:
-            kg = k / 0.1
-
-        try:
-            kr = k / r_avg
-        except ZeroDivisionError:
-            kr = k / 0.1
-
-        b = cv2.addWeighted(src1=b, alpha=kb, src2=0, beta=0, gamma=0)
-        g = cv2.addWeighted(src1=g, alpha=kg, src2=0, beta=0, gamma=0)
-        r = cv2.addWeighted(src1=r, alpha=kr, src2=0, beta=0, gamma=0)
-
-        self.image = cv2.merge([b, g, r])
-
-
     def contrast_clahe(self):
         if self.focus_mode:
             # disable processing in focus mode
@@ -2271,28 +3118,60 @@ class ImageProcessor(object):
             # already color
             return
 
+        if not self._labelsRequireColor():
+            # single channel is kept through encoding
+            return
+
         self.image = cv2.cvtColor(self.image, cv2.COLOR_GRAY2BGR)
 
 
+    def _labelsRequireColor(self):
+        if not self.config['TEXT_PROPERTIES'].get('FONT_FACE'):
+            return False
+
+        if not self.config.get('IMAGE_LABEL', True):
+            return False
+
+
+        color_list = [self.config['TEXT_PROPERTIES']['FONT_COLOR']]
+
+        if self.config.get('ORB_PROPERTIES', {}).get('MODE', 'ha') != 'off':
+            color_list.append(self.config['ORB_PROPERTIES']['SUN_COLOR'])
+            color_list.append(self.config['ORB_PROPERTIES']['MOON_COLOR'])
+
+
+        for color in color_list:
+            if len(set(color)) > 1:
+                return True
+
+        # gray colors can be drawn on a single channel
+        return False
+
+
     def apply_image_circle_mask(self):
         if not self.config.get('IMAGE_CIRCLE_MASK', {}).get('ENABLE'):
             return
 
-        if isinstance(self._image_circle_alpha_mask, type(None)):
+        if isinstance(self._image_circle_alpha_mask, type(None)) or self._image_circle_alpha_mask.shape != self.image.shape:
+            # regenerated if the resolution changes
             self._image_circle_alpha_mask = self._generate_image_circle_mask(self.image)
 
 
         alpha_start = time.time()
 
-        self.image = (self.image * self._image_circle_alpha_mask).astype(numpy.uint8)
+        # uint8 mask is scaled to 0-1, computed in place
+        cv2.multiply(self.image, self._image_circle_alpha_mask, dst=self.image, scale=1.0 / 255)
 
 
         if self.config.get('IMAGE_CIRCLE_MASK', {}).get('OUTLINE'):
             image_height, image_width = self.image.shape[:2]
 
-            center_x = int(image_width / 2) + self.config['IMAGE_CIRCLE_MASK']['OFFSET_X']
-            center_y = int(image_height / 2) - self.config['IMAGE_CIRCLE_MASK']['OFFSET_Y']  # minus
-            radius = int(self.config['IMAGE_CIRCLE_MASK']['DIAMETER'] / 2)
+            # circle is defined against the full size image
+            scale = self._geometry.scale
+
+            center_x = int(image_width / 2) + int(self.config['IMAGE_CIRCLE_MASK']['OFFSET_X'] * scale)
+            center_y = int(image_height / 2) - int(self.config['IMAGE_CIRCLE_MASK']['OFFSET_Y'] * scale)  # minus
+            radius = int(self.config['IMAGE_CIRCLE_MASK']['DIAMETER'] * scale / 2)
 
             cv2.circle(
                 img=self.image,
@@ -2314,19 +3193,53 @@ class ImageProcessor(object):
 
 
         if isinstance(self._overlay, type(None)):
-            self._overlay, self._alpha_mask = self._load_logo_overlay(self.image)
+            self._overlay = self._load_logo_overlay(self.image)
 
             if isinstance(self._overlay, bool):
                 return
 
+            if isinstance(self._overlay, type(None)):
+                return
+
         elif isinstance(self._overlay, bool):
             logger.error('Logo overlay failed to load')
             return
 
 
+        if self._overlay.shape[:2] != self.image.shape[:2]:
+            logger.error('Logo dimensions do not match image')
+            return
+
+
+        # gray and color frames may alternate, for example grayscale at night
+        layers = self._overlay_layers.get(len(self.image.shape))
+        if isinstance(layers, type(None)):
+            layers = self._logoOverlayLayers(self._overlay, self.image)
+            self._overlay_layers[len(self.image.shape)] = layers
+
+
+        overlay_premult, inverse_alpha, overlay_color, overlay_bbox = layers
+
+        if len(self.image.shape) == 2 and overlay_color:
+            # colored logo on a gray image
+            self.image = cv2.cvtColor(self.image, cv2.COLOR_GRAY2BGR)
+
+
         alpha_start = time.time()
 
-        self.image = self.image * (1 - self._alpha_mask) + self._overlay * self._alpha_mask
+        x1, y1, x2, y2 = overlay_bbox
+
+        # only the non-transparent area of the logo is blended
+        image_roi = self.image[y1:y2, x1:x2]
+
+        # fixed point: (image * (255 - alpha) + overlay * alpha) / 255, fits in uint16
+        blend = numpy.multiply(image_roi, inverse_alpha, dtype=numpy.uint16)
+        blend += overlay_premult
+        blend += 128
+        blend += blend >> 8
+        blend >>= 8
+
+        image_roi[:] = blend  # in place
 
         alpha_elapsed_s = time.time() - alpha_start
         logger.info('Alpha transparency in %0.4f s', alpha_elapsed_s)
@@ -2375,8 +3288,8 @@ class ImageProcessor(object):
         image_height, image_width = self.image.shape[:2]
 
         logger.info('Scaling image by %d%%', self.config['IMAGE_SCALE'])
-        new_width = int(image_width * self.config['IMAGE_SCALE'] / 100.0)
-        new_height = int(image_height * self.config['IMAGE_SCALE'] / 100.0)
+        new_width = int(image_width * (self.config['IMAGE_SCALE'] / 100.0))
+        new_height = int(image_height * (self.config['IMAGE_SCALE'] / 100.0))
 
         logger.info('New size: %d x %d', new_width, new_height)
 
@@ -2466,43 +3379,32 @@ class ImageProcessor(object):
             return
 
 
-        utcnow = datetime.utcnow()  # ephem expects UTC dates
+        utcnow = datetime.utcnow()  # ephemeris table is indexed by UTC
         #utcnow = datetime.utcnow() - timedelta(hours=13)  # testing
 
-        obs = ephem.Observer()
-        obs.lon = math.radians(self.longitude_v.value)
-        obs.lat = math.radians(self.latitude_v.value)
-
-
-        sun = ephem.Sun()
-        obs.date = utcnow
-        sun.compute(obs)
-        self.astrometric_data['sun_alt'] = math.degrees(sun.alt)
-
-
-
-        moon = ephem.Moon()
-        #obs.date = utcnow
-        moon.compute(obs)
-        self.astrometric_data['moon_alt'] = math.degrees(moon.alt)
-        self.astrometric_data['moon_phase'] = moon.moon_phase * 100.0
+        position = self._ephemeris.position(utcnow)
 
+        self.astrometric_data['sun_alt'] = position['sun_alt']
+        self.astrometric_data['moon_alt'] = position['moon_alt']
+        self.astrometric_data['moon_phase'] = position['moon_phase']
 
         # separation of 1-3 degrees means a possible eclipse
-        self.astrometric_data['sun_moon_sep'] = abs((ephem.separation(moon, sun) / (math.pi / 180)) - 180)
+        self.astrometric_data['sun_moon_sep'] = position['sun_moon_sep']
+
+        self.astrometric_data['sidereal_time'] = position['sidereal_time']
 
 
-        self.astrometric_data['sidereal_time'] = str(obs.sidereal_time())
+        label_start = time.time()
 
 
         ### ORBS
         orb_mode = self.config.get('ORB_PROPERTIES', {}).get('MODE', 'ha')
         if orb_mode == 'ha':
-            self._orb.drawOrbsHourAngle(self.image, utcnow, color_bgr, obs, sun, moon)
+            self._orb.drawOrbsHourAngle(self.image, utcnow, color_bgr, self._ephemeris)
         elif orb_mode == 'az':
-            self._orb.drawOrbsAzimuth(self.image, utcnow, color_bgr, obs, sun, moon)
+            self._orb.drawOrbsAzimuth(self.image, utcnow, color_bgr, self._ephemeris)
         elif orb_mode == 'alt':
-            self._orb.drawOrbsAltitude(self.image, utcnow, color_bgr, obs, sun, moon)
+            self._orb.drawOrbsAltitude(self.image, utcnow, color_bgr, self._ephemeris)
         elif orb_mode == 'off':
             # orbs disabled
             pass
@@ -2626,31 +3528,140 @@ class ImageProcessor(object):
                 line_offset += self.config['TEXT_PROPERTIES']['FONT_HEIGHT']
 
 
+        label_elapsed_s = time.time() - label_start
+        logger.info('Labels drawn in %0.4f s', label_elapsed_s)
+
+
+    def encode_image(self, data, folder):
+        tmpfile_name = IndiAllSkyAssetWriter.tempFile(folder)
+
+
+        write_img_start = time.time()
+
+        # write to temporary file
+        if self.config['IMAGE_FILE_TYPE'] in ('jpg', 'jpeg'):
+            result, buf = cv2.imencode('.jpg', data, [cv2.IMWRITE_JPEG_QUALITY, self.config['IMAGE_FILE_COMPRESSION']['jpg']])
+        elif self.config['IMAGE_FILE_TYPE'] in ('png',):
+            result, buf = cv2.imencode('.png', data, [cv2.IMWRITE_PNG_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['png']])
+        elif self.config['IMAGE_FILE_TYPE'] in ('tif', 'tiff'):
+            result, buf = cv2.imencode('.tif', data, [cv2.IMWRITE_TIFF_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['tif']])
+        else:
+            tmpfile_name.unlink()
+            raise Exception('Unknown file type: %s', self.config['IMAGE_FILE_TYPE'])
+
+        # extension is not part of the temporary name
+        buf.tofile(str(tmpfile_name))
+
+        write_img_elapsed_s = time.time() - write_img_start
+        logger.info('Image compressed in %0.4f s', write_img_elapsed_s)
+
+        return tmpfile_name
+
+
+    def encode_fit(self, hdulist, folder):
+        if self.config.get('IMAGE_SAVE_FITS_COMPRESS'):
+            # lossless tile compression, the primary hdu is left empty
+            comp_hdu = fits.CompImageHDU(data=hdulist[0].data, header=hdulist[0].header, compression_type='RICE_1')
+            hdulist = fits.HDUList([fits.PrimaryHDU(), comp_hdu])
+
+
+        write_fit_start = time.time()
+
+        tmpfile_p = IndiAllSkyAssetWriter.tempFile(folder)
+
+        with io.open(str(tmpfile_p), 'wb') as f_tmpfile:
+            hdulist.writeto(f_tmpfile)
+
+        write_fit_elapsed_s = time.time() - write_fit_start
+        logger.info('FITS written in %0.4f s', write_fit_elapsed_s)
+
+        return tmpfile_p
+
+
+    def encode_raw(self, data, image_bitpix, max_bit_depth, folder):
+        tmpfile_name = IndiAllSkyAssetWriter.tempFile(folder)
+
+
+        if image_bitpix == 8:
+            # nothing to scale
+            scaled_data = data
+        elif image_bitpix == 16:
+            if max_bit_depth == 8:
+                logger.info('Upscaling data from 8 to 16 bit')
+                scaled_data = numpy.left_shift(data, 8)
+            elif max_bit_depth == 9:
+                logger.info('Upscaling data from 9 to 16 bit')
+                scaled_data = numpy.left_shift(data, 7)
+            elif max_bit_depth == 10:
+                logger.info('Upscaling data from 10 to 16 bit')
+                scaled_data = numpy.left_shift(data, 6)
+            elif max_bit_depth == 11:
+                logger.info('Upscaling data from 11 to 16 bit')
+                scaled_data = numpy.left_shift(data, 5)
+            elif max_bit_depth == 12:
+                logger.info('Upscaling data from 12 to 16 bit')
+                scaled_data = numpy.left_shift(data, 4)
+            elif max_bit_depth == 13:
+                logger.info('Upscaling data from 13 to 16 bit')
+                scaled_data = numpy.left_shift(data, 3)
+            elif max_bit_depth == 14:
+                logger.info('Upscaling data from 14 to 16 bit')
+                scaled_data = numpy.left_shift(data, 2)
+            elif max_bit_depth == 15:
+                logger.info('Upscaling data from 15 to 16 bit')
+                scaled_data = numpy.left_shift(data, 1)
+            elif max_bit_depth == 16:
+                # nothing to scale
+                scaled_data = data
+            else:
+                # assume 16 bit
+                scaled_data = data
+        else:
+            raise Exception('Unsupported bit depth')
+
+
+
+        write_img_start = time.time()
+
+        if self.config['IMAGE_EXPORT_RAW'] in ('jpg', 'jpeg'):
+            if image_bitpix == 8:
+                scaled_data_8 = scaled_data
+            else:
+                # jpeg has to be 8 bits
+                logger.info('Resampling image from %d to 8 bits', image_bitpix)
+
+                div_factor = int((2 ** max_bit_depth) / 255)
+                scaled_data_8 = (scaled_data / div_factor).astype(numpy.uint8)
+
+            result, buf = cv2.imencode('.jpg', scaled_data_8, [cv2.IMWRITE_JPEG_QUALITY, self.config['IMAGE_FILE_COMPRESSION']['jpg']])
+        elif self.config['IMAGE_EXPORT_RAW'] in ('png',):
+            result, buf = cv2.imencode('.png', scaled_data, [cv2.IMWRITE_PNG_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['png']])
+        elif self.config['IMAGE_EXPORT_RAW'] in ('tif', 'tiff'):
+            result, buf = cv2.imencode('.tif', scaled_data, [cv2.IMWRITE_TIFF_COMPRESSION, self.config['IMAGE_FILE_COMPRESSION']['tif']])
+
+            #with TiffWriter(str(tmpfile_name), ) as tif:
+            #    tif.write(
+            #        scaled_data,
+            #        compression='lzw',  # requires imagecodecs
+            #        metadata={'foo': 'bar'},
+            #    )
+        else:
+            tmpfile_name.unlink()
+            raise Exception('Unknown file type: %s', self.config['IMAGE_EXPORT_RAW'])
+
+        # extension is not part of the temporary name
+        buf.tofile(str(tmpfile_name))
+
+        write_img_elapsed_s = time.time() - write_img_start
+        logger.info('Raw image written in %0.4f s', write_img_elapsed_s)
+
+        return tmpfile_name
+
+
+
     def drawText(self, data, text, pt, color_bgr):
-        fontFace = getattr(cv2, self.config['TEXT_PROPERTIES']['FONT_FACE'])
-        lineType = getattr(cv2, self.config['TEXT_PROPERTIES']['FONT_AA'])
-
-        if self.config['TEXT_PROPERTIES']['FONT_OUTLINE']:
-            cv2.putText(
-                img=data,
-                text=text,
-                org=pt,
-                fontFace=fontFace,
-                color=(0, 0, 0),
-                lineType=lineType,
-                fontScale=self.config['TEXT_PROPERTIES']['FONT_SCALE'],
-                thickness=self.config['TEXT_PROPERTIES']['FONT_THICKNESS'] + 1,
-            )  # black outline
-        cv2.putText(
-            img=data,
-            text=text,
-            org=pt,
-            fontFace=fontFace,
-            color=tuple(color_bgr),
-            lineType=lineType,
-            fontScale=self.config['TEXT_PROPERTIES']['FONT_SCALE'],
-            thickness=self.config['TEXT_PROPERTIES']['FONT_THICKNESS'],
-        )
+        # rendered lines are cached, unchanged lines are only blended
+        self._overlay_cache.text(data, text, pt, color_bgr)
 
 
     def get_extra_text(self):
@@ -2698,7 +3709,7 @@ class ImageProcessor(object):
 
         if not logo_overlay:
             logger.warning('No logo overlay defined')
-            return None, None
+            return None
 
 
         logo_overlay_p = Path(logo_overlay)
@@ -2706,45 +3717,82 @@ class ImageProcessor(object):
         try:
             if not logo_overlay_p.exists():
                 logger.error('%s does not exist', logo_overlay_p)
-                return None, None
+                return None
 
 
             if not logo_overlay_p.is_file():
                 logger.error('%s is not a file', logo_overlay_p)
-                return None, None
+                return None
 
         except PermissionError as e:
             logger.error(str(e))
-            return None, None
+            return None
 
         overlay_img = cv2.imread(str(logo_overlay_p), cv2.IMREAD_UNCHANGED)
         if isinstance(overlay_img, type(None)):
             logger.error('%s is not a valid image', logo_overlay_p)
-            return False, None  # False so the image is not retried
+            return False  # False so the image is not retried
+
+
+        if self._geometry.scale != 1.0:
+            # logo is defined against the full size image
+            overlay_height, overlay_width = overlay_img.shape[:2]
+            overlay_img = cv2.resize(
+                overlay_img,
+                self._geometry.scaledSize(overlay_width, overlay_height),
+                interpolation=cv2.INTER_AREA,
+            )
 
 
         if overlay_img.shape[:2] != image.shape[:2]:
             logger.error('Logo dimensions do not match image')
-            return False, None  # False so the image is not retried
+            return False  # False so the image is not retried
 
 
         try:
             if overlay_img.shape[2] != 4:
                 logger.error('%s does not have an alpha channel')
-                return False, None  # False so the image is not retried
+                return False  # False so the image is not retried
         except IndexError:
             logger.error('%s does not have an alpha channel')
-            return False, None  # False so the image is not retried
+            return False  # False so the image is not retried
+
+
+        return overlay_img
+
+
+    def _logoOverlayLayers(self, overlay_img, image):
+        # returns (premultiplied logo, inverse alpha, color, bounding box) for images with the same dimensions
+        overlay_bgr = overlay_img[:, :, :3]
+        overlay_alpha = overlay_img[:, :, 3]
+
+        overlay_color = True
+        if len(image.shape) == 2:
+            # mono image, the logo is only blended in color if it has color
+            b, g, r = cv2.split(overlay_bgr)
+            if not cv2.countNonZero(cv2.absdiff(b, g)) and not cv2.countNonZero(cv2.absdiff(b, r)):
+                overlay_color = False
+
+
+        if overlay_color:
+            overlay_alpha = cv2.merge((overlay_alpha, overlay_alpha, overlay_alpha))
+        else:
+            overlay_bgr = overlay_bgr[:, :, 0]
 
 
-        overlay_rgb = overlay_img[:, :, :3]
-        overlay_alpha = (overlay_img[:, :, 3] / 255).astype(numpy.float32)
+        # only the non-transparent area needs to be composited
+        x, y, w, h = cv2.boundingRect((overlay_img[:, :, 3] > 0).astype(numpy.uint8))
 
+        overlay_bgr = overlay_bgr[y:y + h, x:x + w]
+        overlay_alpha = overlay_alpha[y:y + h, x:x + w]
 
-        alpha_mask = numpy.dstack((overlay_alpha, overlay_alpha, overlay_alpha))
 
+        # premultiplied layers in 8 bit fixed point
+        overlay_premult = numpy.multiply(overlay_bgr, overlay_alpha, dtype=numpy.uint16)
+        inverse_alpha = (255 - overlay_alpha).astype(numpy.uint16)
 
-        return overlay_rgb, alpha_mask
+
+        return overlay_premult, inverse_alpha, overlay_color, (x, y, x + w, y + h)
 
 
     def _generate_image_circle_mask(self, image):
@@ -2762,10 +3810,16 @@ class ImageProcessor(object):
 
         channel_mask = numpy.full([image_height, image_width], background, dtype=numpy.uint8)
 
-        center_x = int(image_width / 2) + self.config['IMAGE_CIRCLE_MASK']['OFFSET_X']
-        center_y = int(image_height / 2) - self.config['IMAGE_CIRCLE_MASK']['OFFSET_Y']  # minus
-        radius = int(self.config['IMAGE_CIRCLE_MASK']['DIAMETER'] / 2)
+        # circle is defined against the full size image
+        scale = self._geometry.scale
+
+        center_x = int(image_width / 2) + int(self.config['IMAGE_CIRCLE_MASK']['OFFSET_X'] * scale)
+        center_y = int(image_height / 2) - int(self.config['IMAGE_CIRCLE_MASK']['OFFSET_Y'] * scale)  # minus
+        radius = int(self.config['IMAGE_CIRCLE_MASK']['DIAMETER'] * scale / 2)
+
         blur = self.config['IMAGE_CIRCLE_MASK']['BLUR']
+        if blur:
+            blur = max(int(blur * scale), 1)
 
 
         # draw a white circle
@@ -2787,9 +3841,9 @@ class ImageProcessor(object):
             )
 
 
-        channel_alpha = (channel_mask / 255).astype(numpy.float32)
-
-        alpha_mask = numpy.dstack((channel_alpha, channel_alpha, channel_alpha))
+        if len(image.shape) == 2:
+            # mono
+            return channel_mask
 
-        return alpha_mask
+        return cv2.merge((channel_mask, channel_mask, channel_mask))
 
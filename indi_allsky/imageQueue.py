@@ -0,0 +1,149 @@
+from pathlib import Path
+from multiprocessing import Queue
+from multiprocessing import Value
+import queue
+import logging
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyImageQueue(object):
+    """Bounded queue of frames waiting for the ImageWorker.
+
+    Frames are put by the camera client, the policy decides what happens
+    when max_depth frames are already waiting:
+
+      drop_oldest - the oldest waiting frame is discarded
+      drop_newest - the new frame is discarded
+      pause       - the main loop delays the next exposure, see backlogged()
+
+    Control messages (stop) are never dropped.  Discarded frames have their
+    spooled file removed or their shared memory slot released.
+    """
+
+    policies = (
+        'drop_oldest',
+        'drop_newest',
+        'pause',
+    )
+
+
+    def __init__(self, max_depth=0, policy='drop_oldest'):
+        self._max_depth = int(max_depth)  # 0 = unbounded
+
+        if policy not in self.policies:
+            logger.error('Unknown image queue policy: %s', policy)
+            policy = 'drop_oldest'
+
+        self._policy = policy
+
+        self._q = Queue()
+        self._dropped_v = Value('i', 0)
+
+        self.frame_ring = None  # set when shared memory transport is used
+
+
+    @property
+    def max_depth(self):
+        return self._max_depth
+
+    @max_depth.setter
+    def max_depth(self, *args):
+        pass  # read only
+
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @policy.setter
+    def policy(self, *args):
+        pass  # read only
+
+
+    @property
+    def dropped(self):
+        return self._dropped_v.value
+
+    @dropped.setter
+    def dropped(self, *args):
+        pass  # read only
+
+
+    def put(self, item):
+        if item.get('stop') or not self._max_depth:
+            self._q.put(item)
+            return
+
+
+        if self.qsize() < self._max_depth:
+            self._q.put(item)
+            return
+
+
+        if self._policy == 'drop_oldest':
+            try:
+                old_item = self._q.get_nowait()
+            except queue.Empty:
+                # worker caught up
+                old_item = None
+
+            if old_item and old_item.get('stop'):
+                # stop must still reach the worker
+                self._q.put(old_item)
+            elif old_item:
+                logger.warning('Image queue full (%d), dropping oldest frame', self._max_depth)
+                self._discard(old_item)
+
+            self._q.put(item)
+            return
+
+
+        # drop_newest, or pause when the camera was not paused in time
+        logger.warning('Image queue full (%d), dropping newest frame', self._max_depth)
+        self._discard(item)
+
+
+    def get(self, timeout=None):
+        return self._q.get(timeout=timeout)
+
+
+    def get_nowait(self):
+        return self._q.get_nowait()
+
+
+    def qsize(self):
+        try:
+            return self._q.qsize()
+        except NotImplementedError:
+            # macOS
+            return 0
+
+
+    def backlogged(self):
+        # True if the next exposure should be delayed
+        if self._policy != 'pause' or not self._max_depth:
+            return False
+
+        return self.qsize() >= self._max_depth
+
+
+    def _discard(self, item):
+        with self._dropped_v.get_lock():
+            self._dropped_v.value += 1
+
+
+        frame_slot = item.get('frame_slot')
+        if not isinstance(frame_slot, type(None)):
+            if self.frame_ring:
+                self.frame_ring.release(frame_slot)
+
+            return
+
+
+        if item.get('filename'):
+            try:
+                Path(item['filename']).unlink()
+            except FileNotFoundError:
+                pass
@@ -18,6 +18,8 @@ class KeogramGenerator(object):
     line_thickness = 2
     line_length = 35
 
+    default_columns = 1024  # initial buffer size when the image count is not known
+
 
     def __init__(self, config):
         self.config = config
@@ -33,6 +35,14 @@ class KeogramGenerator(object):
         self.rotated_height = None
 
         self.keogram_data = None
+        self._column_count = 0
+        self._reserved_columns = 0
+        self._keogram_height = None  # height of the first column if not set
+
+        # sample coordinates of the rotated center line, calculated once per image size
+        self._sample_key = None
+        self._sample_map_x = None
+        self._sample_map_y = None
 
         self.timestamps_list = list()
         self.image_processing_elapsed_s = 0
@@ -65,6 +75,19 @@ class KeogramGenerator(object):
         self._h_scale_factor = int(new_factor)
 
 
+    @property
+    def keogram_height(self):
+        return self._keogram_height
+
+    @keogram_height.setter
+    def keogram_height(self, new_height):
+        if isinstance(new_height, type(None)):
+            self._keogram_height = None
+            return
+
+        self._keogram_height = int(new_height)
+
+
     def generate(self, outfile, file_list):
         # Exclude empty files
         file_list_nonzero = filter(lambda p: p.stat().st_size != 0, file_list)
@@ -72,6 +95,8 @@ class KeogramGenerator(object):
         # Sort by timestamp
         file_list_ordered = sorted(file_list_nonzero, key=lambda p: p.stat().st_mtime)
 
+        self.reserve(len(file_list_ordered))
+
 
         processing_start = time.time()
 
@@ -92,38 +117,179 @@ class KeogramGenerator(object):
         logger.warning('Total keogram processing in %0.1f s', processing_elapsed_s)
 
 
+    def reserve(self, image_count):
+        # size of the keogram buffer, normally the number of images in the DB
+        self._reserved_columns = int(image_count)
+
+
     def processImage(self, filename, image):
         image_processing_start = time.time()
 
         self.timestamps_list.append(filename.stat().st_mtime)
 
+        rotated_center_line = self.extractColumn(image)
+
+        if isinstance(self.keogram_data, type(None)):
+            self._allocate(rotated_center_line)
+        elif self._column_count >= self.keogram_data.shape[1]:
+            self._grow()
+
+
+        keogram_height = self.keogram_data.shape[0]
+        if rotated_center_line.shape[0] != keogram_height:
+            # frame size changed during the night
+            rotated_center_line = cv2.resize(rotated_center_line, (1, keogram_height), interpolation=cv2.INTER_AREA)
+
+        self.keogram_data[:, self._column_count] = rotated_center_line.reshape(self.keogram_data[:, self._column_count].shape)
+        self._column_count += 1
+
+        self.image_processing_elapsed_s += time.time() - image_processing_start
+
+
+    def extractColumn(self, image):
+        # returns the center column of the rotated image, only the pixels on the line are sampled
         height, width = image.shape[:2]
+
+        if self._sample_key != (width, height, self._angle):
+            self._calculateSampleMaps(width, height)
+
+        return cv2.remap(image, self._sample_map_x, self._sample_map_y, cv2.INTER_LINEAR)
+
+
+    def columnHeight(self, image):
+        # height of the column extracted from the image
+        height, width = image.shape[:2]
+
+        _, _, bound_h = self._rotationMatrix(width, height)
+
+        return bound_h
+
+
+    def _calculateSampleMaps(self, width, height):
         self.original_height = height
         self.original_width = width
 
 
-        rotated_image = self.rotate(image)
-        del image
+        rot, bound_w, bound_h = self._rotationMatrix(width, height)
+
+        self.rotated_height = bound_h
+        self.rotated_width = bound_w
+
+
+        # map the center column of the rotated image back to the original image
+        inv = cv2.invertAffineTransform(rot)
+
+        center_x = int(bound_w / 2)
+        y = numpy.arange(bound_h, dtype=numpy.float64)
+
+        self._sample_map_x = ((inv[0, 0] * center_x) + (inv[0, 1] * y) + inv[0, 2]).astype(numpy.float32).reshape((bound_h, 1))
+        self._sample_map_y = ((inv[1, 0] * center_x) + (inv[1, 1] * y) + inv[1, 2]).astype(numpy.float32).reshape((bound_h, 1))
+
+        self._sample_key = (width, height, self._angle)
+
 
+    def _allocate(self, column):
+        columns = self._reserved_columns
+        if not columns:
+            columns = self.default_columns
 
-        rot_height, rot_width = rotated_image.shape[:2]
-        self.rotated_height = rot_height
-        self.rotated_width = rot_width
+        keogram_height = self._keogram_height
+        if not keogram_height:
+            keogram_height = column.shape[0]
 
-        rotated_center_line = rotated_image[:, [int(rot_width / 2)]]
+        new_shape = (keogram_height, columns) + column.shape[2:]
+        logger.info('New Shape: %s', pformat(new_shape))
 
+        new_dtype = column.dtype
+        logger.info('New dtype: %s', new_dtype)
+
+        self.keogram_data = numpy.zeros(new_shape, dtype=new_dtype)
+        self._column_count = 0
+
+
+    def _grow(self):
+        # more images than reserved
+        old_data = self.keogram_data
+
+        new_shape = list(old_data.shape)
+        new_shape[1] = old_data.shape[1] * 2
+
+        self.keogram_data = numpy.zeros(new_shape, dtype=old_data.dtype)
+        self.keogram_data[:, :self._column_count] = old_data[:, :self._column_count]
+
+
+    def getDimensions(self):
+        # dimensions of the last image, needed to trim the keogram
+        return {
+            'original_width'  : self.original_width,
+            'original_height' : self.original_height,
+            'rotated_width'   : self.rotated_width,
+            'rotated_height'  : self.rotated_height,
+            'angle'           : self._angle,
+        }
+
+
+    def getState(self):
+        # columns processed so far, merged with mergeState()
         if isinstance(self.keogram_data, type(None)):
-            new_shape = rotated_center_line.shape
-            logger.info('New Shape: %s', pformat(new_shape))
+            keogram_data = None
+        else:
+            keogram_data = self.keogram_data[:, :self._column_count]
 
-            new_dtype = rotated_center_line.dtype
-            logger.info('New dtype: %s', new_dtype)
+        return {
+            'keogram_data'    : keogram_data,
+            'timestamps_list' : list(self.timestamps_list),
+            'dimensions'      : self.getDimensions(),
+            'elapsed'         : self.image_processing_elapsed_s,
+        }
 
-            self.keogram_data = numpy.empty(new_shape, dtype=new_dtype)
 
-        self.keogram_data = numpy.append(self.keogram_data, rotated_center_line, 1)
+    def mergeState(self, state):
+        # appends columns processed by another generator, states must be merged in order
+        self.image_processing_elapsed_s += state['elapsed']
 
-        self.image_processing_elapsed_s += time.time() - image_processing_start
+        keogram_data = state['keogram_data']
+        if isinstance(keogram_data, type(None)):
+            return
+
+
+        column_count = keogram_data.shape[1]
+
+        if isinstance(self.keogram_data, type(None)):
+            self._allocate(keogram_data[:, [0]])
+
+        while self._column_count + column_count > self.keogram_data.shape[1]:
+            self._grow()
+
+
+        keogram_height = self.keogram_data.shape[0]
+        if keogram_data.shape[0] != keogram_height:
+            # frame size changed during the night
+            keogram_data = cv2.resize(keogram_data, (column_count, keogram_height), interpolation=cv2.INTER_AREA)
+
+        self.keogram_data[:, self._column_count:self._column_count + column_count] = keogram_data.reshape(self.keogram_data[:, :column_count].shape)
+        self._column_count += column_count
+
+        self.timestamps_list.extend(state['timestamps_list'])
+
+
+        dimensions = state['dimensions']
+        self.original_width = dimensions['original_width']
+        self.original_height = dimensions['original_height']
+        self.rotated_width = dimensions['rotated_width']
+        self.rotated_height = dimensions['rotated_height']
+
+
+    def loadStrip(self, keogram_data, timestamps_list, dimensions):
+        # keogram columns collected during capture, the images are not read again
+        self.keogram_data = keogram_data
+        self._column_count = keogram_data.shape[1]
+        self.timestamps_list = list(timestamps_list)
+
+        self.original_width = dimensions['original_width']
+        self.original_height = dimensions['original_height']
+        self.rotated_width = dimensions['rotated_width']
+        self.rotated_height = dimensions['rotated_height']
 
 
     def finalize(self, outfile):
@@ -131,17 +297,7 @@ class KeogramGenerator(object):
 
         logger.info('Images processed for keogram in %0.1f s', self.image_processing_elapsed_s)
 
-        # trim off the top and bottom bars
-        keogram_trimmed = self.trimEdges(self.keogram_data)
-
-        # scale horizontal size
-        trimmed_height, trimmed_width = keogram_trimmed.shape[:2]
-        new_width = int(trimmed_width * self._h_scale_factor / 100)
-        new_height = int(trimmed_height * self._v_scale_factor / 100)
-        keogram_resized = cv2.resize(keogram_trimmed, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
-        # apply time labels
-        self.applyLabels(keogram_resized)
+        keogram_resized = self.render()
 
 
         write_img_start = time.time()
@@ -164,8 +320,34 @@ class KeogramGenerator(object):
         outfile_p.chmod(0o644)
 
 
+    def render(self):
+        # trim off the unused columns and the top and bottom bars
+        keogram_trimmed = self.trimEdges(self.keogram_data[:, :self._column_count])
+
+        # scale horizontal size
+        trimmed_height, trimmed_width = keogram_trimmed.shape[:2]
+        new_width = int(trimmed_width * self._h_scale_factor / 100)
+        new_height = int(trimmed_height * self._v_scale_factor / 100)
+        keogram_resized = cv2.resize(keogram_trimmed, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+        # apply time labels
+        self.applyLabels(keogram_resized)
+
+        return keogram_resized
+
+
     def rotate(self, image):
         height, width = image.shape[:2]
+
+        rot, bound_w, bound_h = self._rotationMatrix(width, height)
+
+        rotated = cv2.warpAffine(image, rot, (bound_w, bound_h))
+
+        return rotated
+
+
+    def _rotationMatrix(self, width, height):
+        # rotation into the bounding box of the rotated image
         center = (width / 2, height / 2)
 
         rot = cv2.getRotationMatrix2D(center, self._angle, 1.0)
@@ -179,9 +361,7 @@ class KeogramGenerator(object):
         rot[0, 2] += bound_w / 2 - center[0]
         rot[1, 2] += bound_h / 2 - center[1]
 
-        rotated = cv2.warpAffine(image, rot, (bound_w, bound_h))
-
-        return rotated
+        return rot, bound_w, bound_h
 
 
     def trimEdges(self, image):
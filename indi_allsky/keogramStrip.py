@@ -0,0 +1,227 @@
+import io
+import json
+import time
+from pathlib import Path
+import cv2
+import numpy
+import logging
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyKeogramStrip(object):
+    """Keogram columns collected while images are captured.
+
+    Each column is appended to a memory mapped .npy file in the day/night
+    image folder, with the exposure timestamps in a second file.  The files
+    survive restarts, the end of night processing only has to trim, scale
+    and label the strip.
+
+    Columns are stored as rows of the file, so every append only touches a
+    contiguous block.  A timestamp is only written after its column, the
+    number of columns is the number of timestamps that are set.
+    """
+
+    strip_name = 'keogram_strip.npy'
+    timestamps_name = 'keogram_strip_ts.npy'
+    info_name = 'keogram_strip.json'
+
+    initial_columns = 4096  # grows when full
+
+
+    def __init__(self, folder):
+        self.folder_p = Path(folder)
+
+        self._data = None
+        self._timestamps = None
+        self._info = None
+        self._count = 0
+
+
+    @property
+    def count(self):
+        return self._count
+
+    @count.setter
+    def count(self, *args):
+        pass  # read only
+
+
+    @property
+    def info(self):
+        return self._info
+
+    @info.setter
+    def info(self, *args):
+        pass  # read only
+
+
+    @classmethod
+    def exists(cls, folder):
+        folder_p = Path(folder)
+
+        for name in (cls.strip_name, cls.timestamps_name, cls.info_name):
+            if not folder_p.joinpath(name).exists():
+                return False
+
+        return True
+
+
+    @classmethod
+    def remove(cls, folder):
+        folder_p = Path(folder)
+
+        for name in (cls.strip_name, cls.timestamps_name, cls.info_name):
+            try:
+                folder_p.joinpath(name).unlink()
+            except FileNotFoundError:
+                pass
+
+
+    def open(self):
+        # returns False if there is no usable strip
+        if not self.exists(self.folder_p):
+            return False
+
+        try:
+            with io.open(str(self.folder_p.joinpath(self.info_name)), 'r') as f_info:
+                self._info = json.load(f_info)
+
+            self._data = numpy.load(str(self.folder_p.joinpath(self.strip_name)), mmap_mode='r+')
+            self._timestamps = numpy.load(str(self.folder_p.joinpath(self.timestamps_name)), mmap_mode='r+')
+        except (OSError, ValueError) as e:
+            logger.error('Unable to open keogram strip: %s', str(e))
+            self.close()
+            return False
+
+
+        self._count = int(numpy.count_nonzero(self._timestamps))
+        logger.info('Opened keogram strip with %d columns: %s', self._count, self.folder_p)
+
+        return True
+
+
+    def close(self):
+        self._data = None  # unmapped when released
+        self._timestamps = None
+        self._info = None
+        self._count = 0
+
+
+    def append(self, column, timestamp, dimensions):
+        if isinstance(self._data, type(None)):
+            if not self.open():
+                self._create(column, dimensions)
+
+
+        if self._count >= self._timestamps.shape[0]:
+            self._grow()
+
+
+        strip_height = self._data.shape[1]
+
+        if len(column.shape) == 2:
+            column = cv2.cvtColor(column, cv2.COLOR_GRAY2BGR)
+
+        if column.shape[0] != strip_height:
+            # frame size changed during the night
+            column = cv2.resize(column, (1, strip_height), interpolation=cv2.INTER_AREA).reshape((strip_height, 1, 3))
+
+
+        self._data[self._count] = column[:, 0]
+        self._data.flush()
+
+        self._timestamps[self._count] = timestamp
+        self._timestamps.flush()
+
+        self._count += 1
+
+
+    def getData(self):
+        # copy of the columns as a keogram image, the strip may keep growing
+        return numpy.ascontiguousarray(self._data[:self._count].transpose(1, 0, 2))
+
+
+    def getTimestamps(self):
+        return self._timestamps[:self._count].tolist()
+
+
+    def _create(self, column, dimensions):
+        logger.info('Creating keogram strip: %s', self.folder_p)
+
+        if not self.folder_p.exists():
+            self.folder_p.mkdir(mode=0o755, parents=True)
+
+
+        self._info = dict(dimensions)
+
+        with io.open(str(self.folder_p.joinpath(self.info_name)), 'w') as f_info:
+            json.dump(self._info, f_info, indent=4)
+
+
+        self._data = numpy.lib.format.open_memmap(
+            str(self.folder_p.joinpath(self.strip_name)),
+            mode='w+',
+            dtype=numpy.uint8,
+            shape=(self.initial_columns, column.shape[0], 3),
+        )
+
+        self._timestamps = numpy.lib.format.open_memmap(
+            str(self.folder_p.joinpath(self.timestamps_name)),
+            mode='w+',
+            dtype=numpy.float64,
+            shape=(self.initial_columns,),
+        )
+
+        self._count = 0
+
+
+    def _grow(self):
+        grow_start = time.time()
+
+        old_data = self._data
+        old_timestamps = self._timestamps
+
+        new_columns = old_timestamps.shape[0] * 2
+
+        strip_p = self.folder_p.joinpath(self.strip_name)
+        timestamps_p = self.folder_p.joinpath(self.timestamps_name)
+
+        tmp_strip_p = strip_p.with_name('.{0:s}.tmp'.format(self.strip_name))
+        tmp_timestamps_p = timestamps_p.with_name('.{0:s}.tmp'.format(self.timestamps_name))
+
+
+        new_data = numpy.lib.format.open_memmap(
+            str(tmp_strip_p),
+            mode='w+',
+            dtype=numpy.uint8,
+            shape=(new_columns, old_data.shape[1], 3),
+        )
+        new_data[:self._count] = old_data[:self._count]
+        new_data.flush()
+
+        new_timestamps = numpy.lib.format.open_memmap(
+            str(tmp_timestamps_p),
+            mode='w+',
+            dtype=numpy.float64,
+            shape=(new_columns,),
+        )
+        new_timestamps[:self._count] = old_timestamps[:self._count]
+        new_timestamps.flush()
+
+
+        del old_data
+        del old_timestamps
+        self._data = None
+        self._timestamps = None
+
+
+        # the strip is replaced before the timestamps, a crash in between only loses the new space
+        tmp_strip_p.replace(strip_p)
+        tmp_timestamps_p.replace(timestamps_p)
+
+        self._data = new_data
+        self._timestamps = new_timestamps
+
+        logger.info('Keogram strip grown to %d columns in %0.4f s', new_columns, time.time() - grow_start)
@@ -1,8 +1,7 @@
 import cv2
-import math
 import logging
 
-import ephem
+from .overlayCache import IndiAllSkyOverlayCache
 
 logger = logging.getLogger('indi_allsky')
 
@@ -12,21 +11,23 @@ class IndiAllskyOrbGenerator(object):
 
     line_thickness = 2
 
+    # sunrise/sunset, civil, nautical and astronomical
+    event_horizons = (0.0, -6.0, -12.0, -18.0)
+
 
     def __init__(self, config):
         self.config = config
 
+        self._overlay = IndiAllSkyOverlayCache(self.config)
+
 
-    def drawOrbsHourAngle(self, data_bytes, utcnow, color_bgr, obs, sun, moon):
+    def drawOrbsHourAngle(self, data_bytes, utcnow, color_bgr, ephemeris):
         image_height, image_width = data_bytes.shape[:2]
 
-        obs.date = utcnow
-        sun.compute(obs)
-        sunOrbX, sunOrbY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
+        position = ephemeris.position(utcnow)
 
-        obs.date = utcnow
-        moon.compute(obs)
-        moonOrbX, moonOrbY = self.getOrbHourAngleXY(moon, obs, (image_height, image_width))
+        sunOrbX, sunOrbY = self.getOrbHourAngleXY(position['sun_ha'], (image_height, image_width))
+        moonOrbX, moonOrbY = self.getOrbHourAngleXY(position['moon_ha'], (image_height, image_width))
 
 
         # Sun
@@ -43,233 +44,18 @@ class IndiAllskyOrbGenerator(object):
         self.drawEdgeCircle(data_bytes, (moonOrbX, moonOrbY), moon_color_bgr)
 
 
+        # Sunrise/dawn and sunset/twilight, then the night/day boundaries
+        for event in self._sunEvents(utcnow, color_bgr, ephemeris):
+            event_position, event_color_bgr = event
 
+            eventX, eventY = self.getOrbHourAngleXY(event_position['sun_ha'], (image_height, image_width))
+            self.drawEdgeLine(data_bytes, (eventX, eventY), event_color_bgr)
 
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Sunrise
-        try:
-            obs.horizon = math.radians(0.0)
-            sun_rise_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_rise_date
-            sun.compute(obs)
-            sunRiseX, sunRiseY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunRiseX, sunRiseY), (100, 100, 100))
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Civil dawn
-        try:
-            obs.horizon = math.radians(-6.0)
-            sun_civilDawn_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_civilDawn_date
-            sun.compute(obs)
-            sunCivilDawnX, sunCivilDawnY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunCivilDawnX, sunCivilDawnY), (100, 100, 100))
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Nautical dawn
-        try:
-            obs.horizon = math.radians(-12.0)
-            sun_nauticalDawn_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_nauticalDawn_date
-            sun.compute(obs)
-            sunNauticalDawnX, sunNauticalDawnY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunNauticalDawnX, sunNauticalDawnY), (100, 100, 100))
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Astronomical dawn
-        try:
-            obs.horizon = math.radians(-18.0)
-            sun_astroDawn_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_astroDawn_date
-            sun.compute(obs)
-            sunAstroDawnX, sunAstroDawnY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunAstroDawnX, sunAstroDawnY), (100, 100, 100))
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Sunset
-        try:
-            obs.horizon = math.radians(0.0)
-            sun_set_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_set_date
-            sun.compute(obs)
-            sunSunSetX, sunSunSetY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunSunSetX, sunSunSetY), (100, 100, 100))
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Civil twilight
-        try:
-            obs.horizon = math.radians(-6.0)
-            sun_civilTwilight_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_civilTwilight_date
-            sun.compute(obs)
-            sunCivilTwilightX, sunCivilTwilightY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunCivilTwilightX, sunCivilTwilightY), (100, 100, 100))
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Nautical twilight
-        try:
-            obs.horizon = math.radians(-12.0)
-            sun_nauticalTwilight_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_nauticalTwilight_date
-            sun.compute(obs)
-            sunNauticalTwilightX, sunNauticalTwilightY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunNauticalTwilightX, sunNauticalTwilightY), (100, 100, 100))
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Astronomical twilight
-        try:
-            obs.horizon = math.radians(-18.0)
-            sun_astroTwilight_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_astroTwilight_date
-            sun.compute(obs)
-            sunAstroTwilightX, sunAstroTwilightY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunAstroTwilightX, sunAstroTwilightY), (100, 100, 100))
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
 
-        # Night/Day boundary
-        try:
-            obs.horizon = math.radians(self.config['NIGHT_SUN_ALT_DEG'])
-            sun_nightDay_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_nightDay_date
-            sun.compute(obs)
-            sunNightDayX, sunNightDayY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunNightDayX, sunNightDayY), color_bgr)
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Day/Night boundary
-        try:
-            obs.horizon = math.radians(self.config['NIGHT_SUN_ALT_DEG'])
-            sun_dayNight_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_dayNight_date
-            sun.compute(obs)
-            sunDayNightX, sunDayNightY = self.getOrbHourAngleXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunDayNightX, sunDayNightY), color_bgr)
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-
-    def getOrbHourAngleXY(self, skyObj, obs, image_size):
+    def getOrbHourAngleXY(self, ha_deg, image_size):
         image_height, image_width = image_size
 
-        ha_rad = obs.sidereal_time() - skyObj.ra
-        ha_deg = math.degrees(ha_rad)
-
-        if ha_deg < -180:
-            ha_deg = 360 + ha_deg
-        elif ha_deg > 180:
-            ha_deg = -360 + ha_deg
-        else:
-            pass
-
-        #logger.info('%s hour angle: %0.2f @ %s', skyObj.name, ha_deg, obs.date)
+        #logger.info('Hour angle: %0.2f', ha_deg)
 
         abs_ha_deg = abs(ha_deg)
         perimeter_half = image_width + image_height
@@ -303,7 +89,9 @@ class IndiAllskyOrbGenerator(object):
             x = 0
             y = mapped_ha_deg - (image_width / 2)
         else:
-            raise Exception('This cannot happen')
+            # exactly on the meridian
+            x = image_width / 2
+            y = 0
 
 
         #logger.info('Orb: %0.2f x %0.2f', x, y)
@@ -311,16 +99,13 @@ class IndiAllskyOrbGenerator(object):
         return int(x), int(y)
 
 
-    def drawOrbsAzimuth(self, data_bytes, utcnow, color_bgr, obs, sun, moon):
+    def drawOrbsAzimuth(self, data_bytes, utcnow, color_bgr, ephemeris):
         image_height, image_width = data_bytes.shape[:2]
 
-        obs.date = utcnow
-        sun.compute(obs)
-        sunOrbX, sunOrbY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
+        position = ephemeris.position(utcnow)
 
-        obs.date = utcnow
-        moon.compute(obs)
-        moonOrbX, moonOrbY = self.getOrbAzimuthXY(moon, obs, (image_height, image_width))
+        sunOrbX, sunOrbY = self.getOrbAzimuthXY(position['sun_az'], (image_height, image_width))
+        moonOrbX, moonOrbY = self.getOrbAzimuthXY(position['moon_az'], (image_height, image_width))
 
 
         # Sun
@@ -337,222 +122,17 @@ class IndiAllskyOrbGenerator(object):
         self.drawEdgeCircle(data_bytes, (moonOrbX, moonOrbY), moon_color_bgr)
 
 
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Sunrise
-        try:
-            obs.horizon = math.radians(0.0)
-            sun_rise_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_rise_date
-            sun.compute(obs)
-            sunSunRiseX, sunSunRiseY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunSunRiseX, sunSunRiseY), (100, 100, 100))
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Civil dawn
-        try:
-            obs.horizon = math.radians(-6.0)
-            sun_civilDawn_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_civilDawn_date
-            sun.compute(obs)
-            sunCivilDawnX, sunCivilDawnY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunCivilDawnX, sunCivilDawnY), (100, 100, 100))
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Nautical dawn
-        try:
-            obs.horizon = math.radians(-12.0)
-            sun_nauticalDawn_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_nauticalDawn_date
-            sun.compute(obs)
-            sunNauticalDawnX, sunNauticalDawnY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunNauticalDawnX, sunNauticalDawnY), (100, 100, 100))
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Astronomical dawn
-        try:
-            obs.horizon = math.radians(-18.0)
-            sun_astroDawn_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_astroDawn_date
-            sun.compute(obs)
-            sunAstroDawnX, sunAstroDawnY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunAstroDawnX, sunAstroDawnY), (100, 100, 100))
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Sunset
-        try:
-            obs.horizon = math.radians(0.0)
-            sun_set_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_set_date
-            sun.compute(obs)
-            sunSunSetX, sunSunSetY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunSunSetX, sunSunSetY), (100, 100, 100))
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Civil twilight
-        try:
-            obs.horizon = math.radians(-6.0)
-            sun_civilTwilight_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_civilTwilight_date
-            sun.compute(obs)
-            sunCivilTwilightX, sunCivilTwilightY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunCivilTwilightX, sunCivilTwilightY), (100, 100, 100))
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
+        # Sunrise/dawn and sunset/twilight, then the night/day boundaries
+        for event in self._sunEvents(utcnow, color_bgr, ephemeris):
+            event_position, event_color_bgr = event
 
-        obs.date = utcnow  # reset
-        sun.compute(obs)
+            eventX, eventY = self.getOrbAzimuthXY(event_position['sun_az'], (image_height, image_width))
+            self.drawEdgeLine(data_bytes, (eventX, eventY), event_color_bgr)
 
-        # Nautical twilight
-        try:
-            obs.horizon = math.radians(-12.0)
-            sun_nauticalTwilight_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_nauticalTwilight_date
-            sun.compute(obs)
-            sunNauticalTwilightX, sunNauticalTwilightY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunNauticalTwilightX, sunNauticalTwilightY), (100, 100, 100))
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Astronomical twilight
-        try:
-            obs.horizon = math.radians(-18.0)
-            sun_astroTwilight_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_astroTwilight_date
-            sun.compute(obs)
-            sunAstroTwilightX, sunAstroTwilightY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunAstroTwilightX, sunAstroTwilightY), (100, 100, 100))
-        except ephem.AlwaysUpError:
-            # northern hemisphere
-            pass
-        except ephem.NeverUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
-
-        # Night/Day
-        try:
-            obs.horizon = math.radians(self.config['NIGHT_SUN_ALT_DEG'])
-            sun_nightDay_date = obs.next_rising(sun, use_center=True)
-
-            obs.date = sun_nightDay_date
-            sun.compute(obs)
-            sunNightDayX, sunNightDayY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunNightDayX, sunNightDayY), color_bgr)
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-        obs.date = utcnow  # reset
-        sun.compute(obs)
 
-        # Day/Night
-        try:
-            obs.horizon = math.radians(self.config['NIGHT_SUN_ALT_DEG'])
-            sun_dayNight_date = obs.next_setting(sun, use_center=True)
-
-            obs.date = sun_dayNight_date
-            sun.compute(obs)
-            sunDayNightX, sunDayNightY = self.getOrbAzimuthXY(sun, obs, (image_height, image_width))
-
-            self.drawEdgeLine(data_bytes, (sunDayNightX, sunDayNightY), color_bgr)
-        except ephem.NeverUpError:
-            # northern hemisphere
-            pass
-        except ephem.AlwaysUpError:
-            # southern hemisphere
-            pass
-
-
-    def getOrbAzimuthXY(self, skyObj, obs, image_size):
+    def getOrbAzimuthXY(self, az_deg, image_size):
         image_height, image_width = image_size
 
-        az_deg = math.degrees(skyObj.az)
-
-
         # For now, I am too lazy to fix the calculations below (pulled from hour angle code)
         if az_deg < 180:
             az_deg = az_deg * -1
@@ -560,7 +140,7 @@ class IndiAllskyOrbGenerator(object):
             az_deg = (-360 + az_deg) * -1
 
 
-        #logger.info('%s azimuth: %0.2f @ %s', skyObj.name, az_deg, obs.date)
+        #logger.info('Azimuth: %0.2f', az_deg)
 
         abs_az_deg = abs(az_deg)
         perimeter_half = image_width + image_height
@@ -594,7 +174,9 @@ class IndiAllskyOrbGenerator(object):
             x = 0
             y = mapped_az_deg - (image_width / 2)
         else:
-            raise Exception('This cannot happen')
+            # due north
+            x = image_width / 2
+            y = 0
 
 
         #logger.info('Orb: %0.2f x %0.2f', x, y)
@@ -602,16 +184,33 @@ class IndiAllskyOrbGenerator(object):
         return int(x), int(y)
 
 
-    def drawOrbsAltitude(self, data_bytes, utcnow, color_bgr, obs, sun, moon):
+    def _sunEvents(self, utcnow, color_bgr, ephemeris):
+        # sun position at the next crossing of each horizon, skipped if the sun does not cross
+        events = list()
+
+        for horizon in self.event_horizons:
+            for rising in (True, False):
+                event_position = ephemeris.nextCrossing(utcnow, horizon, rising=rising)
+                if event_position:
+                    events.append((event_position, (100, 100, 100)))
+
+
+        for rising in (True, False):
+            event_position = ephemeris.nextCrossing(utcnow, self.config['NIGHT_SUN_ALT_DEG'], rising=rising)
+            if event_position:
+                events.append((event_position, color_bgr))
+
+
+        return events
+
+
+    def drawOrbsAltitude(self, data_bytes, utcnow, color_bgr, ephemeris):
         image_height, image_width = data_bytes.shape[:2]
 
-        obs.date = utcnow
-        sun.compute(obs)
-        sunOrbX, sunOrbY = self.getOrbAltitudeXY(sun, obs, (image_height, image_width), utcnow)
+        position = ephemeris.position(utcnow)
 
-        obs.date = utcnow
-        moon.compute(obs)
-        moonOrbX, moonOrbY = self.getOrbAltitudeXY(moon, obs, (image_height, image_width), utcnow)
+        sunOrbX, sunOrbY = self.getOrbAltitudeXY(position['sun_alt'], position['sun_ha'], (image_height, image_width))
+        moonOrbX, moonOrbY = self.getOrbAltitudeXY(position['moon_alt'], position['moon_ha'], (image_height, image_width))
 
 
         # Sun
@@ -703,15 +302,11 @@ class IndiAllskyOrbGenerator(object):
         self.drawEdgeLine(data_bytes, (sunDayNightX, int(sunDayNightY)), color_bgr)
 
 
-    def getOrbAltitudeXY(self, skyObj, obs, image_size, utcnow):
+    def getOrbAltitudeXY(self, alt_deg, ha_deg, image_size):
         image_height, image_width = image_size
 
-        alt_deg = math.degrees(skyObj.alt)
-
-        skyObj_transit_date = obs.next_transit(skyObj).datetime()
-        skyObj_transit_delta = skyObj_transit_date - utcnow
-        if skyObj_transit_delta.seconds < 43200:  # 12 hours
-            # rising, put on right
+        if ha_deg < 0:
+            # before transit, rising, put on right
             x = image_width
         else:
             # setting, put on left
@@ -724,21 +319,12 @@ class IndiAllskyOrbGenerator(object):
 
 
     def drawEdgeCircle(self, data_bytes, pt, color_bgr):
-        if self.config['TEXT_PROPERTIES']['FONT_OUTLINE']:
-            cv2.circle(
-                img=data_bytes,
-                center=pt,
-                radius=self.config['ORB_PROPERTIES']['RADIUS'],
-                color=(0, 0, 0),
-                thickness=cv2.FILLED,
-            )
-
-        cv2.circle(
-            img=data_bytes,
-            center=pt,
-            radius=self.config['ORB_PROPERTIES']['RADIUS'] - 1,
-            color=tuple(color_bgr),
-            thickness=cv2.FILLED,
+        self._overlay.circle(
+            data_bytes,
+            pt,
+            self.config['ORB_PROPERTIES']['RADIUS'],
+            color_bgr,
+            self.config['TEXT_PROPERTIES']['FONT_OUTLINE'],
         )
 
 
@@ -764,22 +350,15 @@ class IndiAllskyOrbGenerator(object):
             y2 = y + line_length
 
 
-        if self.config['TEXT_PROPERTIES']['FONT_OUTLINE']:
-            cv2.line(
-                img=data_bytes,
-                pt1=(x1, y1),
-                pt2=(x2, y2),
-                color=(0, 0, 0),
-                thickness=self.line_thickness + 1,
-                lineType=lineType,
-            )  # black outline
-        cv2.line(
-            img=data_bytes,
-            pt1=(x1, y1),
-            pt2=(x2, y2),
-            color=tuple(color_bgr),
-            thickness=self.line_thickness,
-            lineType=lineType,
+        # black outline included in the tile
+        self._overlay.line(
+            data_bytes,
+            (x1, y1),
+            (x2, y2),
+            color_bgr,
+            self.line_thickness,
+            lineType,
+            self.config['TEXT_PROPERTIES']['FONT_OUTLINE'],
         )
 
 
@@ -0,0 +1,245 @@
+from collections import OrderedDict
+import cv2
+import numpy
+import logging
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyOverlayCache(object):
+    """Cached tiles for labels and orbs.
+
+    Text lines, circles and lines are rendered once into small premultiplied
+    tiles keyed by their content and style, then blended into the frame with
+    integer alpha.  Static lines are only rendered once, lines that change
+    (timestamp, exposure, etc) only cost a small tile instead of drawing on
+    the full frame.
+    """
+
+    max_tiles = 256
+
+
+    def __init__(self, config):
+        self.config = config
+
+        self._tiles = OrderedDict()
+
+
+    def text(self, image, text, pt, color_bgr):
+        text_props = self.config['TEXT_PROPERTIES']
+
+        key = (
+            'text',
+            text,
+            tuple(color_bgr),
+            len(image.shape),
+            text_props['FONT_FACE'],
+            text_props['FONT_AA'],
+            text_props['FONT_SCALE'],
+            text_props['FONT_THICKNESS'],
+            bool(text_props['FONT_OUTLINE']),
+        )
+
+        tile = self._getTile(key, self._renderText, text, color_bgr, len(image.shape))
+
+        self._blit(image, tile, pt)
+
+
+    def circle(self, image, center, radius, color_bgr, outline):
+        key = ('circle', radius, tuple(color_bgr), bool(outline), len(image.shape))
+
+        tile = self._getTile(key, self._renderCircle, radius, color_bgr, outline, len(image.shape))
+
+        self._blit(image, tile, center)
+
+
+    def line(self, image, pt1, pt2, color_bgr, thickness, lineType, outline):
+        # lines are cached by their shape and drawn relative to the first point
+        dx = pt2[0] - pt1[0]
+        dy = pt2[1] - pt1[1]
+
+        key = ('line', dx, dy, tuple(color_bgr), thickness, lineType, bool(outline), len(image.shape))
+
+        tile = self._getTile(key, self._renderLine, dx, dy, color_bgr, thickness, lineType, outline, len(image.shape))
+
+        self._blit(image, tile, pt1)
+
+
+    def _getTile(self, key, render_func, *args):
+        try:
+            tile = self._tiles[key]
+            self._tiles.move_to_end(key)
+            return tile
+        except KeyError:
+            pass
+
+
+        tile = render_func(*args)
+
+        self._tiles[key] = tile
+        if len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)  # least recently used
+
+        return tile
+
+
+    def _newCanvas(self, width, height, ndim):
+        if ndim == 2:
+            canvas = numpy.zeros((height, width), dtype=numpy.uint8)
+        else:
+            canvas = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+
+        mask = numpy.zeros((height, width), dtype=numpy.uint8)
+
+        return canvas, mask
+
+
+    def _canvasColor(self, color_bgr, ndim):
+        if ndim == 2:
+            # drawing on a single channel only uses the first value
+            return (int(color_bgr[0]),)
+
+        return tuple(int(c) for c in color_bgr)
+
+
+    def _renderText(self, text, color_bgr, ndim):
+        text_props = self.config['TEXT_PROPERTIES']
+
+        fontFace = getattr(cv2, text_props['FONT_FACE'])
+        lineType = getattr(cv2, text_props['FONT_AA'])
+        fontScale = text_props['FONT_SCALE']
+        thickness = text_props['FONT_THICKNESS']
+        outline = text_props['FONT_OUTLINE']
+
+        (text_width, text_height), baseline = cv2.getTextSize(text, fontFace, fontScale, thickness + 1)
+
+        # room for the outline and anti-aliasing
+        pad = (thickness * 2) + 4
+
+        canvas, mask = self._newCanvas(text_width + (pad * 2), text_height + baseline + (pad * 2), ndim)
+        org = (pad, pad + text_height)
+
+        if outline:
+            # the black outline only removes background, it is only drawn on the mask
+            cv2.putText(
+                img=mask,
+                text=text,
+                org=org,
+                fontFace=fontFace,
+                color=(255,),
+                lineType=lineType,
+                fontScale=fontScale,
+                thickness=thickness + 1,
+            )
+
+        cv2.putText(
+            img=canvas,
+            text=text,
+            org=org,
+            fontFace=fontFace,
+            color=self._canvasColor(color_bgr, ndim),
+            lineType=lineType,
+            fontScale=fontScale,
+            thickness=thickness,
+        )
+        cv2.putText(
+            img=mask,
+            text=text,
+            org=org,
+            fontFace=fontFace,
+            color=(255,),
+            lineType=lineType,
+            fontScale=fontScale,
+            thickness=thickness,
+        )
+
+        return self._premultiply(canvas, mask, org)
+
+
+    def _renderCircle(self, radius, color_bgr, outline, ndim):
+        pad = 2
+        size = (radius * 2) + 1 + (pad * 2)
+
+        canvas, mask = self._newCanvas(size, size, ndim)
+        center = (radius + pad, radius + pad)
+
+        if outline:
+            cv2.circle(img=mask, center=center, radius=radius, color=(255,), thickness=cv2.FILLED)
+
+        cv2.circle(img=canvas, center=center, radius=radius - 1, color=self._canvasColor(color_bgr, ndim), thickness=cv2.FILLED)
+        cv2.circle(img=mask, center=center, radius=radius - 1, color=(255,), thickness=cv2.FILLED)
+
+        return self._premultiply(canvas, mask, center)
+
+
+    def _renderLine(self, dx, dy, color_bgr, thickness, lineType, outline, ndim):
+        pad = thickness + 4
+
+        canvas, mask = self._newCanvas(abs(dx) + (pad * 2) + 1, abs(dy) + (pad * 2) + 1, ndim)
+
+        pt1 = (pad + max(-dx, 0), pad + max(-dy, 0))
+        pt2 = (pt1[0] + dx, pt1[1] + dy)
+
+        if outline:
+            cv2.line(img=mask, pt1=pt1, pt2=pt2, color=(255,), thickness=thickness + 1, lineType=lineType)
+
+        cv2.line(img=canvas, pt1=pt1, pt2=pt2, color=self._canvasColor(color_bgr, ndim), thickness=thickness, lineType=lineType)
+        cv2.line(img=mask, pt1=pt1, pt2=pt2, color=(255,), thickness=thickness, lineType=lineType)
+
+        return self._premultiply(canvas, mask, pt1)
+
+
+    def _premultiply(self, canvas, mask, anchor):
+        # crop to the drawn area
+        x, y, w, h = cv2.boundingRect(mask)
+
+        canvas = canvas[y:y + h, x:x + w]
+        mask = mask[y:y + h, x:x + w]
+
+        if len(canvas.shape) == 3:
+            mask = numpy.dstack((mask, mask, mask))
+
+        # the canvas is drawn on black, it is already multiplied by alpha
+        tile_premult = numpy.multiply(canvas, 255, dtype=numpy.uint16)
+        inverse_alpha = (255 - mask).astype(numpy.uint16)
+
+        # position of the tile relative to the drawing point
+        offset = (x - anchor[0], y - anchor[1])
+
+        return tile_premult, inverse_alpha, offset
+
+
+    def _blit(self, image, tile, pt):
+        tile_premult, inverse_alpha, offset = tile
+
+        image_height, image_width = image.shape[:2]
+        tile_height, tile_width = tile_premult.shape[:2]
+
+        x1 = pt[0] + offset[0]
+        y1 = pt[1] + offset[1]
+
+        # clip to the image
+        ix1 = max(x1, 0)
+        iy1 = max(y1, 0)
+        ix2 = min(x1 + tile_width, image_width)
+        iy2 = min(y1 + tile_height, image_height)
+
+        if ix1 >= ix2 or iy1 >= iy2:
+            return
+
+        tx1 = ix1 - x1
+        ty1 = iy1 - y1
+        tx2 = tx1 + (ix2 - ix1)
+        ty2 = ty1 + (iy2 - iy1)
+
+        image_roi = image[iy1:iy2, ix1:ix2]
+
+        # fixed point: (image * (255 - alpha) + tile * alpha) / 255, fits in uint16
+        blend = numpy.multiply(image_roi, inverse_alpha[ty1:ty2, tx1:tx2], dtype=numpy.uint16)
+        blend += tile_premult[ty1:ty2, tx1:tx2]
+        blend += 128
+        blend += blend >> 8
+        blend >>= 8
+
+        image_roi[:] = blend  # in place
@@ -0,0 +1,183 @@
+import time
+import math
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Value
+import cv2
+import logging
+
+from .keogram import KeogramGenerator
+from .starTrails import StarTrailGenerator
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyProductPool(object):
+    """Keogram and star trails from a pool of processes.
+
+    The ordered file list is split into contiguous chunks, each process
+    builds the keogram columns and star trails of one chunk.  The chunks
+    are merged in order, the columns are concatenated and the trails are
+    combined with max, the result is the same as processing the files in
+    a single pass.  Every chunk uses the keogram height of the first
+    image, columns of other frame sizes are resized once.
+
+    Products that need every frame in order (timelapse videos) are built in
+    the calling process, imread() decodes the images in the pool and returns
+    them in file order.  Decoding runs ahead of the caller by decode_ahead
+    images per process.
+    """
+
+    decode_ahead = 2
+
+
+    def __init__(self, config, bin_v, mask=None, workers=2):
+        self.config = config
+        self.bin_v = bin_v
+        self._mask = mask
+        self._workers = int(workers)
+
+
+    def generate(self, file_list, kg=None, stg=None):
+        # results are merged into the keogram and star trail generators
+        pool_start = time.time()
+
+        chunk_size = math.ceil(len(file_list) / self._workers)
+        chunk_list = [file_list[i:i + chunk_size] for i in range(0, len(file_list), chunk_size)]
+
+        logger.info('Processing %d images in %d chunks', len(file_list), len(chunk_list))
+
+
+        keogram_height = None
+        if kg:
+            keogram_height = self._keogramHeight(file_list, kg)
+            kg.keogram_height = keogram_height
+
+
+        with ProcessPoolExecutor(max_workers=self._workers) as executor:
+            future_list = list()
+            for chunk in chunk_list:
+                future = executor.submit(
+                    processChunk,
+                    self.config,
+                    self.bin_v.value,
+                    self._mask,
+                    chunk,
+                    bool(kg),
+                    bool(stg),
+                    keogram_height,
+                )
+                future_list.append(future)
+
+
+            # merged in order
+            for future in future_list:
+                kg_state, stg_state = future.result()
+
+                if kg:
+                    kg.mergeState(kg_state)
+
+                if stg:
+                    stg.mergeState(stg_state)
+
+
+        pool_elapsed_s = time.time() - pool_start
+        logger.warning('Keogram and star trails processed by %d workers in %0.1f s', self._workers, pool_elapsed_s)
+
+
+    def _keogramHeight(self, file_list, kg):
+        # the height is set by the first image, as in a single pass
+        for filename in file_list:
+            image = readImage(filename)
+
+            if isinstance(image, type(None)):
+                continue
+
+            return kg.columnHeight(image)
+
+        return None
+
+
+    def imread(self, file_list):
+        # yields (path, image) in file order, image is None if the file cannot be used
+        window = self._workers * self.decode_ahead
+
+        with ProcessPoolExecutor(max_workers=self._workers) as executor:
+            future_q = deque()
+
+            for filename in file_list:
+                future_q.append((filename, executor.submit(readImage, filename)))
+
+                if len(future_q) < window:
+                    continue
+
+                filename, future = future_q.popleft()
+                yield Path(filename), future.result()
+
+
+            while future_q:
+                filename, future = future_q.popleft()
+                yield Path(filename), future.result()
+
+
+def readImage(filename):
+    # returns None if the image cannot be used
+    p_entry = Path(filename)
+
+    if not p_entry.exists():
+        logger.error('File not found: %s', p_entry)
+        return None
+
+    if p_entry.stat().st_size == 0:
+        return None
+
+    image = cv2.imread(str(p_entry), cv2.IMREAD_COLOR)  # convert grayscale to color
+
+    if isinstance(image, type(None)):
+        logger.error('Unable to read %s', p_entry)
+
+    return image
+
+
+def processChunk(config, bin_value, mask, file_list, keogram, startrails, keogram_height=None):
+    # runs in a pool process
+    bin_v = Value('i', bin_value)
+
+    kg = KeogramGenerator(config)
+    kg.angle = config['KEOGRAM_ANGLE']
+    kg.keogram_height = keogram_height
+    kg.reserve(len(file_list))
+
+    stg = StarTrailGenerator(config, bin_v, mask=mask)
+    stg.max_brightness = config['STARTRAILS_MAX_ADU']
+    stg.mask_threshold = config['STARTRAILS_MASK_THOLD']
+    stg.pixel_cutoff_threshold = config['STARTRAILS_PIXEL_THOLD']
+    stg.write_timelapse_frames = False
+
+
+    for filename in file_list:
+        p_entry = Path(filename)
+
+        image = readImage(p_entry)
+
+        if isinstance(image, type(None)):
+            continue
+
+        if keogram:
+            kg.processImage(p_entry, image)
+
+        if startrails:
+            stg.processImage(p_entry, image)
+
+
+    kg_state = None
+    if keogram:
+        kg_state = kg.getState()
+
+    stg_state = None
+    if startrails:
+        stg_state = stg.getState()
+
+    return kg_state, stg_state
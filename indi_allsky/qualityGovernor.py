@@ -0,0 +1,176 @@
+import logging
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyQualityGovernor(object):
+    """Keeps image processing within the exposure period.
+
+    The cost of each frame and of the optional stages is tracked as a
+    moving average.  While frames cost more than the budget, or frames are
+    waiting in the queue, optional stages are reduced one at a time in
+    stage_order.  Stages are restored in reverse order when there is
+    headroom again.  Each change is reported as (action, stage, message),
+    the action is reduce or restore.
+
+    The reduced stages of a frame are stored as a bitmask, bit n is set
+    when stage_order[n] is reduced.  New stages must be appended.
+    """
+
+    # optional stages, reduced in this order, positions are stored in the image table
+    stage_order = (
+        'align',        # stack registration
+        'lines',        # meteor detection
+        'stars_scale',  # star detection at half resolution
+        'clahe',        # contrast enhancement
+        'stars',        # star detection
+        'fits',         # FITS export
+    )
+
+    # stage costs used to decide if reducing a stage helps
+    stage_cost_keys = {
+        'align'       : 'align',
+        'lines'       : 'lines',
+        'stars_scale' : 'stars',
+        'clahe'       : 'clahe',
+        'stars'       : 'stars',
+        'fits'        : 'fits',
+    }
+
+    over_ratio = 0.9  # of the budget
+    under_ratio = 0.6
+    over_frames = 2  # consecutive frames before reducing
+    under_frames = 10  # consecutive frames before restoring
+    cost_decay = 0.3  # weight of the newest frame
+    min_stage_cost = 0.005  # seconds, cheaper stages are not worth reducing
+
+
+    def __init__(self, config):
+        self.config = config
+
+        self._reduced = list()
+
+        self._frame_cost = None
+        self._stage_cost = dict()
+
+        self._over_count = 0
+        self._under_count = 0
+
+
+    @property
+    def reduced(self):
+        return tuple(self._reduced)
+
+    @reduced.setter
+    def reduced(self, *args):
+        pass  # read only
+
+
+    @classmethod
+    def stageMask(cls, stages):
+        mask = 0
+        for stage in stages:
+            mask |= 1 << cls.stage_order.index(stage)
+
+        return mask
+
+
+    @classmethod
+    def maskStages(cls, mask):
+        return tuple(stage for i, stage in enumerate(cls.stage_order) if mask & (1 << i))
+
+
+    def update(self, frame_cost, budget, queue_depth, stage_elapsed):
+        # returns (action, stage, description) of the change, None if nothing changed
+        self._frame_cost = self._average(self._frame_cost, frame_cost)
+
+        for stage, elapsed in stage_elapsed.items():
+            self._stage_cost[stage] = self._average(self._stage_cost.get(stage), elapsed)
+
+
+        if not self.config.get('QUALITY_GOVERNOR'):
+            if self._reduced:
+                self._reduced = list()
+                return 'restore', 'all', 'Quality governor disabled, all stages restored'
+
+            return None
+
+
+        logger.info('Frame cost %0.2fs of %0.2fs budget, %d queued', self._frame_cost, budget, queue_depth)
+
+
+        if self._frame_cost > budget * self.over_ratio or queue_depth > 1:
+            self._under_count = 0
+            self._over_count += 1
+
+            if self._over_count < self.over_frames:
+                return None
+
+            self._over_count = 0
+            return self._reduce(budget, queue_depth)
+
+
+        self._over_count = 0
+
+        if self._frame_cost < budget * self.under_ratio and queue_depth == 0:
+            self._under_count += 1
+
+            if self._under_count < self.under_frames:
+                return None
+
+            self._under_count = 0
+            return self._restore(budget)
+
+
+        self._under_count = 0
+
+        return None
+
+
+    def _reduce(self, budget, queue_depth):
+        for stage in self.stage_order:
+            if stage in self._reduced:
+                continue
+
+            cost = self._stage_cost.get(self.stage_cost_keys[stage])
+            if isinstance(cost, type(None)) or cost < self.min_stage_cost:
+                # not running, reducing it gains nothing
+                continue
+
+            self._reduced.append(stage)
+
+            return 'reduce', stage, 'Processing over budget ({0:0.1f}s of {1:0.1f}s, {2:d} queued), reduced {3:s}'.format(
+                self._frame_cost,
+                budget,
+                queue_depth,
+                stage,
+            )
+
+
+        logger.warning('Processing over budget, no stages left to reduce')
+
+        return None
+
+
+    def _restore(self, budget):
+        if not self._reduced:
+            return None
+
+        stage = self._reduced.pop()
+
+        # the reduced cost is unknown until the stage runs again
+        self._stage_cost.pop(self.stage_cost_keys[stage], None)
+
+        return 'restore', stage, 'Processing within budget ({0:0.1f}s of {1:0.1f}s), restored {2:s}'.format(
+            self._frame_cost,
+            budget,
+            stage,
+        )
+
+
+    def _average(self, current, value):
+        if isinstance(current, type(None)):
+            return value
+
+        return (current * (1 - self.cost_decay)) + (value * self.cost_decay)
@@ -5,7 +5,6 @@
 
 import time
 #from pathlib import Path
-import cv2
 import numpy
 import logging
 
@@ -14,80 +13,77 @@ logger = logging.getLogger('indi_allsky')
 
 
 class IndiAllskyScnr(object):
+    """Green reduction operating on individual channel planes.
+
+    Each method returns a new green plane, the input planes are not modified.
+    The planes are 8 bit, additive_mask uses 8 bit fixed point math.
+    """
 
     def __init__(self, config):
         self.config = config
 
-        self.amount = self.config.get('SCNR_AMOUNT', 0.50)  # not currently used
-
+        self.amount = self.config.get('SCNR_AMOUNT', 0.50)
 
-    def additive_mask(self, scidata):
-        ### The function below returns an out of memory error, needs to be fixed
+        self._amount_fixed = int(round(min(max(self.amount, 0.0), 1.0) * 256))
 
-        if len(scidata.shape) == 2:
-            # grayscale
-            return scidata
 
+    def additive_mask(self, b, g, r):
         #logger.warning('Applying SCNR additive mask')
 
+        start = time.time()
 
-        image_height, image_width = scidata.shape[:2]
-        b, g, r = cv2.split(scidata)
+        # g * ((1 - amount) * (1 - m) + m) == g - g * amount * (1 - m)
+        # 8 bit fixed point, every step fits in uint16
 
-        start = time.time()
+        # mask is the saturated sum of red and blue, inverted
+        m_inv = numpy.add(r, b, dtype=numpy.uint16)
+        numpy.minimum(m_inv, 255, out=m_inv)
+        numpy.subtract(255, m_inv, out=m_inv)
 
-        ones = numpy.ones([image_height, image_width])
+        # round(g * (1 - m) / 255)
+        numpy.multiply(m_inv, g, out=m_inv)
+        m_inv += 128
+        m_inv += m_inv >> 8
+        m_inv >>= 8
 
-        m = numpy.minimum(ones, numpy.sum(r + b))
+        # amount in 1/256 steps
+        m_inv *= self._amount_fixed
+        m_inv += 128
+        m_inv >>= 8
 
-        #g * (1 - self.amount) * (1 - m) + m * g
-        g = numpy.multiply(g * (1 - self.amount), numpy.sum(numpy.subtract(ones, m), numpy.multiply(m, g)))  # oom
+        # the reduction never exceeds g
+        g_new = numpy.subtract(g, m_inv, dtype=numpy.uint16).astype(g.dtype)
 
         elapsed_s = time.time() - start
         logger.info('SCNR additive mask in %0.4f s', elapsed_s)
 
-        return cv2.merge((b, g, r))
-
+        return g_new
 
-    def average_neutral(self, scidata):
-        if len(scidata.shape) == 2:
-            # grayscale
-            return scidata
 
+    def average_neutral(self, b, g, r):
         #logger.warning('Applying SCNR average neutral')
 
-
-        b, g, r = cv2.split(scidata)
-
         start = time.time()
 
-        m = numpy.add(r, b) * 0.5
-        g = numpy.minimum(g, m.astype(numpy.uint8))
+        # widen before adding so the sum cannot overflow
+        m = (r.astype(numpy.uint32) + b) >> 1
+        g_new = numpy.minimum(g, m).astype(g.dtype)
 
         elapsed_s = time.time() - start
         logger.info('SCNR average neutral in %0.4f s', elapsed_s)
 
-        return cv2.merge((b, g, r))
-
+        return g_new
 
-    def maximum_neutral(self, scidata):
-        if len(scidata.shape) == 2:
-            # grayscale
-            return scidata
 
+    def maximum_neutral(self, b, g, r):
         #logger.warning('Applying SCNR maximum neutral')
 
-
-        b, g, r = cv2.split(scidata)
-
         start = time.time()
 
         m = numpy.maximum(r, b)
-        g = numpy.minimum(g, m)
+        g_new = numpy.minimum(g, m)
 
         elapsed_s = time.time() - start
         logger.info('SCNR maximum neutral in %0.4f s', elapsed_s)
 
-        return cv2.merge((b, g, r))
-
-
+        return g_new
@@ -17,7 +17,7 @@ class IndiAllskySqm(object):
         self._sqm_mask = None
 
 
-    def calculate(self, img, exposure, gain):
+    def calculate(self, img, exposure, gain, frame_stats=None):
         logger.info('Exposure: %0.6f, gain: %d', exposure, gain)
 
         if isinstance(self._sqm_mask, type(None)):
@@ -25,15 +25,18 @@ class IndiAllskySqm(object):
             self._generateSqmMask(img)
 
 
-        if len(img.shape) == 2:
-            # mono
-            img_gray = img
+        if not isinstance(frame_stats, type(None)):
+            sqm_avg = frame_stats.roiMean('sqm', self._sqm_mask)
         else:
-            # color
-            img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            if len(img.shape) == 2:
+                # mono
+                img_gray = img
+            else:
+                # color
+                img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
+            sqm_avg = cv2.mean(src=img_gray, mask=self._sqm_mask)[0]
 
-        sqm_avg = cv2.mean(src=img_gray, mask=self._sqm_mask)[0]
         logger.info('Raw SQM average: %0.2f', sqm_avg)
 
         # offset the sqm based on the exposure and gain
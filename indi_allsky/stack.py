@@ -19,10 +19,21 @@ class IndiAllskyStacker(object):
         self._max_control_points = 50
         self._min_area = 10
 
+        # use cached star centroids instead of astroalign source extraction
+        self._star_registration = False
+
         self.hist_rotation = list()
         self._rotation_dev = 3  # rotation may not exceed this deviation
         self._history_min_vals = 15
 
+        # frames are registered once against a fixed anchor
+        self._anchor_i_ref = None
+        self._anchor_masked = None
+        self._anchor_centroids = None
+        self._anchor_generation = 0
+        self._last_rotation = 0.0
+        self._reference_matrix = None
+
 
     @property
     def detection_sigma(self):
@@ -30,7 +41,7 @@ class IndiAllskyStacker(object):
 
     @detection_sigma.setter
     def detection_sigma(self, new_detection_sigma):
-        self._detection_simga = int(new_detection_sigma)
+        self._detection_sigma = int(new_detection_sigma)
 
 
     @property
@@ -42,6 +53,15 @@ class IndiAllskyStacker(object):
         self._max_control_points = int(new_max_control_points)
 
 
+    @property
+    def star_registration(self):
+        return self._star_registration
+
+    @star_registration.setter
+    def star_registration(self, new_star_registration):
+        self._star_registration = bool(new_star_registration)
+
+
     @property
     def min_area(self):
         return self._min_area
@@ -88,8 +108,13 @@ class IndiAllskyStacker(object):
 
 
     def average(self, stack_data_list, numpy_type):
-        mean_image = numpy.mean(stack_data_list, axis=0)
-        return numpy.floor(mean_image).astype(numpy_type)  # no floats
+        # integer sum avoids building a float64 cube of every frame
+        sum_image = numpy.zeros(stack_data_list[0].shape, dtype=numpy.uint32)
+
+        for i in stack_data_list:
+            sum_image += i
+
+        return (sum_image // len(stack_data_list)).astype(numpy_type)  # no floats
 
 
     def maximum(self, stack_data_list, numpy_type):
@@ -112,7 +137,7 @@ class IndiAllskyStacker(object):
 
 
     def register(self, stack_i_ref_list):
-        # first image is the reference
+        # first image is the reference, returned data is aligned to the anchor frame
         reference_i_ref = stack_i_ref_list[0]
 
 
@@ -121,100 +146,237 @@ class IndiAllskyStacker(object):
             self._generateSqmMask(reference_i_ref['hdulist'][0].data)
 
 
-        reg_data_list = [reference_i_ref['hdulist'][0].data]  # add target to final list
+        reg_start = time.time()
+
 
-        #reference_masked = self._crop(reference_i_ref['hdulist'][0].data)
-        reference_masked = cv2.bitwise_and(reference_i_ref['hdulist'][0].data, reference_i_ref['hdulist'][0].data, mask=self._sqm_mask)
+        if isinstance(self._anchor_i_ref, type(None)):
+            # oldest image is the initial anchor
+            self._setAnchor(stack_i_ref_list[-1])
+
+
+        # only frames that have not been seen before need a transform, oldest first
+        for i_ref in reversed(stack_i_ref_list):
+            registration = i_ref.get('registration')
+            if registration and registration['anchor'] == self._anchor_generation:
+                continue
+
+            self._registerFrame(i_ref)
+
+
+        reference_registration = reference_i_ref.get('registration')
+
+        if not reference_registration or isinstance(reference_registration['matrix'], type(None)):
+            # the reference could not be registered, nothing to stack against
+            self._reference_matrix = None
+            return [reference_i_ref['hdulist'][0].data]
+
+
+        if not any(x is self._anchor_i_ref for x in stack_i_ref_list):
+            # anchor is no longer part of the stack
+            self._reanchor(reference_i_ref, stack_i_ref_list)
+
+
+        reg_data_list = list()
+        for i_ref in stack_i_ref_list:
+            registration = i_ref.get('registration')
+            if not registration or registration['anchor'] != self._anchor_generation:
+                continue
+
+            if isinstance(registration['data'], type(None)):
+                # registration failed
+                continue
+
+            reg_data_list.append(registration['data'])
+
+
+        # maps the anchor frame back onto the reference
+        self._reference_matrix = numpy.linalg.inv(reference_i_ref['registration']['matrix'])
 
-        reg_start = time.time()
 
+        reg_elapsed_s = time.time() - reg_start
+        logger.info('Registered %d images in %0.4f s', len(reg_data_list), reg_elapsed_s)
+
+        return reg_data_list
+
+
+    def alignToReference(self, data):
+        # transform stacked data from the anchor frame to the last reference
+        if isinstance(self._reference_matrix, type(None)):
+            return data
+
+        if numpy.allclose(self._reference_matrix, numpy.identity(3)):
+            # reference is the anchor
+            return data
+
+        return self._warp(data, self._reference_matrix)
+
+
+    def reset(self):
+        # the next registered stack will select a new anchor
+        self._anchor_i_ref = None
+        self._anchor_masked = None
+        self._anchor_centroids = None
+        self._last_rotation = 0.0
+        self._reference_matrix = None
+
+
+    def _setAnchor(self, anchor_i_ref):
+        logger.info('Setting new registration anchor')
+
+        self._anchor_i_ref = anchor_i_ref
+        self._anchor_generation += 1
+
+        if self._star_registration:
+            self._anchor_centroids = anchor_i_ref.get('star_centroids')
+        else:
+            self._anchor_masked = cv2.bitwise_and(anchor_i_ref['hdulist'][0].data, anchor_i_ref['hdulist'][0].data, mask=self._sqm_mask)
+
+        anchor_i_ref['registration'] = {
+            'anchor'   : self._anchor_generation,
+            'matrix'   : numpy.identity(3),
+            'rotation' : 0.0,
+            'data'     : anchor_i_ref['hdulist'][0].data,
+        }
 
-        last_rotation = 0
+        self._last_rotation = 0.0
 
-        for i_ref in stack_i_ref_list[1:]:
-            #i_masked = self._crop(i_ref['hdulist'][0].data)
-            i_masked = cv2.bitwise_and(i_ref['hdulist'][0].data, i_ref['hdulist'][0].data, mask=self._sqm_mask)
 
-            # detection_sigma default = 5
-            # max_control_points default = 50
-            # min_area default = 5
+    def _registerFrame(self, i_ref):
+        if self._star_registration:
+            # control points were already found by star detection
+            source = i_ref.get('star_centroids')
+            target = self._anchor_centroids
 
-            try:
-                ### Find transform using a crop of the image
-                transform, (source_list, target_list) = astroalign.find_transform(
-                    i_masked,
-                    reference_masked,
-                    detection_sigma=self.detection_sigma,
-                    max_control_points=self.max_control_points,
-                    min_area=self.min_area,
-                )
+            if isinstance(source, type(None)) or isinstance(target, type(None)):
+                logger.error('Image registration failure: star centroids not available')
+                self._registrationFailed(i_ref)
+                return
+        else:
+            source = cv2.bitwise_and(i_ref['hdulist'][0].data, i_ref['hdulist'][0].data, mask=self._sqm_mask)
+            target = self._anchor_masked
 
-                logger.info(
-                    'Registration Matches: %d, Rotation: %0.6f, Translation: (%0.6f, %0.6f), Scale: %0.6f',
-                    len(target_list),
-                    transform.rotation,
-                    transform.translation[0], transform.translation[1],
-                    transform.scale,
-                )
+        # detection_sigma default = 5
+        # max_control_points default = 50
+        # min_area default = 5
 
+        try:
+            ### Find transform from the frame to the anchor
+            transform, (source_list, target_list) = astroalign.find_transform(
+                source,
+                target,
+                detection_sigma=self.detection_sigma,
+                max_control_points=self.max_control_points,
+                min_area=self.min_area,
+            )
+        except astroalign.MaxIterError as e:
+            logger.error('Image registration failure: %s', str(e))
+            self._registrationFailed(i_ref)
+            return
+        except ValueError as e:
+            logger.error('Image registration failure: %s', str(e))
+            self._registrationFailed(i_ref)
+            return
+
+
+        logger.info(
+            'Registration Matches: %d, Rotation: %0.6f, Translation: (%0.6f, %0.6f), Scale: %0.6f',
+            len(target_list),
+            transform.rotation,
+            transform.translation[0], transform.translation[1],
+            transform.scale,
+        )
+
+
+        # add new rotation value
+        rotation = transform.rotation - self._last_rotation
+        #logger.info('Last rotation: %0.8f', rotation)
+
+
+        if len(self.hist_rotation) >= self._history_min_vals:
+            # need at least this many values to establish an average
+            rotation_mean = numpy.mean(self.hist_rotation)
+            rotation_std = numpy.std(self.hist_rotation)
+
+            #logger.info('Rotation standard deviation: %0.8f', rotation_std)
 
-                # add new rotation value
-                rotation = transform.rotation - last_rotation
-                #logger.info('Last rotation: %0.8f', rotation)
+            rotation_stddev_limit = rotation_std * self._rotation_dev
 
 
-                if len(self.hist_rotation) >= self._history_min_vals:
-                    # need at least this many values to establish an average
-                    rotation_mean = numpy.mean(self.hist_rotation)
-                    rotation_std = numpy.std(self.hist_rotation)
+            # if the new rotation exceeds the deviation limit, do not apply the transform
+            if rotation > (rotation_mean + rotation_stddev_limit)\
+                    or rotation < (rotation_mean - rotation_stddev_limit):
 
-                    #logger.info('Rotation standard deviation: %0.8f', rotation_std)
+                logger.error('Rotation exceeded limit of +/- %0.8f', rotation_stddev_limit)
+                self._last_rotation += rotation_mean  # skipping a frame, need to account for rotation difference
+                self._registrationFailed(i_ref)
+                return
 
-                    rotation_stddev_limit = rotation_std * self._rotation_dev
 
+        self.hist_rotation.append(rotation)  # only add known good rotation values
+        self._last_rotation = transform.rotation
 
-                    # if the new rotation exceeds the deviation limit, do not apply the transform
-                    if rotation > (rotation_mean + rotation_stddev_limit)\
-                            or rotation < (rotation_mean - rotation_stddev_limit):
 
-                        logger.error('Rotation exceeded limit of +/- %0.8f', rotation_stddev_limit)
-                        last_rotation += rotation_mean  # skipping a frame, need to account for rotation difference
-                        continue
+        i_ref['registration'] = {
+            'anchor'   : self._anchor_generation,
+            'matrix'   : transform.params,
+            'rotation' : transform.rotation,
+            'data'     : self._warp(i_ref['hdulist'][0].data, transform.params),
+        }
 
 
-                self.hist_rotation.append(rotation)  # only add known good rotation values
-                last_rotation = transform.rotation
+    def _registrationFailed(self, i_ref):
+        # failed frames are excluded from the stack and not retried
+        i_ref['registration'] = {
+            'anchor'   : self._anchor_generation,
+            'matrix'   : None,
+            'rotation' : None,
+            'data'     : None,
+        }
 
 
+    def _reanchor(self, new_anchor_i_ref, stack_i_ref_list):
+        # existing transforms are chained to the new anchor, no new matching is needed
+        new_anchor_inv = numpy.linalg.inv(new_anchor_i_ref['registration']['matrix'])
+        new_anchor_rotation = new_anchor_i_ref['registration']['rotation']
 
-                reg_data, footprint = astroalign.apply_transform(
-                    transform,
-                    i_ref['hdulist'][0],
-                    reference_i_ref['hdulist'][0],
-                )
+        old_generation = self._anchor_generation
+        self._setAnchor(new_anchor_i_ref)
 
-                ### Register full image
-                #reg_data, footprint = astroalign.register(
-                #    i_ref['hdulist'][0],
-                #    reference_i_ref['hdulist'][0],
-                #    detection_sigma=self.detection_simga,
-                #    max_control_points=self.max_control_points,
-                #    min_area=self.min_area,
-                #)
-            except astroalign.MaxIterError as e:
-                logger.error('Image registration failure: %s', str(e))
+
+        for i_ref in stack_i_ref_list:
+            if i_ref is new_anchor_i_ref:
                 continue
-            except ValueError as e:
-                logger.error('Image registration failure: %s', str(e))
+
+            registration = i_ref.get('registration')
+            if not registration or registration['anchor'] != old_generation:
                 continue
 
-            reg_data_list.append(reg_data)
+            if isinstance(registration['matrix'], type(None)):
+                registration['anchor'] = self._anchor_generation  # still failed
+                continue
 
+            matrix = new_anchor_inv @ registration['matrix']
 
-        reg_elapsed_s = time.time() - reg_start
-        logger.info('Registered %d+1 images in %0.4f s', len(stack_i_ref_list) - 1, reg_elapsed_s)  # reference image is not aligned
+            i_ref['registration'] = {
+                'anchor'   : self._anchor_generation,
+                'matrix'   : matrix,
+                'rotation' : registration['rotation'] - new_anchor_rotation,
+                'data'     : self._warp(i_ref['hdulist'][0].data, matrix),
+            }
 
-        return reg_data_list
+
+    def _warp(self, data, matrix):
+        image_height, image_width = data.shape[:2]
+
+        # same interpolation and fill as astroalign.apply_transform()
+        return cv2.warpAffine(
+            data,
+            matrix[:2],
+            (image_width, image_height),
+            flags=cv2.INTER_CUBIC,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=float(numpy.median(data)),
+        )
 
 
     def _crop(self, image):
@@ -266,3 +428,154 @@ class IndiAllskyStacker(object):
         self._sqm_mask = mask
 
 
+
+
+class IndiAllskyStackAccumulator(object):
+    """Live stack backed by a preallocated ring buffer of frames.
+
+    The average method keeps an integer running sum, so adding a frame costs
+    one add and one subtract regardless of the stack depth.  Maximum and
+    minimum are updated incrementally, only pixels that were held by the
+    evicted frame are recomputed from the ring.
+
+    add() returns the ring entry of the frame, callers replace their own
+    array with it so only one copy of each frame is held.  The entry is
+    overwritten when the frame is evicted, depth frames later.
+    """
+
+    def __init__(self, config, method='average'):
+        self.config = config
+
+        self._method = method
+        self._depth = 1
+
+        self._ring = None
+        self._ring_index = 0
+        self._count = 0
+
+        self._sum = None
+        self._extreme = None  # running maximum or minimum
+
+
+    @property
+    def method(self):
+        return self._method
+
+    @method.setter
+    def method(self, *args):
+        pass  # read only
+
+
+    @property
+    def depth(self):
+        return self._depth
+
+    @depth.setter
+    def depth(self, new_depth):
+        new_depth = int(new_depth)
+
+        if new_depth != self._depth:
+            self._depth = new_depth
+            self.reset()
+
+
+    @property
+    def count(self):
+        return self._count
+
+    @count.setter
+    def count(self, *args):
+        pass  # read only
+
+
+    def reset(self):
+        # buffers are reallocated on the next frame
+        self._ring = None
+        self._ring_index = 0
+        self._count = 0
+
+        self._sum = None
+        self._extreme = None
+
+
+    def _allocate(self, data):
+        logger.info('Allocating stack ring buffer: %d x %s %s', self._depth, str(data.shape), str(data.dtype))
+
+        self._ring = numpy.zeros((self._depth,) + data.shape, dtype=data.dtype.newbyteorder('='))
+        self._ring_index = 0
+        self._count = 0
+
+        if self._method in ('average', 'mean'):
+            self._sum = numpy.zeros(data.shape, dtype=numpy.uint32)
+        else:
+            self._extreme = None
+
+
+    def add(self, data):
+        # returns the copy of the frame held in the ring
+        if self._method not in ('average', 'mean', 'maximum', 'minimum'):
+            raise AttributeError('Unknown stacking method: {0:s}'.format(self._method))
+
+
+        if isinstance(self._ring, type(None)) or self._ring.shape[1:] != data.shape or self._ring.dtype != data.dtype.newbyteorder('='):
+            self._allocate(data)
+
+
+        slot = self._ring_index
+        evicting = self._count == self._depth
+
+
+        if self._method in ('average', 'mean'):
+            if evicting:
+                self._sum -= self._ring[slot]
+
+            self._ring[slot] = data
+            self._sum += data
+        else:
+            if self._method == 'maximum':
+                extreme_func = numpy.maximum
+                ring_func = numpy.amax
+            else:
+                extreme_func = numpy.minimum
+                ring_func = numpy.amin
+
+
+            if evicting:
+                # pixels held by the evicted frame must be recomputed
+                stale = self._ring[slot] == self._extreme
+            else:
+                stale = None
+
+
+            self._ring[slot] = data
+
+
+            if isinstance(self._extreme, type(None)):
+                self._extreme = data.copy()
+            else:
+                extreme_func(self._extreme, data, out=self._extreme)
+
+
+            if not isinstance(stale, type(None)):
+                stale_idx = numpy.nonzero(stale)
+                if len(stale_idx[0]):
+                    self._extreme[stale_idx] = ring_func(self._ring[(slice(None),) + stale_idx], axis=0)
+
+
+        self._ring_index = (slot + 1) % self._depth
+
+        if not evicting:
+            self._count += 1
+
+        return self._ring[slot]
+
+
+    def result(self, numpy_type):
+        if self._count == 0:
+            return None
+
+        if self._method in ('average', 'mean'):
+            # integer division matches floor() of the mean
+            return (self._sum // self._count).astype(numpy_type)
+
+        return self._extreme.astype(numpy_type)  # copy
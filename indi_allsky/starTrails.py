@@ -13,6 +13,9 @@ logger = logging.getLogger('indi_allsky')
 
 class StarTrailGenerator(object):
 
+    write_timelapse_frames = True  # frames for the star trail timelapse
+
+
     def __init__(self, config, bin_v, mask=None):
         self.config = config
         self.bin_v = bin_v
@@ -38,6 +41,9 @@ class StarTrailGenerator(object):
         self._timelapse_frame_count = 0
         self._timelapse_frame_list = list()
 
+        # frames are passed to a streaming TimelapseGenerator instead of being written to disk
+        self._timelapse_stream = None
+
 
         if self.config['IMAGE_FOLDER']:
             self.image_dir = Path(self.config['IMAGE_FOLDER']).absolute()
@@ -45,8 +51,9 @@ class StarTrailGenerator(object):
             self.image_dir = Path(__file__).parent.parent.joinpath('html', 'images').absolute()
 
 
-        self.timelapse_tmpdir = tempfile.TemporaryDirectory(dir=self.image_dir, suffix='_startrail_timelapse')
-        self.timelapse_tmpdir_p = Path(self.timelapse_tmpdir.name)
+        # created with the first timelapse frame
+        self.timelapse_tmpdir = None
+        self.timelapse_tmpdir_p = None
 
 
     def __del__(self):
@@ -93,6 +100,14 @@ class StarTrailGenerator(object):
     def timelapse_frame_list(self, new_frame_list):
         return  # read only
 
+    @property
+    def timelapse_stream(self):
+        return self._timelapse_stream
+
+    @timelapse_stream.setter
+    def timelapse_stream(self, new_stream):
+        self._timelapse_stream = new_stream
+
 
     def generate(self, outfile, file_list):
         # Exclude empty files
@@ -127,15 +142,7 @@ class StarTrailGenerator(object):
 
 
         if isinstance(self.trail_image, type(None)):
-            image_height, image_width = image.shape[:2]
-
-            self.pixels_cutoff = (image_height * image_width) * (self._pixel_cutoff_threshold / 100)
-
-            # base image is just a black image
-            if len(image.shape) == 2:
-                self.trail_image = numpy.zeros((image_height, image_width), dtype=numpy.uint8)
-            else:
-                self.trail_image = numpy.zeros((image_height, image_width, 3), dtype=numpy.uint8)
+            self._initTrail(image)
 
 
         if isinstance(self._sqm_mask, type(None)):
@@ -154,8 +161,7 @@ class StarTrailGenerator(object):
 
         if m_avg < self.placeholder_adu:
             # placeholder should be the image with the lowest calculated ADU
-            self.placeholder_image = image
-            self.placeholder_adu = m_avg
+            self._setPlaceholder(image, m_avg)
 
 
         if m_avg > self._max_brightness:
@@ -175,11 +181,18 @@ class StarTrailGenerator(object):
 
 
         ### Here is the magic
-        self.trail_image = cv2.max(self.trail_image, image)
+        cv2.max(self.trail_image, image, dst=self.trail_image)
 
 
         # Star trail timelapse processing
-        if self.config.get('STARTRAILS_TIMELAPSE', True):
+        if self.config.get('STARTRAILS_TIMELAPSE', True) and self._timelapse_stream:
+            self._timelapse_stream.addFrame(self.trail_image)
+            self._timelapse_frame_count += 1
+        elif self.config.get('STARTRAILS_TIMELAPSE', True) and self.write_timelapse_frames:
+            if isinstance(self.timelapse_tmpdir, type(None)):
+                self.timelapse_tmpdir = tempfile.TemporaryDirectory(dir=self.image_dir, suffix='_startrail_timelapse')
+                self.timelapse_tmpdir_p = Path(self.timelapse_tmpdir.name)
+
             image_mtime = file_p.stat().st_mtime
 
             f_tmp_frame = tempfile.NamedTemporaryFile(dir=self.timelapse_tmpdir_p, suffix='.{0:s}'.format(self.config['IMAGE_FILE_TYPE']), delete=False)
@@ -206,6 +219,39 @@ class StarTrailGenerator(object):
         self.image_processing_elapsed_s += time.time() - image_processing_start
 
 
+    def getState(self):
+        # star trails processed so far, merged with mergeState()
+        return {
+            'trail_image'       : self.trail_image,
+            'trail_count'       : self.trail_count,
+            'excluded_images'   : self.excluded_images,
+            'placeholder_image' : self.placeholder_image,
+            'placeholder_adu'   : self.placeholder_adu,
+            'elapsed'           : self.image_processing_elapsed_s,
+        }
+
+
+    def mergeState(self, state):
+        # combines star trails processed by another generator, states must be merged in order
+        self.trail_count += state['trail_count']
+        self.excluded_images += state['excluded_images']
+        self.image_processing_elapsed_s += state['elapsed']
+
+
+        if state['placeholder_adu'] < self.placeholder_adu:
+            # earlier images win a tie, same as processing them in order
+            self._setPlaceholder(state['placeholder_image'], state['placeholder_adu'])
+
+
+        if isinstance(state['trail_image'], type(None)):
+            return
+
+        if isinstance(self.trail_image, type(None)):
+            self._initTrail(state['trail_image'])
+
+        cv2.max(self.trail_image, state['trail_image'], dst=self.trail_image)
+
+
     def finalize(self, outfile):
         outfile_p = Path(outfile)
 
@@ -240,7 +286,25 @@ class StarTrailGenerator(object):
 
     def cleanup(self):
         # cleanup the folder
-        self.timelapse_tmpdir.cleanup()
+        if self.timelapse_tmpdir:
+            self.timelapse_tmpdir.cleanup()
+
+
+    def _initTrail(self, image):
+        image_height, image_width = image.shape[:2]
+
+        self.pixels_cutoff = (image_height * image_width) * (self._pixel_cutoff_threshold / 100)
+
+        # base image is just a black image
+        if len(image.shape) == 2:
+            self.trail_image = numpy.zeros((image_height, image_width), dtype=numpy.uint8)
+        else:
+            self.trail_image = numpy.zeros((image_height, image_width, 3), dtype=numpy.uint8)
+
+
+    def _setPlaceholder(self, image, m_avg):
+        self.placeholder_image = image
+        self.placeholder_adu = m_avg
 
 
     def _generateSqmMask(self, img):
@@ -0,0 +1,223 @@
+import io
+import json
+from pathlib import Path
+import cv2
+import numpy
+import logging
+
+from .starTrails import StarTrailGenerator
+
+
+logger = logging.getLogger('indi_allsky')
+
+
+class IndiAllSkyStarTrailAccumulator(StarTrailGenerator):
+    """Star trails built while images are captured.
+
+    The trail image and the placeholder image are memory mapped .npy files
+    in the night image folder, the counters are stored in a json file.  At
+    every checkpoint the images are flushed before the counters are
+    written, a restart resumes from the last checkpoint.  Frames added
+    after the checkpoint may already be in the trail image, adding them
+    again does not change the maximum.
+
+    Frames are included or excluded with the same rules as the end of
+    night star trails.
+    """
+
+    trail_name = 'startrail_live.npy'
+    placeholder_name = 'startrail_live_placeholder.npy'
+    state_name = 'startrail_live.json'
+
+    write_timelapse_frames = False
+
+    checkpoint_interval = 10  # frames between checkpoints
+
+
+    def __init__(self, config, bin_v, folder, mask=None):
+        super(IndiAllSkyStarTrailAccumulator, self).__init__(config, bin_v, mask=mask)
+
+        self.folder_p = Path(folder)
+
+        self._placeholder_data = None
+
+        self._frame_count = 0
+        self._unsaved_frames = 0
+
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    @frame_count.setter
+    def frame_count(self, *args):
+        pass  # read only
+
+
+    @classmethod
+    def exists(cls, folder):
+        folder_p = Path(folder)
+
+        for name in (cls.trail_name, cls.placeholder_name, cls.state_name):
+            if not folder_p.joinpath(name).exists():
+                return False
+
+        return True
+
+
+    @classmethod
+    def remove(cls, folder):
+        folder_p = Path(folder)
+
+        for name in (cls.trail_name, cls.placeholder_name, cls.state_name):
+            try:
+                folder_p.joinpath(name).unlink()
+            except FileNotFoundError:
+                pass
+
+
+    def open(self):
+        # returns False if there is no usable checkpoint
+        if not self.exists(self.folder_p):
+            return False
+
+        try:
+            with io.open(str(self.folder_p.joinpath(self.state_name)), 'r') as f_state:
+                state = json.load(f_state)
+
+            trail_image = numpy.load(str(self.folder_p.joinpath(self.trail_name)), mmap_mode='r+')
+            placeholder_data = numpy.load(str(self.folder_p.joinpath(self.placeholder_name)), mmap_mode='r+')
+        except (OSError, ValueError) as e:
+            logger.error('Unable to open live star trails: %s', str(e))
+            return False
+
+
+        self.trail_image = trail_image
+        self._placeholder_data = placeholder_data
+
+        self.trail_count = state['trail_count']
+        self.excluded_images = state['excluded_images']
+        self._frame_count = state['frame_count']
+        self._unsaved_frames = 0
+
+        self.placeholder_adu = state['placeholder_adu']
+        if self.placeholder_adu < 255:
+            self.placeholder_image = self._placeholder_data
+        else:
+            self.placeholder_image = None
+
+
+        image_height, image_width = self.trail_image.shape[:2]
+        self.pixels_cutoff = (image_height * image_width) * (self._pixel_cutoff_threshold / 100)
+
+        logger.info('Opened live star trails with %d of %d frames: %s', self.trail_count, self._frame_count, self.folder_p)
+
+        return True
+
+
+    def close(self):
+        self.trail_image = None  # unmapped when released
+        self.placeholder_image = None
+        self._placeholder_data = None
+
+
+    def addImage(self, image):
+        # returns True if a checkpoint was written
+        if isinstance(self.trail_image, type(None)):
+            self.open()  # created with the first frame if there is no checkpoint
+
+
+        if len(image.shape) == 2:
+            # same as reading the stored image as color
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+        if not isinstance(self.trail_image, type(None)) and image.shape != self.trail_image.shape:
+            # frame size changed during the night
+            image_height, image_width = self.trail_image.shape[:2]
+            image = cv2.resize(image, (image_width, image_height), interpolation=cv2.INTER_AREA)
+
+
+        self.processImage(None, image)
+
+        self._frame_count += 1
+        self._unsaved_frames += 1
+
+
+        if self._unsaved_frames < self.checkpoint_interval:
+            return False
+
+        self.checkpoint()
+
+        return True
+
+
+    def checkpoint(self):
+        if isinstance(self.trail_image, type(None)) or not self._unsaved_frames:
+            return
+
+
+        # images must be on disk before the counters
+        self.trail_image.flush()
+        self._placeholder_data.flush()
+
+
+        state = {
+            'trail_count'     : self.trail_count,
+            'excluded_images' : self.excluded_images,
+            'frame_count'     : self._frame_count,
+            'placeholder_adu' : self.placeholder_adu,
+        }
+
+        state_p = self.folder_p.joinpath(self.state_name)
+        tmp_state_p = state_p.with_name('.{0:s}.tmp'.format(self.state_name))
+
+        with io.open(str(tmp_state_p), 'w') as f_state:
+            json.dump(state, f_state, indent=4)
+
+        tmp_state_p.replace(state_p)
+
+        self._unsaved_frames = 0
+
+
+    def getImage(self):
+        # copy of the star trails so far, the trail image keeps changing
+        if self.trail_count == 0:
+            if isinstance(self.placeholder_image, type(None)):
+                return None
+
+            return numpy.array(self.placeholder_image)
+
+        return numpy.array(self.trail_image)
+
+
+    def _initTrail(self, image):
+        logger.info('Creating live star trails: %s', self.folder_p)
+
+        if not self.folder_p.exists():
+            self.folder_p.mkdir(mode=0o755, parents=True)
+
+
+        image_height, image_width = image.shape[:2]
+
+        self.pixels_cutoff = (image_height * image_width) * (self._pixel_cutoff_threshold / 100)
+
+        # new files are filled with zeros, a black base image
+        self.trail_image = numpy.lib.format.open_memmap(
+            str(self.folder_p.joinpath(self.trail_name)),
+            mode='w+',
+            dtype=numpy.uint8,
+            shape=image.shape,
+        )
+
+        self._placeholder_data = numpy.lib.format.open_memmap(
+            str(self.folder_p.joinpath(self.placeholder_name)),
+            mode='w+',
+            dtype=numpy.uint8,
+            shape=image.shape,
+        )
+
+
+    def _setPlaceholder(self, image, m_avg):
+        self._placeholder_data[:] = image
+        self.placeholder_image = self._placeholder_data
+        self.placeholder_adu = m_avg
@@ -13,13 +13,16 @@ class IndiAllSkyStars(object):
     _distanceThreshold = 10
 
 
-    def __init__(self, config, bin_v, mask=None):
+    def __init__(self, config, bin_v, mask=None, geometry=None):
         self.config = config
         self.bin_v = bin_v
 
+        self._geometry = geometry
+
         self._sqm_mask = mask
 
         self._detectionThreshold = self.config.get('DETECT_STARS_THOLD', 0.6)
+        self._pyramidLevel = self.config.get('DETECT_STARS_PYRAMID', 0)  # 0 = full resolution
 
         if self.config['IMAGE_FOLDER']:
             self.image_dir = Path(self.config['IMAGE_FOLDER']).absolute()
@@ -48,48 +51,189 @@ class IndiAllSkyStars(object):
         self.star_template_w, self.star_template_h = self.star_template.shape[::-1]
 
 
-    def detectObjects(self, original_data):
+    def detectObjects(self, original_data, frame_stats=None, extra_level=0):
         if isinstance(self._sqm_mask, type(None)):
             # This only needs to be done once if a mask is not provided
             self._generateSqmMask(original_data)
 
-        masked_img = cv2.bitwise_and(original_data, original_data, mask=self._sqm_mask)
+        if not isinstance(frame_stats, type(None)):
+            # luminance plane is already available
+            grey_img = frame_stats.maskedLuminance(self._sqm_mask)
+        else:
+            masked_img = cv2.bitwise_and(original_data, original_data, mask=self._sqm_mask)
+
+            if len(original_data.shape) == 2:
+                # gray scale or bayered
+                grey_img = masked_img
+            else:
+                # assume color
+                grey_img = cv2.cvtColor(masked_img, cv2.COLOR_BGR2GRAY)
+
+
+        sep_start = time.time()
+
+        # extra_level reduces the resolution further when processing is over budget
+        blobs = self._findBlobs(grey_img, self.star_template, level=self._pyramidLevel + extra_level)
+
+        sep_elapsed_s = time.time() - sep_start
+        logger.info('Star detection in %0.4f s', sep_elapsed_s)
+
+        logger.info('Found %d objects', len(blobs))
+
+        self._drawCircles(original_data, blobs)
+
+        return blobs
+
+
+    def detectCentroids(self, original_data, detection_sigma=5, max_points=50):
+        # star centers for image registration, brightest first
+        if isinstance(self._sqm_mask, type(None)):
+            # This only needs to be done once if a mask is not provided
+            self._generateSqmMask(original_data)
 
         if len(original_data.shape) == 2:
             # gray scale or bayered
-            grey_img = masked_img
+            grey_img = original_data.astype(numpy.float32)
         else:
             # assume color
-            grey_img = cv2.cvtColor(masked_img, cv2.COLOR_BGR2GRAY)
+            grey_img = cv2.cvtColor(original_data, cv2.COLOR_BGR2GRAY).astype(numpy.float32)
 
 
-        sep_start = time.time()
+        cent_start = time.time()
 
+        grey_img = cv2.bitwise_and(grey_img, grey_img, mask=self._sqm_mask)
 
-        result = cv2.matchTemplate(grey_img, self.star_template, cv2.TM_CCOEFF_NORMED)
-        result_filter = numpy.where(result >= self._detectionThreshold)
+        blobs = self._findBlobs(grey_img, self.star_template.astype(numpy.float32))
 
-        blobs = list()
-        for pt in zip(*result_filter[::-1]):
-            for blob in blobs:
-                if (abs(pt[0] - blob[0]) < self._distanceThreshold) and (abs(pt[1] - blob[1]) < self._distanceThreshold):
-                    break
 
-            else:
-                # if none of the points are under the distance threshold, then add it
-                blobs.append(pt)
+        # background level of the detection area
+        roi_values = grey_img[self._sqm_mask > 0]
+        bg_median = numpy.median(roi_values)
+        bg_std = 1.4826 * numpy.median(numpy.abs(roi_values - bg_median))  # robust std-dev
 
+        detection_limit = bg_median + (detection_sigma * bg_std)
 
-        sep_elapsed_s = time.time() - sep_start
-        logger.info('Star detection in %0.4f s', sep_elapsed_s)
 
-        logger.info('Found %d objects', len(blobs))
+        centroids = list()
+        for blob in blobs:
+            x = blob[0] + int(self.star_template_w / 2)
+            y = blob[1] + int(self.star_template_h / 2)
 
-        self._drawCircles(original_data, blobs)
+            value = grey_img[y, x]
+            if value <= detection_limit:
+                continue
+
+
+            # intensity weighted center for sub-pixel accuracy
+            window = grey_img[max(y - 2, 0):y + 3, max(x - 2, 0):x + 3] - bg_median
+            window[window < 0] = 0
+
+            window_sum = numpy.sum(window)
+            if window_sum <= 0:
+                continue
+
+            w_y, w_x = numpy.indices(window.shape)
+            c_x = max(x - 2, 0) + (numpy.sum(w_x * window) / window_sum)
+            c_y = max(y - 2, 0) + (numpy.sum(w_y * window) / window_sum)
+
+            centroids.append((value, c_x, c_y))
+
+
+        centroids.sort(key=lambda c: c[0], reverse=True)
+
+        centroid_array = numpy.array([(c[1], c[2]) for c in centroids[:max_points]], dtype=numpy.float64).reshape(-1, 2)
+
+
+        cent_elapsed_s = time.time() - cent_start
+        logger.info('Found %d registration stars in %0.4f s', len(centroid_array), cent_elapsed_s)
+
+        return centroid_array
+
+
+    def _findBlobs(self, grey_img, template, level=0):
+        # blobs are returned as the top left corner of the matching template
+        template_h, template_w = template.shape[:2]
+
+        small_img = grey_img
+        small_template = template
+        for i in range(level):
+            # search a downscaled image, the template is scaled to match
+            small_img = cv2.pyrDown(small_img)
+            small_template = cv2.pyrDown(small_template)
+
+        scale = 2 ** level
+        distance = max(int(self._distanceThreshold / scale), 1)
+
+
+        result = cv2.matchTemplate(small_img, small_template, cv2.TM_CCOEFF_NORMED)
+
+
+        # non-maximum suppression, a peak must be the highest value within the distance threshold
+        kernel = numpy.ones(((distance * 2) - 1, (distance * 2) - 1), dtype=numpy.uint8)
+        result_max = cv2.dilate(result, kernel)
+
+        peaks = (result >= self._detectionThreshold) & (result == result_max)
+
+        peak_y, peak_x = numpy.nonzero(peaks)
+
+
+        if level:
+            # map the template center back to full resolution
+            small_h, small_w = small_template.shape[:2]
+            peak_x = ((peak_x + (small_w / 2)) * scale) - (template_w / 2)
+            peak_y = ((peak_y + (small_h / 2)) * scale) - (template_h / 2)
+
+            peak_x, peak_y = self._refinePeaks(grey_img, template, numpy.round(peak_x).astype(numpy.int64), numpy.round(peak_y).astype(numpy.int64), int(scale / 2))
+
+
+        blobs = list(zip(peak_x.tolist(), peak_y.tolist()))
 
         return blobs
 
 
+    def _refinePeaks(self, grey_img, template, peak_x, peak_y, radius):
+        # score downscaled candidates at full resolution, weak matches are dropped
+        template_h, template_w = template.shape[:2]
+
+        windows = numpy.lib.stride_tricks.sliding_window_view(grey_img, (template_h, template_w))
+        max_y, max_x = windows.shape[:2]
+
+        t = template.astype(numpy.float32)
+        t = t - numpy.mean(t)
+        t_norm = numpy.sqrt(numpy.sum(t * t))
+
+
+        best_score = numpy.full(peak_x.shape, -1.0, dtype=numpy.float32)
+        best_x = peak_x.copy()
+        best_y = peak_y.copy()
+
+        for dy in range(-radius, radius + 1):
+            for dx in range(-radius, radius + 1):
+                x = numpy.clip(peak_x + dx, 0, max_x - 1)
+                y = numpy.clip(peak_y + dy, 0, max_y - 1)
+
+                w = windows[y, x].astype(numpy.float32)
+                w = w - numpy.mean(w, axis=(1, 2), keepdims=True)
+
+                w_norm = numpy.sqrt(numpy.sum(w * w, axis=(1, 2)))
+                w_norm[w_norm == 0] = numpy.inf  # flat areas do not match
+
+                score = numpy.sum(w * t, axis=(1, 2)) / (w_norm * t_norm)
+
+                better = score > best_score
+                best_score[better] = score[better]
+                best_x[better] = x[better]
+                best_y[better] = y[better]
+
+
+        keep = best_score >= self._detectionThreshold
+
+        # neighboring candidates may converge on the same peak
+        peaks = numpy.unique(numpy.stack((best_y[keep], best_x[keep]), axis=1), axis=0)
+
+        return peaks[:, 1], peaks[:, 0]
+
+
     def _generateSqmMask(self, img):
         logger.info('Generating mask based on SQM_ROI')
 
@@ -101,10 +245,14 @@ class IndiAllSkyStars(object):
         sqm_roi = self.config.get('SQM_ROI', [])
 
         try:
-            x1 = int(sqm_roi[0] / self.bin_v.value)
-            y1 = int(sqm_roi[1] / self.bin_v.value)
-            x2 = int(sqm_roi[2] / self.bin_v.value)
-            y2 = int(sqm_roi[3] / self.bin_v.value)
+            if not isinstance(self._geometry, type(None)):
+                # map onto the cropped and scaled frame
+                x1, y1, x2, y2 = self._geometry.mapRoi(sqm_roi)
+            else:
+                x1 = int(sqm_roi[0] / self.bin_v.value)
+                y1 = int(sqm_roi[1] / self.bin_v.value)
+                x2 = int(sqm_roi[2] / self.bin_v.value)
+                y2 = int(sqm_roi[3] / self.bin_v.value)
         except IndexError:
             logger.warning('Using central ROI for star detection')
             x1 = int((image_width / 2) - (image_width / 3))
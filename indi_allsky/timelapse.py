@@ -3,6 +3,8 @@ import time
 import tempfile
 from pathlib import Path
 import subprocess
+import cv2
+import numpy
 import logging
 
 from .exceptions import TimelapseException
@@ -20,6 +22,24 @@ class TimelapseGenerator(object):
         self.seqfolder = tempfile.TemporaryDirectory(suffix='_timelapse')
         self.seqfolder_p = Path(self.seqfolder.name)
 
+        # streaming state
+        self._video_file_p = None
+        self._ffmpeg_proc = None
+        self._ffmpeg_output = None
+        self._frame_size = None
+        self._frame_count = 0
+        self._stream_start = None
+        self._stream_error = False
+
+
+    @property
+    def frame_count(self):
+        return self._frame_count
+
+    @frame_count.setter
+    def frame_count(self, *args):
+        pass  # read only
+
 
     def __del__(self):
         self.cleanup()
@@ -51,22 +71,9 @@ class TimelapseGenerator(object):
             #'-start_number', '0',
             #'-pattern_type', 'glob',
             '-i', '{0:s}/%05d.{1:s}'.format(str(self.seqfolder_p), self.config['IMAGE_FILE_TYPE']),
-            '-vcodec', '{0:s}'.format(self.config['FFMPEG_CODEC']),
-            '-b:v', '{0:s}'.format(self.config['FFMPEG_BITRATE']),
-            '-pix_fmt', 'yuv420p',
-            '-movflags', '+faststart',
         ]
 
-
-        # add scaling option if defined
-        if self.config.get('FFMPEG_VFSCALE'):
-            logger.warning('Setting FFMPEG scaling option: %s', self.config.get('FFMPEG_VFSCALE'))
-            cmd.append('-vf')
-            cmd.append('scale={0:s}'.format(self.config.get('FFMPEG_VFSCALE')))
-
-
-        # finally add filename
-        cmd.append('{0:s}'.format(str(video_file_p)))
+        cmd.extend(self._outputArgs(video_file_p))
 
 
         try:
@@ -100,7 +107,169 @@ class TimelapseGenerator(object):
         video_file_p.chmod(0o644)
 
 
+    def start(self, video_file):
+        # frames are passed to addFrame() as decoded BGR images, ffmpeg is started with the first frame
+        self._video_file_p = Path(video_file)
+        self._frame_count = 0
+        self._stream_error = False
+
+
+    def addFrame(self, image):
+        if self._stream_error:
+            return
+
+
+        if len(image.shape) == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+
+        if isinstance(self._ffmpeg_proc, type(None)):
+            self._startStream(image)
+
+            if self._stream_error:
+                return
+
+
+        height, width = image.shape[:2]
+        if (width, height) != self._frame_size:
+            # raw video frames must all be the same size
+            image = cv2.resize(image, self._frame_size, interpolation=cv2.INTER_AREA)
+
+
+        try:
+            self._ffmpeg_proc.stdin.write(numpy.ascontiguousarray(image).data)
+        except BrokenPipeError:
+            logger.error('FFMPEG exited while receiving frames')
+            self._stream_error = True
+            return
+
+        self._frame_count += 1
+
+
+    def finish(self):
+        if isinstance(self._ffmpeg_proc, type(None)):
+            if self._stream_error:
+                raise TimelapseException('FFMPEG failed to start')
+
+            raise TimelapseException('No frames for timelapse')
+
+
+        try:
+            self._ffmpeg_proc.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        returncode = self._ffmpeg_proc.wait()
+
+        self._ffmpeg_output.seek(0)
+        ffmpeg_stdout = self._ffmpeg_output.read()
+        self._ffmpeg_output.close()
+
+        self._ffmpeg_proc = None
+
+
+        elapsed_s = time.time() - self._stream_start
+
+        if returncode != 0 or self._stream_error:
+            logger.info('FFMPEG ran for %0.4f s', elapsed_s)
+            logger.error('FFMPEG failed to generate timelapse, return code: %d', returncode)
+            logger.error('FFMPEG output: %s', ffmpeg_stdout)
+
+            if self._video_file_p.is_file():
+                logger.error('FFMPEG created broken video file, cleaning up')
+                self._video_file_p.unlink()
+
+            raise TimelapseException('FFMPEG return code %d', returncode)
+
+
+        logger.info('Timelapse generated from %d frames in %0.4f s', self._frame_count, elapsed_s)
+        logger.info('FFMPEG output: %s', ffmpeg_stdout)
+
+
+        # set default permissions
+        self._video_file_p.chmod(0o644)
+
+
+    def abort(self):
+        # discard a timelapse that is not needed
+        if isinstance(self._ffmpeg_proc, type(None)):
+            return
+
+        self._ffmpeg_proc.kill()
+        self._ffmpeg_proc.wait()
+
+        self._ffmpeg_output.close()
+        self._ffmpeg_proc = None
+
+        try:
+            self._video_file_p.unlink()
+        except FileNotFoundError:
+            pass
+
+
+    def _startStream(self, image):
+        height, width = image.shape[:2]
+        self._frame_size = (width, height)
+
+        cmd = [
+            'ffmpeg',
+            '-y',
+            '-loglevel', 'level+warning',
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            '-s', '{0:d}x{1:d}'.format(width, height),
+            '-r', '{0:d}'.format(self.config['FFMPEG_FRAMERATE']),
+            '-i', '-',
+        ]
+
+        cmd.extend(self._outputArgs(self._video_file_p))
+
+
+        # output is collected in a file, a pipe could fill and block ffmpeg
+        self._ffmpeg_output = tempfile.TemporaryFile()
+
+        self._stream_start = time.time()
+
+        try:
+            self._ffmpeg_proc = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=self._ffmpeg_output,
+                stderr=subprocess.STDOUT,
+                preexec_fn=lambda: os.nice(19),
+            )
+        except OSError as e:
+            # the other products are still generated
+            logger.error('Unable to start FFMPEG: %s', str(e))
+            self._ffmpeg_output.close()
+            self._stream_error = True
+
+
+    def _outputArgs(self, video_file_p):
+        args = [
+            '-vcodec', '{0:s}'.format(self.config['FFMPEG_CODEC']),
+            '-b:v', '{0:s}'.format(self.config['FFMPEG_BITRATE']),
+            '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart',
+        ]
+
+
+        # add scaling option if defined
+        if self.config.get('FFMPEG_VFSCALE'):
+            logger.warning('Setting FFMPEG scaling option: %s', self.config.get('FFMPEG_VFSCALE'))
+            args.append('-vf')
+            args.append('scale={0:s}'.format(self.config.get('FFMPEG_VFSCALE')))
+
+
+        # finally add filename
+        args.append('{0:s}'.format(str(video_file_p)))
+
+        return args
+
+
     def cleanup(self):
+        self.abort()
+
         # delete all existing symlinks and sequence folder
         self.seqfolder.cleanup()
 
@@ -19,7 +19,11 @@ from . import constants
 
 from .timelapse import TimelapseGenerator
 from .keogram import KeogramGenerator
+from .keogramStrip import IndiAllSkyKeogramStrip
 from .starTrails import StarTrailGenerator
+from .starTrailsLive import IndiAllSkyStarTrailAccumulator
+from .productPool import IndiAllSkyProductPool
+from .productPool import readImage
 
 from .flask import create_app
 from .flask import db
@@ -57,6 +61,9 @@ logger = logging.getLogger('indi_allsky')
 
 class VideoWorker(Process):
 
+    keogram_strip_min_ratio = 0.9  # live keogram must include this fraction of the images
+    startrail_live_min_ratio = 0.9  # live star trails must include this fraction of the images
+
 
     def __init__(
         self,
@@ -438,6 +445,16 @@ class VideoWorker(Process):
 
 
     def generateKeogramStarTrails(self, task, timespec, img_folder, night, camera):
+        self._generateProducts(task, timespec, img_folder, night, camera, timelapse=False)
+
+
+    def generateProducts(self, task, timespec, img_folder, night, camera):
+        # timelapse, keogram and star trails from a single pass over the images
+        self._generateProducts(task, timespec, img_folder, night, camera, timelapse=True)
+
+
+    def _generateProducts(self, task, timespec, img_folder, night, camera, timelapse=False):
+        # each image is decoded once and shared by all of the products
         task.setRunning()
 
         now = datetime.now()
@@ -469,61 +486,89 @@ class VideoWorker(Process):
         keogram_file = img_folder.parent.joinpath('allsky-keogram_ccd{0:d}_{1:s}_{2:s}.{3:s}'.format(camera.id, timespec, timeofday, self.config['IMAGE_FILE_TYPE']))
         startrail_file = img_folder.parent.joinpath('allsky-startrail_ccd{0:d}_{1:s}_{2:s}.{3:s}'.format(camera.id, timespec, timeofday, self.config['IMAGE_FILE_TYPE']))
         startrail_video_file = img_folder.parent.joinpath('allsky-startrail_timelapse_ccd{0:d}_{1:s}_{2:s}.{3:s}'.format(camera.id, timespec, timeofday, video_format))
+        video_file = img_folder.parent.joinpath('allsky-timelapse_ccd{0:d}_{1:s}_{2:s}.{3:s}'.format(camera.id, timespec, timeofday, video_format))
+
+        if timelapse and video_file.exists():
+            # the other products can still be generated
+            logger.warning('Video is already generated: %s', video_file)
+            timelapse = False
 
+        keogram = True
         if keogram_file.exists():
             logger.warning('Keogram is already generated: %s', keogram_file)
-            task.setFailed('Keogram is already generated: {0:s}'.format(str(keogram_file)))
-            return
+            keogram = False
 
-        if startrail_file.exists():
+        startrail = night
+        if startrail and startrail_file.exists():
             logger.warning('Star trail is already generated: %s', startrail_file)
-            task.setFailed('Star trail is already generated: {0:s}'.format(str(startrail_file)))
-            return
+            startrail = False
 
-        if startrail_video_file.exists():
+        startrail_timelapse = night and self.config.get('STARTRAILS_TIMELAPSE', True)
+        if startrail_timelapse and startrail_video_file.exists():
             logger.warning('Star trail timelapse is already generated: %s', startrail_video_file)
-            task.setFailed('Star trail timelapse is already generated: {0:s}'.format(str(startrail_video_file)))
+            startrail_timelapse = False
+
+
+        if not timelapse and not keogram and not startrail and not startrail_timelapse:
+            task.setFailed('Keogram and star trails are already generated: {0:s}'.format(str(keogram_file)))
             return
 
 
 
-        try:
-            # delete old keogram entry if it exists
-            old_keogram_entry = IndiAllSkyDbKeogramTable.query\
-                .filter(IndiAllSkyDbKeogramTable.filename == str(keogram_file))\
-                .one()
+        if keogram:
+            try:
+                # delete old keogram entry if it exists
+                old_keogram_entry = IndiAllSkyDbKeogramTable.query\
+                    .filter(IndiAllSkyDbKeogramTable.filename == str(keogram_file))\
+                    .one()
 
-            logger.warning('Removing orphaned keogram db entry')
-            db.session.delete(old_keogram_entry)
-            db.session.commit()
-        except NoResultFound:
-            pass
+                logger.warning('Removing orphaned keogram db entry')
+                db.session.delete(old_keogram_entry)
+                db.session.commit()
+            except NoResultFound:
+                pass
 
 
-        try:
-            # delete old star trail entry if it exists
-            old_startrail_entry = IndiAllSkyDbStarTrailsTable.query\
-                .filter(IndiAllSkyDbStarTrailsTable.filename == str(startrail_file))\
-                .one()
+        if startrail:
+            try:
+                # delete old star trail entry if it exists
+                old_startrail_entry = IndiAllSkyDbStarTrailsTable.query\
+                    .filter(IndiAllSkyDbStarTrailsTable.filename == str(startrail_file))\
+                    .one()
 
-            logger.warning('Removing orphaned star trail db entry')
-            db.session.delete(old_startrail_entry)
-            db.session.commit()
-        except NoResultFound:
-            pass
+                logger.warning('Removing orphaned star trail db entry')
+                db.session.delete(old_startrail_entry)
+                db.session.commit()
+            except NoResultFound:
+                pass
 
 
-        try:
-            # delete old star trail video entry if it exists
-            old_startrail_video_entry = IndiAllSkyDbStarTrailsVideoTable.query\
-                .filter(IndiAllSkyDbStarTrailsVideoTable.filename == str(startrail_video_file))\
-                .one()
+        if startrail_timelapse:
+            try:
+                # delete old star trail video entry if it exists
+                old_startrail_video_entry = IndiAllSkyDbStarTrailsVideoTable.query\
+                    .filter(IndiAllSkyDbStarTrailsVideoTable.filename == str(startrail_video_file))\
+                    .one()
 
-            logger.warning('Removing orphaned star trail video db entry')
-            db.session.delete(old_startrail_video_entry)
-            db.session.commit()
-        except NoResultFound:
-            pass
+                logger.warning('Removing orphaned star trail video db entry')
+                db.session.delete(old_startrail_video_entry)
+                db.session.commit()
+            except NoResultFound:
+                pass
+
+
+        if timelapse:
+            try:
+                # delete old video entry if it exists
+                old_video_entry = IndiAllSkyDbVideoTable.query\
+                    .filter(IndiAllSkyDbVideoTable.filename == str(video_file))\
+                    .one()
+
+                logger.warning('Removing orphaned video db entry')
+                db.session.delete(old_video_entry)
+                db.session.commit()
+            except NoResultFound:
+                pass
 
 
         # find all files
@@ -536,7 +581,7 @@ class VideoWorker(Process):
 
 
         image_count = files_entries.count()
-        logger.info('Found %d images for keogram/star trails', image_count)
+        logger.info('Found %d images for timelapse/keogram/star trails', image_count)
 
 
         processing_start = time.time()
@@ -545,6 +590,24 @@ class VideoWorker(Process):
         kg.angle = self.config['KEOGRAM_ANGLE']
         kg.h_scale_factor = self.config['KEOGRAM_H_SCALE']
         kg.v_scale_factor = self.config['KEOGRAM_V_SCALE']
+        kg.reserve(image_count)
+
+
+        # use the keogram built during capture if it is complete
+        keogram_strip = False
+
+        strip = IndiAllSkyKeogramStrip(img_folder)
+        if keogram and strip.open():
+            if strip.info['angle'] != kg.angle:
+                logger.warning('Live keogram angle does not match, rebuilding keogram')
+            elif not strip.count or strip.count < image_count * self.keogram_strip_min_ratio:
+                logger.warning('Live keogram is incomplete (%d of %d images), rebuilding keogram', strip.count, image_count)
+            else:
+                logger.info('Using live keogram with %d columns', strip.count)
+                kg.loadStrip(strip.getData(), strip.getTimestamps(), strip.info)
+                keogram_strip = True
+
+            strip.close()
 
 
         keogram_metadata = {
@@ -571,14 +634,25 @@ class VideoWorker(Process):
             'camera_uuid': camera.uuid,
         }
 
+        video_metadata = {
+            'type'       : constants.VIDEO,
+            'createDate' : now.timestamp(),
+            'dayDate'    : d_dayDate.strftime('%Y%m%d'),
+            'night'      : night,
+            'camera_uuid': camera.uuid,
+        }
+
         # Add DB entries before creating files
-        keogram_entry = self._miscDb.addKeogram(
-            keogram_file,
-            camera.id,
-            keogram_metadata,
-        )
+        if keogram:
+            keogram_entry = self._miscDb.addKeogram(
+                keogram_file,
+                camera.id,
+                keogram_metadata,
+            )
+        else:
+            keogram_entry = None
 
-        if night:
+        if startrail:
             startrail_entry = self._miscDb.addStarTrail(
                 startrail_file,
                 camera.id,
@@ -586,47 +660,142 @@ class VideoWorker(Process):
             )
         else:
             startrail_entry = None
-            startrail_video_entry = None
 
+        startrail_video_entry = None
 
-        stg = StarTrailGenerator(self.config, self.bin_v, mask=self._detection_mask)
-        stg.max_brightness = self.config['STARTRAILS_MAX_ADU']
-        stg.mask_threshold = self.config['STARTRAILS_MASK_THOLD']
-        stg.pixel_cutoff_threshold = self.config['STARTRAILS_PIXEL_THOLD']
 
+        if timelapse:
+            video_entry = self._miscDb.addVideo(
+                video_file,
+                camera.id,
+                video_metadata,
+            )
 
-        # Files are presorted from the DB
-        for i, entry in enumerate(files_entries):
-            if i % 100 == 0:
-                logger.info('Processed %d of %d images', i, image_count)
+            # decoded frames are piped to ffmpeg
+            tg = TimelapseGenerator(self.config)
+            tg.start(video_file)
+        else:
+            video_entry = None
+            tg = None
 
-            p_entry = Path(entry.getFilesystemPath())
 
-            if not p_entry.exists():
-                logger.error('File not found: %s', p_entry)
-                continue
+        # use the star trails built during capture if they are complete, the
+        # star trail timelapse still needs every frame
+        startrail_live = False
 
-            if p_entry.stat().st_size == 0:
-                continue
+        if startrail and not startrail_timelapse:
+            stg = IndiAllSkyStarTrailAccumulator(self.config, self.bin_v, img_folder)
+            if stg.open():
+                if stg.frame_count < image_count * self.startrail_live_min_ratio:
+                    logger.warning('Live star trails are incomplete (%d of %d images), rebuilding star trails', stg.frame_count, image_count)
+                    stg.close()
+                else:
+                    logger.info('Using live star trails with %d frames', stg.frame_count)
+                    startrail_live = True
+
+
+        if not startrail_live:
+            stg = StarTrailGenerator(self.config, self.bin_v, mask=self._detection_mask)
+            stg.max_brightness = self.config['STARTRAILS_MAX_ADU']
+            stg.mask_threshold = self.config['STARTRAILS_MASK_THOLD']
+            stg.pixel_cutoff_threshold = self.config['STARTRAILS_PIXEL_THOLD']
+
+
+        if startrail_timelapse:
+            # star trail frames are piped to ffmpeg as they are built
+            st_tg = TimelapseGenerator(self.config)
+            st_tg.start(startrail_video_file)
+            stg.timelapse_stream = st_tg
+        else:
+            st_tg = None
+            stg.write_timelapse_frames = False
+
+
+        # products that are already generated or were built during capture do not need the images
+        keogram_images = keogram and not keogram_strip
+        startrail_images = (startrail or startrail_timelapse) and not startrail_live
+
+
+        if not tg and not keogram_images and not startrail_images:
+            # the images are not needed
+            file_list = list()
+        else:
+            # Files are presorted from the DB
+            file_list = [entry.getFilesystemPath() for entry in files_entries]
+
+
+        product_workers = int(self.config.get('PRODUCT_WORKERS', 2))
+
+        if product_workers > 1 and file_list:
+            pool = IndiAllSkyProductPool(self.config, self.bin_v, mask=self._detection_mask, workers=product_workers)
+        else:
+            pool = None
+
+
+        if pool and not tg and not st_tg:
+            # without videos the frames do not need to be processed in order
+            if keogram_images:
+                pool_kg = kg
+            else:
+                pool_kg = None
+
+            if startrail_images:
+                pool_stg = stg
+            else:
+                pool_stg = None
+
+            if pool_kg or pool_stg:
+                pool.generate(file_list, kg=pool_kg, stg=pool_stg)
 
-            #logger.info('Reading file: %s', p_entry)
-            image = cv2.imread(str(p_entry), cv2.IMREAD_COLOR)  # convert grayscale to color
+            file_list = list()
+
+
+        if pool and file_list:
+            # videos need the frames in order, only decoding is done in the pool
+            image_iter = pool.imread(file_list)
+        else:
+            image_iter = ((Path(filename), readImage(filename)) for filename in file_list)
+
+
+        for i, (p_entry, image) in enumerate(image_iter):
+            if i % 100 == 0:
+                logger.info('Processed %d of %d images', i, image_count)
 
             if isinstance(image, type(None)):
-                logger.error('Unable to read %s', p_entry)
                 continue
 
-            kg.processImage(p_entry, image)
+            if tg:
+                tg.addFrame(image)
+
+            if keogram_images:
+                kg.processImage(p_entry, image)
 
-            if night:
+            if startrail_images:
                 stg.processImage(p_entry, image)
 
 
-        kg.finalize(keogram_file)
+        if tg:
+            try:
+                tg.finish()
+            except TimelapseException:
+                video_entry.success = False
+                db.session.commit()
 
-        if night:
+                self._miscDb.addNotification(
+                    NotificationCategory.MEDIA,
+                    'timelapse_video',
+                    'Timelapse video failed to generate',
+                    expire=timedelta(hours=12),
+                )
+
+
+        if keogram:
+            kg.finalize(keogram_file)
+
+        if startrail:
             stg.finalize(startrail_file)
 
+        if st_tg:
             st_frame_count = stg.timelapse_frame_count
             if st_frame_count >= self.config.get('STARTRAILS_TIMELAPSE_MINFRAMES', 250):
                 startrail_video_entry = self._miscDb.addStarTrailVideo(
@@ -636,8 +805,7 @@ class VideoWorker(Process):
                 )
 
                 try:
-                    st_tg = TimelapseGenerator(self.config)
-                    st_tg.generate(startrail_video_file, stg.timelapse_frame_list)
+                    st_tg.finish()
                 except TimelapseException:
                     logger.error('Failed to generate startrails timelapse')
 
@@ -652,11 +820,21 @@ class VideoWorker(Process):
                     )
             else:
                 logger.error('Not enough frames to generate star trails timelapse: %d', st_frame_count)
-                startrail_video_entry = None
+                st_tg.abort()
 
 
         processing_elapsed_s = time.time() - processing_start
-        logger.warning('Total keogram/star trail processing in %0.1f s', processing_elapsed_s)
+        logger.warning('Total timelapse/keogram/star trail processing in %0.1f s', processing_elapsed_s)
+
+
+        if video_entry:
+            if video_file.exists():
+                self._s3_upload(video_entry, video_metadata)
+                self._syncapi(video_entry, video_metadata)
+                self._uploadVideo(video_entry, video_file, camera)
+            else:
+                # success flag set above
+                pass
 
 
         if keogram_entry:
@@ -689,7 +867,10 @@ class VideoWorker(Process):
                 pass
 
 
-        task.setSuccess('Generated keogram and/or star trail')
+        if timelapse:
+            task.setSuccess('Generated timelapse, keogram and/or star trail')
+        else:
+            task.setSuccess('Generated keogram and/or star trail')
 
 
     def _uploadKeogram(self, keogram_entry, keogram_file, camera):
@@ -1087,6 +1268,24 @@ class VideoWorker(Process):
 
 
 
+        # live keograms are removed once the images in their folder have expired
+        for strip_p in img_folder.glob('**/{0:s}'.format(IndiAllSkyKeogramStrip.strip_name)):
+            if any(p.is_dir() for p in strip_p.parent.iterdir()):
+                continue
+
+            logger.info('Removing old live keogram: %s', strip_p.parent)
+            IndiAllSkyKeogramStrip.remove(strip_p.parent)
+
+
+        # live star trails are removed the same way
+        for trail_p in img_folder.glob('**/{0:s}'.format(IndiAllSkyStarTrailAccumulator.trail_name)):
+            if any(p.is_dir() for p in trail_p.parent.iterdir()):
+                continue
+
+            logger.info('Removing old live star trails: %s', trail_p.parent)
+            IndiAllSkyStarTrailAccumulator.remove(trail_p.parent)
+
+
         # Remove empty folders
         dir_list = list()
         self._getFolderFolders(img_folder, dir_list)
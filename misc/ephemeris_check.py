@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Compares the precomputed ephemeris table with ephem under a local
+# timezone, the table must not depend on the timezone of the host
+#
+
+import os
+import sys
+import time
+import math
+import argparse
+from datetime import datetime
+from datetime import timedelta
+from pathlib import Path
+from multiprocessing import Value
+import logging
+
+import ephem
+
+
+sys.path.append(str(Path(__file__).parent.absolute().parent))
+
+from indi_allsky.ephemeris import IndiAllSkyEphemeris
+
+
+logger = logging.getLogger('indi_allsky')
+
+LOG_FORMATTER_STREAM = logging.Formatter('[%(levelname)s]: %(message)s')
+
+LOG_HANDLER_STREAM = logging.StreamHandler()
+LOG_HANDLER_STREAM.setFormatter(LOG_FORMATTER_STREAM)
+
+logger.handlers.clear()  # remove syslog
+logger.addHandler(LOG_HANDLER_STREAM)
+logger.setLevel(logging.ERROR)
+
+
+
+class EphemerisCheck(object):
+
+    max_error_deg = 0.1
+
+
+    def main(self, latitude, longitude, hours):
+        latitude_v = Value('f', latitude)
+        longitude_v = Value('f', longitude)
+
+        ephemeris = IndiAllSkyEphemeris({}, latitude_v, longitude_v)
+
+        obs = ephem.Observer()
+        obs.lat = math.radians(latitude_v.value)
+        obs.lon = math.radians(longitude_v.value)
+
+        sun = ephem.Sun()
+        moon = ephem.Moon()
+
+
+        print('Timezone: {0:s}, latitude {1:0.2f}, longitude {2:0.2f}'.format(time.strftime('%Z'), latitude, longitude))
+
+        start = datetime.utcnow()
+
+        max_error = 0.0
+        for minutes in range(0, hours * 60, 17):
+            utcnow = start + timedelta(minutes=minutes)
+
+            position = ephemeris.position(utcnow)
+
+            obs.date = utcnow
+            sun.compute(obs)
+            moon.compute(obs)
+
+            for key, expected in (
+                ('sun_alt', math.degrees(sun.alt)),
+                ('moon_alt', math.degrees(moon.alt)),
+            ):
+                error = abs(position[key] - expected)
+                max_error = max(max_error, error)
+
+                if error > self.max_error_deg:
+                    print('{0:s} {1:s}: table {2:0.3f}, ephem {3:0.3f}'.format(utcnow.strftime('%Y-%m-%d %H:%M:%S'), key, position[key], expected))
+
+
+        print('Max error: {0:0.4f} degrees'.format(max_error))
+
+        if max_error > self.max_error_deg:
+            sys.exit(1)
+
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        '--tz',
+        help='timezone for the check (default: America/New_York)',
+        type=str,
+        default='America/New_York',
+    )
+    argparser.add_argument(
+        '--latitude',
+        help='latitude (default: 40)',
+        type=float,
+        default=40.0,
+    )
+    argparser.add_argument(
+        '--longitude',
+        help='longitude (default: -75)',
+        type=float,
+        default=-75.0,
+    )
+    argparser.add_argument(
+        '--hours',
+        help='hours to check (default: 48)',
+        type=int,
+        default=48,
+    )
+
+    args = argparser.parse_args()
+
+    os.environ['TZ'] = args.tz
+    time.tzset()
+
+    ec = EphemerisCheck()
+    ec.main(args.latitude, args.longitude, args.hours)
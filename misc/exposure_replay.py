@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+#
+# Replays recorded frames from the image table through the exposure
+# controllers and reports how quickly each one converges
+#
+
+import sys
+import argparse
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from pathlib import Path
+from multiprocessing import Value
+import logging
+
+from sqlalchemy.orm.exc import NoResultFound
+
+
+sys.path.append(str(Path(__file__).parent.absolute().parent))
+
+import indi_allsky
+from indi_allsky.config import IndiAllSkyConfig
+from indi_allsky.ephemeris import IndiAllSkyEphemeris
+from indi_allsky.exposure import IndiAllSkyExposureProportional
+from indi_allsky.exposure import IndiAllSkyExposurePredictive
+
+# setup flask context for db access
+app = indi_allsky.flask.create_app()
+app.app_context().push()
+
+from indi_allsky.flask.models import IndiAllSkyDbCameraTable
+from indi_allsky.flask.models import IndiAllSkyDbImageTable
+
+
+logger = logging.getLogger('indi_allsky')
+
+LOG_FORMATTER_STREAM = logging.Formatter('[%(levelname)s]: %(message)s')
+
+LOG_HANDLER_STREAM = logging.StreamHandler()
+LOG_HANDLER_STREAM.setFormatter(LOG_FORMATTER_STREAM)
+
+logger.handlers.clear()  # remove syslog
+logger.addHandler(LOG_HANDLER_STREAM)
+logger.setLevel(logging.ERROR)  # controllers are verbose
+
+
+
+class ExposureReplay(object):
+
+    adu_max = 255.0
+
+
+    def __init__(self):
+        try:
+            self._config_obj = IndiAllSkyConfig()
+        except NoResultFound:
+            print('No config file found, please import a config')
+            sys.exit(1)
+
+        self.config = self._config_obj.config
+
+
+    def main(self, camera_id, hours):
+        if not camera_id:
+            camera = IndiAllSkyDbCameraTable.query\
+                .order_by(IndiAllSkyDbCameraTable.connectDate.desc())\
+                .first()
+
+            if not camera:
+                print('No cameras are recorded in the database')
+                sys.exit(1)
+
+            camera_id = camera.id
+
+
+        start_date = datetime.now() - timedelta(hours=hours)
+
+        image_entries = IndiAllSkyDbImageTable.query\
+            .filter(IndiAllSkyDbImageTable.camera_id == camera_id)\
+            .filter(IndiAllSkyDbImageTable.createDate > start_date)\
+            .order_by(IndiAllSkyDbImageTable.createDate.asc())
+
+
+        frames = list()
+        for entry in image_entries:
+            if entry.exposure <= 0:
+                continue
+
+            frames.append({
+                'date'       : entry.createDate,
+                'exposure'   : entry.exposure,
+                'gain'       : entry.gain,
+                'night'      : entry.night,
+                # brightness of the sky as ADU per second, clipped frames underestimate it
+                'brightness' : entry.adu / entry.exposure,
+            })
+
+
+        if len(frames) < 2:
+            print('Not enough frames to replay')
+            sys.exit(1)
+
+
+        print('Replaying {0:d} frames from camera {1:d}'.format(len(frames), camera_id))
+        print()
+
+
+        latitude_v = Value('f', float(self.config['LOCATION_LATITUDE']))
+        longitude_v = Value('f', float(self.config['LOCATION_LONGITUDE']))
+        ephemeris = IndiAllSkyEphemeris(self.config, latitude_v, longitude_v)
+
+        self._addSunAltitude(frames, ephemeris)
+
+
+        print('{0:<14s} {1:>10s} {2:>10s} {3:>10s} {4:>10s} {5:>10s} {6:>10s}'.format(
+            'Controller',
+            'In target',
+            'Episodes',
+            'Avg conv',
+            'Max conv',
+            'Avg over',
+            'Max over',
+        ))
+
+        for name, controller in (
+            ('proportional', IndiAllSkyExposureProportional(self.config)),
+            ('predictive', IndiAllSkyExposurePredictive(self.config)),
+        ):
+            r = self.replay(controller, frames)
+
+            print('{0:<14s} {1:>9.1f}% {2:>10d} {3:>10.1f} {4:>10d} {5:>9.1f}% {6:>9.1f}%'.format(
+                name,
+                r['in_target'] * 100,
+                r['episodes'],
+                r['avg_converge'],
+                r['max_converge'],
+                r['avg_overshoot'] * 100,
+                r['max_overshoot'] * 100,
+            ))
+
+
+        print()
+        print('Avg/Max conv: frames to return to the target range')
+        print('Avg/Max over: ADU beyond the target after crossing it')
+
+
+    def replay(self, controller, frames):
+        exposure = frames[0]['exposure']
+
+        in_target = 0
+        converge_list = list()
+        overshoot_list = list()
+
+        out_count = 0  # frames outside the target in the current episode
+        last_side = 0
+
+        for i, frame in enumerate(frames):
+            # simulated frame using the recorded sky brightness
+            adu = min(max(frame['brightness'] * exposure, 0.1), self.adu_max)
+
+            target_adu, adu_dev = controller._targets(exposure, frame['night'])
+
+            if abs(adu - target_adu) <= adu_dev:
+                in_target += 1
+
+                if out_count:
+                    converge_list.append(out_count)
+                    out_count = 0
+
+                side = 0
+            else:
+                out_count += 1
+
+                if adu > target_adu:
+                    side = 1
+                else:
+                    side = -1
+
+                if last_side and side != last_side:
+                    # crossed the target range
+                    overshoot_list.append(abs(adu - target_adu) / target_adu)
+
+            if side:
+                last_side = side
+
+
+            try:
+                sun_alt_next = frames[i + 1]['sun_alt']
+            except IndexError:
+                sun_alt_next = frame['sun_alt']
+
+            adu_average, new_exposure = controller.update(
+                exposure,
+                frame['gain'],
+                adu,
+                frame['night'],
+                sun_alt=frame['sun_alt'],
+                sun_alt_next=sun_alt_next,
+            )
+
+            if not isinstance(new_exposure, type(None)):
+                exposure = new_exposure
+
+
+        if out_count:
+            # never converged
+            converge_list.append(out_count)
+
+
+        return {
+            'in_target'     : in_target / len(frames),
+            'episodes'      : len(converge_list),
+            'avg_converge'  : sum(converge_list) / len(converge_list) if converge_list else 0.0,
+            'max_converge'  : max(converge_list) if converge_list else 0,
+            'avg_overshoot' : sum(overshoot_list) / len(overshoot_list) if overshoot_list else 0.0,
+            'max_overshoot' : max(overshoot_list) if overshoot_list else 0.0,
+        }
+
+
+    def _addSunAltitude(self, frames, ephemeris):
+        for frame in frames:
+            # createDate is local time
+            utc_date = frame['date'].astimezone(timezone.utc)
+            frame['sun_alt'] = ephemeris.position(utc_date)['sun_alt']
+
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        '--camera_id',
+        '-c',
+        help='camera id (default: newest camera)',
+        type=int,
+        default=0,
+    )
+    argparser.add_argument(
+        '--hours',
+        '-H',
+        help='hours of frames to replay (default: 24)',
+        type=int,
+        default=24,
+    )
+
+    args = argparser.parse_args()
+
+    er = ExposureReplay()
+    er.main(args.camera_id, args.hours)